@@ -167,7 +167,9 @@ class AbstractContract:
         if environment.get('now') is None:
             environment.update({'now': now})
 
-        output = executor.execute(
+        execute = executor.sandbox.execute if executor.production else executor.execute
+
+        output = execute(
             sender=signer,
             contract_name=contract_name,
             function_name=func,
@@ -177,9 +179,6 @@ class AbstractContract:
             metering=metering
         )
 
-        if executor.production:
-            executor.sandbox.terminate()
-
         if output['status_code'] == 1:
             raise output['result'] if not return_full_output else output
         return output['result'] if not return_full_output else output
@@ -0,0 +1,326 @@
+import ast
+
+from functools import lru_cache
+from contracting import constants
+from contracting.storage.driver import CODE_KEY
+
+# The key of an access is a list of parts, one per dimension of a hash. A part is {'arg': name} for an argument of
+# the exported function, {'ctx': attribute} for the context, {'value': constant} for a literal, or None when it
+# cannot be known. A None part covers every key below the parts before it.
+VARIABLE_TYPES = {'Variable', 'ForeignVariable'}
+HASH_TYPES = {'Hash', 'ForeignHash'}
+
+# Before and after compilation
+EXPORT_DECORATORS = {
+    constants.EXPORT_DECORATOR_STRING,
+    constants.PRIVATE_METHOD_PREFIX + constants.EXPORT_DECORATOR_STRING
+}
+
+
+def _orm_declarations(tree, contract):
+    declarations = {}
+
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or not isinstance(node.value, ast.Call):
+            continue
+        if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+            continue
+        if not isinstance(node.value.func, ast.Name):
+            continue
+
+        kind = node.value.func.id
+        if kind not in VARIABLE_TYPES | HASH_TYPES:
+            continue
+
+        keywords = {k.arg: k.value.value for k in node.value.keywords if isinstance(k.value, ast.Constant)}
+        name = node.targets[0].id
+
+        if kind.startswith('Foreign'):
+            owner, variable = keywords.get('foreign_contract'), keywords.get('foreign_name')
+        else:
+            owner = keywords.get('contract', contract)
+            variable = keywords.get('name', name)
+
+        declarations[name] = {'hash': kind in HASH_TYPES, 'contract': owner, 'name': variable}
+
+    return declarations
+
+
+def _is_exported(node):
+    for decorator in node.decorator_list:
+        if isinstance(decorator, ast.Call):
+            decorator = decorator.func
+        if isinstance(decorator, ast.Name) and decorator.id in EXPORT_DECORATORS:
+            return True
+    return False
+
+
+class FunctionAccess(ast.NodeVisitor):
+    """
+    Collects the ORM reads and writes and the calls made directly by one function. An ORM object that is used in
+    any other way, e.g. aliased or passed to a function, may be read and written anywhere, so the whole of it is
+    reported as read and written.
+    """
+
+    def __init__(self, node, orm, functions, imports):
+        self.orm = orm
+        self.functions = functions
+        self.imports = imports
+
+        self.reads = []
+        self.writes = []
+        self.calls = []
+        # (function name, {argument: part}) of calls to functions of the same contract
+        self.local_calls = []
+
+        stores = {}
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                stores[child.id] = stores.get(child.id, 0) + 1
+
+        self.args = {a.arg for a in node.args.args if a.arg not in stores}
+
+        # Names assigned once from something with a known part
+        self.aliases = {}
+        for child in ast.walk(node):
+            if isinstance(child, ast.Assign) and len(child.targets) == 1 and isinstance(child.targets[0], ast.Name):
+                name = child.targets[0].id
+                if stores.get(name) == 1:
+                    self.aliases[name] = child.value
+
+        for statement in node.body:
+            self.visit(statement)
+
+    def part(self, node, seen=()):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, bool)):
+            return {'value': node.value}
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'ctx':
+            return {'ctx': node.attr}
+        if isinstance(node, ast.Name):
+            if node.id in self.args:
+                return {'arg': node.id}
+            if node.id in self.aliases and node.id not in seen:
+                return self.part(self.aliases[node.id], seen + (node.id,))
+        return None
+
+    def parts(self, node):
+        if isinstance(node, ast.Tuple):
+            return [self.part(element) for element in node.elts]
+        return [self.part(node)]
+
+    def access(self, declaration, key):
+        return {'contract': declaration['contract'], 'name': declaration['name'], 'key': key}
+
+    def escape(self, declaration):
+        access = self.access(declaration, [None] if declaration['hash'] else [])
+        self.reads.append(access)
+        self.writes.append(access)
+
+    def visit_Name(self, node):
+        # Uses of ORM objects that are understood do not visit their name
+        declaration = self.orm.get(node.id)
+        if declaration is not None:
+            self.escape(declaration)
+
+    def visit_Subscript(self, node):
+        declaration = self.orm.get(node.value.id) if isinstance(node.value, ast.Name) else None
+
+        if declaration is None or not declaration['hash']:
+            self.generic_visit(node)
+            return
+
+        access = self.access(declaration, self.parts(node.slice))
+        if isinstance(node.ctx, ast.Load):
+            self.reads.append(access)
+        else:
+            self.writes.append(access)
+
+        self.visit(node.slice)
+
+    def visit_Compare(self, node):
+        # key in hash
+        for op, comparator in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)) and isinstance(comparator, ast.Name):
+                declaration = self.orm.get(comparator.id)
+                if declaration is not None and declaration['hash']:
+                    self.reads.append(self.access(declaration, self.parts(node.left)))
+                    continue
+            self.visit(comparator)
+
+        self.visit(node.left)
+
+    def visit_AugAssign(self, node):
+        target = node.target
+        if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name) and target.value.id in self.orm:
+            declaration = self.orm[target.value.id]
+            if declaration['hash']:
+                self.reads.append(self.access(declaration, self.parts(target.slice)))
+
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            owner, method = func.value.id, func.attr
+            declaration = self.orm.get(owner)
+
+            if declaration is not None and not declaration['hash'] and method in ('get', 'set'):
+                if method == 'get':
+                    self.reads.append(self.access(declaration, []))
+                else:
+                    self.writes.append(self.access(declaration, []))
+                self.visit_call_arguments(node)
+                return
+
+            elif declaration is not None and declaration['hash'] and method in ('all', 'get_many', 'clear'):
+                prefix = [self.part(arg) for arg in node.args] + [None]
+                if method in ('all', 'get_many'):
+                    self.reads.append(self.access(declaration, prefix if method == 'all' else [None]))
+                else:
+                    self.reads.append(self.access(declaration, prefix))
+                    self.writes.append(self.access(declaration, prefix))
+                self.visit_call_arguments(node)
+                return
+
+            elif owner == 'importlib' and method == 'import_module':
+                # The contract is only known when the transaction runs
+                self.calls.append({'contract': None, 'function': None})
+
+            elif owner in self.imports:
+                self.calls.append({'contract': owner, 'function': method})
+
+        elif isinstance(func, ast.Name) and func.id in self.functions:
+            params = self.functions[func.id]
+            mapping = {param: self.part(arg) for param, arg in zip(params, node.args)}
+            for keyword in node.keywords:
+                if keyword.arg in params:
+                    mapping[keyword.arg] = self.part(keyword.value)
+            self.local_calls.append((func.id, mapping))
+
+        self.generic_visit(node)
+
+    def visit_call_arguments(self, node):
+        for arg in node.args:
+            self.visit(arg)
+        for keyword in node.keywords:
+            self.visit(keyword.value)
+
+
+def _substitute(access, mapping):
+    key = []
+    for part in access['key']:
+        if part is not None and 'arg' in part:
+            part = mapping.get(part['arg'])
+        key.append(part)
+    return {**access, 'key': key}
+
+
+def _unique(accesses):
+    unique = []
+    for access in accesses:
+        if access not in unique:
+            unique.append(access)
+    return unique
+
+
+def _effects(name, local, mapping, stack):
+    function = local[name]
+    reads = [_substitute(a, mapping) for a in function.reads]
+    writes = [_substitute(a, mapping) for a in function.writes]
+    calls = list(function.calls)
+
+    for callee, callee_mapping in function.local_calls:
+        if callee in stack:
+            continue
+        # Arguments of the callee resolve to parts of this function, which resolve through the mapping of the caller
+        resolved = {}
+        for param, part in callee_mapping.items():
+            if part is not None and 'arg' in part:
+                part = mapping.get(part['arg'])
+            resolved[param] = part
+
+        callee_reads, callee_writes, callee_calls = _effects(callee, local, resolved, stack + (callee,))
+        reads += callee_reads
+        writes += callee_writes
+        calls += callee_calls
+
+    return reads, writes, calls
+
+
+@lru_cache(maxsize=1024)
+def analyze(code: str, contract: str = None):
+    """
+    Predict the state each exported function of a contract may read and write. Works on the code stored for a
+    contract as well as on source that was not compiled yet, in which case the contract name has to be given.
+
+    Returns {function: {'reads': [...], 'writes': [...], 'calls': [...]}} where reads and writes are accesses
+    {'contract', 'name', 'key'} and calls are the functions of other contracts it calls, {'contract', 'function'},
+    with None where the contract or function is only known at run time. Effects of other contracts are not
+    included. Results are cached by code, so they must not be changed.
+    """
+    tree = ast.parse(code)
+
+    orm = _orm_declarations(tree, contract)
+    imports = {alias.name for node in tree.body if isinstance(node, ast.Import) for alias in node.names}
+
+    definitions = [node for node in tree.body if isinstance(node, ast.FunctionDef)]
+    functions = {node.name: [a.arg for a in node.args.args] for node in definitions}
+
+    local = {node.name: FunctionAccess(node, orm, functions, imports) for node in definitions}
+
+    analysis = {}
+    for node in definitions:
+        if not _is_exported(node):
+            continue
+
+        identity = {arg: {'arg': arg} for arg in functions[node.name]}
+        reads, writes, calls = _effects(node.name, local, identity, (node.name,))
+
+        analysis[node.name] = {
+            'reads': _unique(reads),
+            'writes': _unique(writes),
+            'calls': _unique(calls),
+        }
+
+    return analysis
+
+
+def resolve_key(access, kwargs, ctx):
+    """
+    Turn an access into a state key for a call with the given arguments and context. Returns (key, exact). When part
+    of the key is not known the key is a prefix of every key the access may touch, and exact is False.
+    """
+    key = f"{access['contract']}{constants.INDEX_SEPARATOR}{access['name']}"
+
+    parts = []
+    for part in access['key']:
+        if part is None:
+            value = None
+        elif 'arg' in part:
+            value = kwargs.get(part['arg'])
+        elif 'ctx' in part:
+            value = ctx.get(part['ctx'])
+        else:
+            value = part['value']
+
+        if value is None:
+            return key + constants.DELIMITER + ''.join(p + constants.DELIMITER for p in parts), False
+
+        parts.append(str(value))
+
+    if parts:
+        key += constants.DELIMITER + constants.DELIMITER.join(parts)
+
+    return key, True
+
+
+def analyze_contract(driver, name):
+    """
+    Analyze a submitted contract, or return None if there is none by that name. The code is read without recording
+    it as a read of the current transaction.
+    """
+    code = driver.get(driver.make_key(name, CODE_KEY), save=False)
+    if code is None:
+        return None
+    return analyze(code, name)
@@ -3,6 +3,7 @@ import astor
 
 from contracting import constants
 from contracting.compilation.linter import Linter
+from contracting.compilation import metering
 
 
 class ContractingCompiler(ast.NodeTransformer):
@@ -63,6 +64,16 @@ class ContractingCompiler(ast.NodeTransformer):
         code = astor.to_source(tree)
         return code
 
+    def compile_metered(self, source: str, lint=True):
+        """
+        Compile the code a contract is stored as so that it charges the stamps tracing it would, without being
+        traced. Returns None if it cannot be, in which case the contract has to be traced.
+        """
+        instrumented = metering.instrument(self.parse_to_code(source, lint=lint))
+        if instrumented is None:
+            return None
+        return instrumented[1]
+
     def visit_FunctionDef(self, node):
 
         # Presumes all decorators are valid, as caught by linter.
@@ -0,0 +1,459 @@
+import ast
+import dis
+import sys
+
+from functools import lru_cache
+from types import CodeType
+from contracting.execution.tracer import cost_table, meter, meter_decorator, meter_frame, meter_loop, METERED
+
+# Names instrumented code charges stamps through. Names in contracts cannot start with an underscore, so these can
+# neither clash with a contract name nor be reached from contract code.
+METER = '___meter'
+METER_LOOP = '___meter_loop'
+METER_DECORATOR = '___meter_decorator'
+METER_FRAME = '___meter_frame'
+
+# What instrumented code needs in its globals
+SCOPE = {METER: meter, METER_LOOP: meter_loop, METER_DECORATOR: meter_decorator, METER_FRAME: meter_frame}
+
+# Where line events fall is worked out from the bytecode of the contract, which is only modelled for this version
+INSTRUMENTABLE = sys.version_info[:2] == (3, 11)
+
+JUMPS = set(dis.hasjrel) | set(dis.hasjabs)
+NO_FALLTHROUGH = {
+    'JUMP_FORWARD', 'JUMP_BACKWARD', 'JUMP_BACKWARD_NO_INTERRUPT', 'RETURN_VALUE', 'RAISE_VARARGS', 'RERAISE'
+}
+
+# Code objects with a scope of their own. Contracts can only define functions and list comprehensions.
+SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef, ast.ListComp, ast.SetComp, ast.DictComp,
+          ast.GeneratorExp)
+
+
+class Uninstrumentable(Exception):
+    pass
+
+
+def _start(node):
+    if isinstance(node, ast.FunctionDef) and node.decorator_list:
+        # Decorators run before the function is made
+        first = node.decorator_list[0]
+        return first.lineno, first.col_offset
+    return node.lineno, node.col_offset
+
+
+def _contains(node, position):
+    if None in position:
+        return False
+    lineno, end_lineno, col_offset, end_col_offset = position
+    return _start(node) <= (lineno, col_offset) and (end_lineno, end_col_offset) <= (node.end_lineno,
+                                                                                       node.end_col_offset)
+
+
+def _wrappable(node, parent):
+    if not isinstance(node, ast.expr) or isinstance(node, (ast.Slice, ast.Starred)):
+        return False
+    if not isinstance(getattr(node, 'ctx', ast.Load()), ast.Load) or isinstance(parent, ast.JoinedStr):
+        return False
+    # A tuple of slices is only valid as the slice of a subscript
+    return not (isinstance(node, ast.Tuple) and any(isinstance(element, ast.Slice) for element in node.elts))
+
+
+class Scope:
+    """
+    The nodes evaluated by one code object: the body of the module or of a function, or a list comprehension.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        # Node to (parent, depth)
+        self.nodes = {}
+        self.nested = []
+
+        if isinstance(root, ast.Module):
+            self.visit_all(root.body, root, 0)
+        elif isinstance(root, ast.FunctionDef):
+            self.visit_all(root.body, root, 0)
+        elif isinstance(root, ast.ListComp):
+            self.visit(root.elt, root, 0)
+            for i, generator in enumerate(root.generators):
+                if i > 0:
+                    self.visit(generator.iter, root, 0)
+                self.visit(generator.target, root, 0)
+                self.visit_all(generator.ifs, root, 0)
+        else:
+            raise Uninstrumentable(type(root).__name__)
+
+    def visit_all(self, nodes, parent, depth):
+        for node in nodes:
+            self.visit(node, parent, depth)
+
+    def visit(self, node, parent, depth):
+        if node is None:
+            return
+
+        if isinstance(node, (ast.expr, ast.stmt)):
+            self.nodes[node] = (parent, depth)
+
+        if isinstance(node, SCOPES):
+            self.nested.append(node)
+            if isinstance(node, ast.FunctionDef):
+                self.visit_all(node.decorator_list, node, depth + 1)
+                self.visit_arguments(node.args, node, depth + 1)
+                self.visit(node.returns, node, depth + 1)
+            elif isinstance(node, ast.ListComp):
+                self.visit(node.generators[0].iter, node, depth + 1)
+            else:
+                raise Uninstrumentable(type(node).__name__)
+            return
+
+        for child in ast.iter_child_nodes(node):
+            self.visit(child, node, depth + 1)
+
+    def visit_arguments(self, args, parent, depth):
+        self.visit_all(args.defaults, parent, depth)
+        self.visit_all([default for default in args.kw_defaults if default is not None], parent, depth)
+        for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]:
+            if arg is not None:
+                self.visit(arg.annotation, parent, depth)
+
+
+class Placement:
+    """
+    Finds where the instrumented code has to charge the line events the tracer would charge for a code object. The
+    tracer charges a line event when an instruction starts a line other than the one of the instruction run before
+    it, when a jump goes backwards, and at the first instruction of a frame. Every edge between two instructions on
+    which that happens is covered by exactly one charge:
+
+    - before a node is evaluated, for events at the first instruction of the node,
+    - after a node is evaluated, for events at the instruction that follows it,
+    - by the iterator of a loop, for events at the instruction that gets the next value,
+    - around a decorator, for events at the call applying it and at the instruction after that call.
+
+    Raises Uninstrumentable if an event cannot be covered that way.
+    """
+
+    def __init__(self, code, scope, probes):
+        self.code = code
+        self.scope = scope
+        self.probes = probes
+        self.costs = cost_table(code)
+
+        self.instructions = list(dis.get_instructions(code))
+        index = {instruction.offset: i for i, instruction in enumerate(self.instructions)}
+
+        self.incoming = [set() for _ in self.instructions]
+        self.targets = [set() for _ in self.instructions]
+        for i, instruction in enumerate(self.instructions):
+            if instruction.opcode in JUMPS:
+                self.targets[i].add(index[instruction.argval])
+            if instruction.opname not in NO_FALLTHROUGH and i + 1 < len(self.instructions):
+                self.targets[i].add(i + 1)
+            for target in self.targets[i]:
+                self.incoming[target].add(i)
+
+        self.events = {(source, target) for target, sources in enumerate(self.incoming) for source in sources
+                       if self.is_event(source, target)}
+        self.covered = set()
+
+        self.runs = {}
+        for node in scope.nodes:
+            inside = [i for i, instruction in enumerate(self.instructions) if _contains(node, instruction.positions)]
+            runs = []
+            for i in inside:
+                if runs and runs[-1][-1] == i - 1:
+                    runs[-1].append(i)
+                else:
+                    runs.append([i])
+            if runs:
+                self.runs[node] = runs
+
+        # Innermost nodes first
+        self.ordered = sorted(self.runs, key=lambda node: -scope.nodes[node][1])
+
+    def is_event(self, source, target):
+        instruction = self.instructions[target]
+        line = instruction.positions.lineno
+        if line is None or instruction.opname == 'RESUME':
+            return False
+        if self.instructions[source].opname == 'RESUME':
+            return True
+        return line != self.instructions[source].positions.lineno or target < source
+
+    def cost(self, i):
+        return self.costs[self.instructions[i].offset // 2]
+
+    def evaluations(self, node):
+        """
+        The runs of instructions that evaluate a node. A node can be compiled more than once, like the condition of a
+        while loop. Other runs are instructions of an enclosing node placed at the position of this one.
+        """
+        runs = self.runs[node]
+        names = [self.instructions[i].opname for i in runs[0]]
+        return [run for run in runs if [self.instructions[i].opname for i in run] == names]
+
+    def take(self, edges):
+        """
+        Cover the edges if they are all uncovered events.
+        """
+        if not edges or not edges <= self.events or edges & self.covered:
+            return False
+        self.covered |= edges
+        return True
+
+    def place(self):
+        if isinstance(self.scope.root, ast.ListComp):
+            starting = {(source, target) for target, sources in enumerate(self.incoming) for source in sources
+                        if self.instructions[source].opname == 'RESUME'}
+            for target, instruction in enumerate(self.instructions):
+                if instruction.opname == 'FOR_ITER':
+                    if not self.place_loop(target, starting):
+                        raise Uninstrumentable('No place to charge the line events of a comprehension')
+                    starting = frozenset()
+
+        for function in self.scope.nested:
+            if isinstance(function, ast.FunctionDef):
+                for decorator in function.decorator_list:
+                    self.place_decorator(decorator)
+
+        for target, sources in enumerate(self.incoming):
+            events = {(source, target) for source in sources} & self.events
+            if not events or events <= self.covered:
+                continue
+
+            if self.instructions[target].opname == 'FOR_ITER':
+                placed = self.place_loop(target)
+            else:
+                placed = self.place_before(target) or self.place_after(target)
+
+            if not placed:
+                raise Uninstrumentable(f'No place to charge the line event at {self.instructions[target].offset}')
+
+        assert self.covered == self.events
+
+    def place_before(self, target):
+        for node in self.ordered:
+            parent, _ = self.scope.nodes[node]
+            if not isinstance(node, ast.stmt) and not _wrappable(node, parent):
+                continue
+
+            firsts = [run[0] for run in self.evaluations(node)]
+            if target not in firsts or len({self.cost(i) for i in firsts}) != 1:
+                continue
+
+            if self.take({(source, first) for first in firsts for source in self.incoming[first]}):
+                self.probes.before[node] = self.cost(target)
+                return True
+        return False
+
+    def place_after(self, target):
+        last = target - 1
+        if self.instructions[last].opcode in JUMPS or self.instructions[last].opname in NO_FALLTHROUGH:
+            return False
+
+        for node in self.ordered:
+            parent, _ = self.scope.nodes[node]
+            if not isinstance(node, ast.stmt) and not _wrappable(node, parent):
+                continue
+
+            runs = self.evaluations(node)
+            if last not in [run[-1] for run in runs]:
+                continue
+
+            edges, costs = set(), set()
+            for run in runs:
+                following = run[-1] + 1
+                # The node has to be left for the instruction after it, whatever way it is evaluated
+                if any(not self.targets[i] <= set(run) | {following} for i in run):
+                    break
+                edges |= {(source, following) for source in self.incoming[following] if source in run}
+                costs.add(self.cost(following))
+            else:
+                if len(costs) == 1 and self.take(edges):
+                    self.probes.after[node] = costs.pop()
+                    return True
+        return False
+
+    def place_loop(self, target, starting=frozenset()):
+        """
+        Charge the events at the instruction getting the next value of a loop from its iterator. Events on the
+        starting edges are charged before the first value too: the frame of a list comprehension starts right
+        before its first loop gets a value.
+        """
+        position = self.instructions[target].positions
+
+        if isinstance(self.scope.root, ast.ListComp):
+            loops = [i for i, instruction in enumerate(self.instructions) if instruction.opname == 'FOR_ITER']
+            if len(loops) != len(self.scope.root.generators):
+                return False
+            iterable = self.scope.root.generators[loops.index(target)].iter
+        else:
+            loops = [node for node in self.runs if isinstance(node, ast.For) and _span(node) == _span(position)]
+            if len(loops) != 1:
+                return False
+            iterable = loops[0].iter
+
+        # The first value is got right after the iterator is, then each one after a jump back
+        entry = {(source, target) for source in self.incoming[target] if source < target}
+        back = {(source, target) for source in self.incoming[target] if source > target}
+        if not back or not back <= self.events or (back | entry | starting) & self.covered:
+            return False
+        if entry & self.events and entry - self.events:
+            return False
+
+        first = [self.cost(edge[1]) for edge in sorted(starting & self.events)]
+        if entry & self.events:
+            first.append(self.cost(target))
+
+        self.covered |= (starting & self.events) | (entry & self.events) | back
+        self.probes.loops[iterable] = (tuple(first), self.cost(target))
+        return True
+
+    def place_decorator(self, decorator):
+        runs = self.runs.get(decorator, [])
+        evaluations = self.evaluations(decorator) if runs else []
+        applications = [run for run in runs if run not in evaluations]
+        if len(applications) != 1:
+            return
+
+        call = applications[0]
+        entering = {(source, call[0]) for source in self.incoming[call[0]]}
+        leaving = {(call[-1], call[-1] + 1)} if call[-1] + 1 < len(self.instructions) else set()
+
+        before = self.cost(call[0]) if self.take(entering) else 0
+        after = self.cost(call[-1] + 1) if self.take(leaving) else 0
+        if before or after:
+            self.probes.decorators[decorator] = (before, after)
+
+
+def _span(node):
+    if isinstance(node, ast.AST):
+        return node.lineno, node.end_lineno, node.col_offset, node.end_col_offset
+    return tuple(node)
+
+
+class Probes(ast.NodeTransformer):
+    """
+    Adds the charges found by Placement to the tree the code was compiled from.
+    """
+
+    def __init__(self):
+        self.before = {}
+        self.after = {}
+        self.loops = {}
+        self.decorators = {}
+
+    def charge(self, cost, node, value=None):
+        args = [ast.Constant(cost)] + ([value] if value is not None else [])
+        return ast.copy_location(ast.Call(func=ast.Name(METER, ast.Load()), args=args, keywords=[]), node)
+
+    def call(self, name, node, *args):
+        return ast.copy_location(ast.Call(func=ast.Name(name, ast.Load()), args=list(args), keywords=[]), node)
+
+    def visit(self, node):
+        original = node
+        node = super().visit(node)
+
+        if isinstance(original, ast.stmt):
+            statements = [node]
+            if original in self.before:
+                statements.insert(0, ast.copy_location(ast.Expr(self.charge(self.before[original], original)),
+                                                       original))
+            if original in self.after:
+                statements.append(ast.copy_location(ast.Expr(self.charge(self.after[original], original)), original))
+            return statements if len(statements) > 1 else node
+
+        if original in self.before:
+            node = ast.copy_location(ast.BoolOp(ast.Or(), [self.charge(self.before[original], original), node]),
+                                     original)
+        if original in self.after:
+            node = self.charge(self.after[original], original, node)
+        if original in self.loops:
+            first, cost = self.loops[original]
+            node = self.call(METER_LOOP, original, ast.Constant(first), ast.Constant(cost), node)
+        if original in self.decorators:
+            before, after = self.decorators[original]
+            node = self.call(METER_DECORATOR, original, ast.Constant(before), node, ast.Constant(after))
+        return node
+
+    def visit_FunctionDef(self, node):
+        original = node.body
+        self.generic_visit(node)
+        node.body = self.frame(node.body, original)
+        return node
+
+    def visit_Module(self, node):
+        original = node.body
+        self.generic_visit(node)
+        node.body = self.frame(node.body, original)
+        return node
+
+    def frame(self, body, original):
+        """
+        Measure memory when the frame starts and when it ends, like the tracer does on calls and returns.
+        """
+        docstring = []
+        if original and isinstance(original[0], ast.Expr) and isinstance(original[0].value, ast.Constant) and \
+                isinstance(original[0].value.value, str):
+            docstring, body = body[:1], body[1:]
+
+        anchor = original[0] if original else ast.Pass(lineno=1, col_offset=0, end_lineno=1, end_col_offset=0)
+        guarded = ast.copy_location(ast.Try(body=body or [ast.copy_location(ast.Pass(), anchor)], handlers=[],
+                                            orelse=[], finalbody=[self.sample(anchor)]), anchor)
+        return docstring + [self.sample(anchor), guarded]
+
+    def sample(self, anchor):
+        return ast.copy_location(ast.Expr(self.call(METER_FRAME, anchor)), anchor)
+
+
+def _code_objects(code):
+    return [const for const in code.co_consts if isinstance(const, CodeType)]
+
+
+def _place(code, scope, probes):
+    if code.co_exceptiontable:
+        raise Uninstrumentable('Exception handling is not modelled')
+
+    Placement(code, scope, probes).place()
+
+    nested = _code_objects(code)
+    if len(nested) != len(scope.nested):
+        raise Uninstrumentable('Code objects do not match the tree')
+
+    for node in scope.nested:
+        matches = [const for const in nested if const.co_firstlineno == _start(node)[0] and
+                   const.co_name == (node.name if isinstance(node, ast.FunctionDef) else '<listcomp>')]
+        if len(matches) != 1:
+            raise Uninstrumentable('Code objects do not match the tree')
+        _place(matches[0], Scope(node), probes)
+
+
+def _register(code):
+    METERED[id(code)] = code
+    for const in _code_objects(code):
+        _register(const)
+
+
+@lru_cache(maxsize=1024)
+def instrument(source: str):
+    """
+    Compile contract code so that it charges its own stamps. Returns the code the tracer would meter and code that
+    charges exactly the stamps the tracer would charge for it, with the same line events counted, without being
+    traced. Returns None if the code cannot be instrumented and has to be traced.
+    """
+    if not INSTRUMENTABLE:
+        return None
+
+    tree = ast.parse(source)
+    reference = compile(tree, '', 'exec')
+
+    probes = Probes()
+    try:
+        _place(reference, Scope(tree), probes)
+    except Uninstrumentable:
+        return None
+
+    tree = ast.fix_missing_locations(probes.visit(tree))
+    instrumented = compile(tree, '', 'exec')
+    _register(instrumented)
+
+    return reference, instrumented
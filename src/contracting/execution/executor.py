@@ -1,20 +1,27 @@
 from contracting.execution import runtime
 from contracting.storage.driver import Driver
-from contracting.execution.module import install_database_loader, uninstall_builtins, enable_restricted_imports, disable_restricted_imports
+from contracting.execution.tracer import COUNT_ALL_LINES, CALL_COUNT_RULES
+from contracting.execution.module import install_database_loader, uninstall_builtins, enable_restricted_imports, disable_restricted_imports, import_contract, ModuleResidency
 from contracting.stdlib.bridge.decimal import ContractingDecimal, CONTEXT
-from contracting.stdlib.bridge.random import Seeded
 from contracting import constants
-from copy import deepcopy
 
-import importlib
 import decimal
 
 
 class Executor:
+    """
+    Executes transactions on a driver. Each thread executes with a runtime of its own, so stamp estimates and read
+    only calls can run next to a block. Metered transactions still run one at a time across threads: memory is metered
+    with tracemalloc, which measures the whole process, so a metered transaction waits while one in another thread is
+    running (see contracting.execution.tracer). Transactions executed with metering=False do not wait.
+    """
+
     def __init__(self,
                  production=False,
                  driver=None,
                  metering=True,
+                 instrumented=False,
+                 call_count_rule=COUNT_ALL_LINES,
                  currency_contract='currency',
                  balances_hash='balances',
                  bypass_privates=False,
@@ -22,12 +29,24 @@ class Executor:
                  bypass_cache=False):
 
         self.metering = metering
+        # Load contracts compiled to charge their own stamps instead of tracing them, where they can be
+        self.instrumented = instrumented
+        # Which lines the infinite loop guard counts, see contracting.execution.tracer. It decides which transactions
+        # fail, so it has to be the same on every node.
+        assert call_count_rule in CALL_COUNT_RULES, f'Unknown call count rule {call_count_rule}.'
+        self.call_count_rule = call_count_rule
         self.driver = driver
 
         if not self.driver:
             self.driver = Driver(bypass_cache=bypass_cache)
         self.production = production
 
+        # Production executes transactions in worker processes. Imported here because the workers run an executor.
+        self.sandbox = None
+        if production:
+            from contracting.execution.sandbox import Sandbox
+            self.sandbox = Sandbox(self)
+
         self.currency_contract = currency_contract
         self.balances_hash = balances_hash
 
@@ -36,10 +55,63 @@ class Executor:
 
         runtime.rt.env.update({'__Driver': self.driver})
 
+        # Contract modules stay loaded between transactions
+        self.keep_modules()
+
+    @staticmethod
+    def keep_modules():
+        # Each execution context keeps its own, as the modules are bound to the transaction executing
+        if runtime.rt.residency is None:
+            runtime.rt.residency = ModuleResidency()
+
+    def balances_key(self, sender):
+        return (f'{self.currency_contract}'
+                f'{constants.INDEX_SEPARATOR}'
+                f'{self.balances_hash}'
+                f'{constants.DELIMITER}'
+                f'{sender}')
+
+    @staticmethod
+    def deduct_stamps(driver, balances_key, stamps_used, stamp_cost):
+        """
+        Charge the stamps used to the balance at balances_key and return the write.
+        """
+        to_deduct = stamps_used
+        to_deduct /= stamp_cost
+        to_deduct = ContractingDecimal(to_deduct)
+
+        balance = driver.get(balances_key)
+        if balance is None:
+            balance = 0
+
+        balance = max(balance - to_deduct, 0)
+
+        driver.set(balances_key, balance)
+        return {balances_key: balance}
+
     def wipe_modules(self):
         uninstall_builtins()
         install_database_loader()
 
+    def execute_batch(self, txs, environment={}, auto_commit=False, driver=None, metering=None) -> list:
+        """
+        Execute transactions in order and return their outputs, which are the same as calling execute() for each of
+        them.
+
+        Each transaction is a dict of the arguments of execute(): sender, contract_name, function_name, kwargs and
+        optionally stamps and stamp_cost.
+
+        The driver, the contract loader and the module residency are set up once for the batch. Metering and the
+        runtime are still set up and cleaned up for each transaction, as they hold its stamps, memory and modules.
+        """
+        if metering is None:
+            metering = self.metering
+
+        driver = self.set_up(driver)
+
+        return [self.run(**tx, environment=environment, auto_commit=auto_commit, driver=driver,
+                         metering=metering) for tx in txs]
+
     def execute(self, sender, contract_name, function_name, kwargs,
                 environment={},
                 auto_commit=False,
@@ -48,16 +120,19 @@ class Executor:
                 stamp_cost=constants.STAMPS_PER_TAU,
                 metering=None) -> dict:
 
-        current_driver_pending_writes = deepcopy(self.driver.pending_writes)
-        self.driver.clear_transaction_writes()
-        self.driver.clear_events()
-
-        if not self.bypass_privates:
-            assert not function_name.startswith(constants.PRIVATE_METHOD_PREFIX), 'Private method not callable.'
-
         if metering is None:
             metering = self.metering
 
+        driver = self.set_up(driver)
+
+        return self.run(sender, contract_name, function_name, kwargs, environment=environment,
+                        auto_commit=auto_commit, driver=driver, stamps=stamps, stamp_cost=stamp_cost,
+                        metering=metering)
+
+    def set_up(self, driver=None):
+        """
+        Point the runtime and the contract loader at the driver transactions are executed on and return it.
+        """
         runtime.rt.env.update({'__Driver': self.driver})
 
         if driver:
@@ -66,16 +141,33 @@ class Executor:
             driver = runtime.rt.env.get('__Driver')
 
         install_database_loader(driver=driver)
+        self.keep_modules()
+
+        return driver
+
+    def run(self, sender, contract_name, function_name, kwargs, environment, auto_commit, driver, metering,
+            stamps=constants.DEFAULT_STAMPS,
+            stamp_cost=constants.STAMPS_PER_TAU) -> dict:
+        """
+        Execute a transaction on a driver returned by set_up().
+        """
+        self.driver.clear_transaction_writes()
+        self.driver.clear_events()
+
+        if not self.bypass_privates:
+            assert not function_name.startswith(constants.PRIVATE_METHOD_PREFIX), 'Private method not callable.'
+
+        runtime.rt.instrumented = self.instrumented
+        runtime.rt.call_count_rule = self.call_count_rule
+
+        # Journal the writes of this transaction so they can be undone if it fails
+        savepoint = driver.savepoint()
 
         balances_key = None
 
         try:
             if metering:
-                balances_key = (f'{self.currency_contract}'
-                                f'{constants.INDEX_SEPARATOR}'
-                                f'{self.balances_hash}'
-                                f'{constants.DELIMITER}'
-                                f'{sender}')
+                balances_key = self.balances_key(sender)
 
                 if self.bypass_balance_amount:
                     balance = 9999999
@@ -112,7 +204,9 @@ class Executor:
 
             decimal.setcontext(CONTEXT)
 
-            module = importlib.import_module(contract_name)
+            # Module bodies are contract code too, and import the contracts they use for this transaction
+            enable_restricted_imports()
+            module = import_contract(contract_name)
             func = getattr(module, function_name)
 
             # Add the contract name to the context on a submission call
@@ -123,22 +217,25 @@ class Executor:
                 if type(v) == float:
                     kwargs[k] = ContractingDecimal(str(v))
 
-            enable_restricted_imports()
             runtime.rt.set_up(stmps=stamps * 1000, meter=metering)
             result = func(**kwargs)
-            transaction_writes = deepcopy(driver.transaction_writes)
-            events = deepcopy(driver.log_events)
+            # Shallow copies are enough: values read by later transactions in the block are copied on first use
+            transaction_writes = dict(driver.transaction_writes)
+            events = list(driver.log_events)
             runtime.rt.tracer.stop()
             disable_restricted_imports()
 
             if auto_commit:
                 driver.commit()
 
+            driver.release(savepoint)
+
         except Exception as e:
             result = e
             status_code = 1
             # Revert the writes if the transaction fails
-            driver.pending_writes = current_driver_pending_writes
+            driver.rollback_to(savepoint)
+            driver.release(savepoint)
             transaction_writes = {}
             events = []
             if auto_commit:
@@ -163,23 +260,11 @@ class Executor:
         if metering:
             assert balances_key is not None, 'Balance key was not set properly. Cannot deduct stamps.'
 
-            to_deduct = stamps_used
-            to_deduct /= stamp_cost
-            to_deduct = ContractingDecimal(to_deduct)
-
-            balance = driver.get(balances_key)
-            if balance is None:
-                balance = 0
-
-            balance = max(balance - to_deduct, 0)
-
-            driver.set(balances_key, balance)
-            transaction_writes[balances_key] = balance
+            transaction_writes.update(self.deduct_stamps(driver, balances_key, stamps_used, stamp_cost))
 
             if auto_commit:
                 driver.commit()
 
-        Seeded.s = False
         runtime.rt.clean_up()
         runtime.rt.env.update({'__Driver': driver})
 
@@ -1,13 +1,20 @@
 from importlib.abc import Loader
 from importlib import invalidate_caches, __import__
 from importlib.machinery import ModuleSpec
-from contracting.storage.driver import Driver
+from contracting.storage.driver import Driver, MISSING, CODE_KEY
 from contracting.stdlib import env
 from contracting.execution.runtime import rt
+from contracting.execution.tracer import Tracer, MAX_STAMPS, prepare, metered
+from contracting.compilation import metering
+from contracting.storage import orm
+from types import CodeType, FunctionType, ModuleType
 
+import decimal
+import dis
 import marshal
 import builtins
 import sys
+import threading
 import importlib.util
 
 # This function overrides the __import__ function, which is the builtin function that is called whenever Python runs
@@ -27,20 +34,54 @@ def is_valid_import(name):
 
 def restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
     if globals is not None and globals.get('__contract__') is True:
-        spec = importlib.util.find_spec(name)
-        if spec is None or not isinstance(spec.loader, DatabaseLoader):
+        if level != 0:
             raise ImportError("module {} cannot be imported in a smart contract.".format(name))
+        return import_contract(name)
 
     return __import__(name, globals, locals, fromlist, level)
 
 
+def import_contract(name):
+    """
+    Import a contract module for the transaction being executed. Contract modules are not put in sys.modules: each
+    execution context imports its own, so that transactions executed in different threads do not share them.
+    """
+    module = rt.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = DatabaseFinder.find_spec(name, None)
+    if spec is None:
+        raise ImportError("module {} cannot be imported in a smart contract.".format(name))
+
+    module = importlib.util.module_from_spec(spec)
+    rt.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        rt.modules.pop(name, None)
+        raise
+
+    return module
+
+
+# Threads executing contracts. The builtin __import__ is shared by all threads, so it stays restricted until none is.
+restricting = set()
+restricting_lock = threading.Lock()
+
+
 def enable_restricted_imports():
-    builtins.__import__ = restricted_import
+    with restricting_lock:
+        restricting.add(threading.get_ident())
+        builtins.__import__ = restricted_import
 #    builtins.float = ContractingDecimal
 
 
 def disable_restricted_imports():
-    builtins.__import__ = __import__
+    with restricting_lock:
+        restricting.discard(threading.get_ident())
+        if not restricting:
+            builtins.__import__ = __import__
 
 
 def uninstall_builtins():
@@ -53,6 +94,7 @@ def uninstall_builtins():
 
 def install_database_loader(driver=Driver()):
     DatabaseFinder.driver = driver
+    rt.driver = driver
     if DatabaseFinder not in sys.meta_path:
         sys.meta_path.insert(0, DatabaseFinder)
 
@@ -73,13 +115,231 @@ def install_system_contracts(directory=''):
 '''
 
 
+class ResidentModule:
+    __slots__ = ("compiled", "instrumented", "scope", "env", "cost", "imports", "bound", "data")
+
+    def __init__(self, compiled, instrumented, scope, env, cost, imports, bound, data):
+        self.compiled = compiled
+        # Whether the module was loaded in instrumented mode, and None if it was but has to be traced
+        self.instrumented = instrumented
+        # Globals of the functions of the module
+        self.scope = scope
+        self.env = env
+        self.cost = cost
+        self.imports = imports
+        # Names the module body reads or assigns, and names of the ORM objects it declares
+        self.bound = bound
+        self.data = data
+
+
+# Instructions a module body can use to read state or change an object it did not create
+STATEFUL_OPS = {
+    'BINARY_SUBSCR', 'STORE_SUBSCR', 'DELETE_SUBSCR', 'BINARY_SLICE', 'STORE_SLICE',
+    'LOAD_ATTR', 'LOAD_METHOD', 'STORE_ATTR', 'DELETE_ATTR', 'IMPORT_FROM', 'IMPORT_STAR'
+}
+
+IMMUTABLE_TYPES = (type(None), bool, int, float, str, bytes, decimal.Decimal)
+
+
+def _immutable(value):
+    if isinstance(value, (tuple, frozenset)):
+        return all(_immutable(v) for v in value)
+    return isinstance(value, IMMUTABLE_TYPES)
+
+
+def _keepable(value):
+    if isinstance(value, (ModuleType, orm.LogEvent)):
+        return True
+    if isinstance(value, orm.Datum):
+        return _immutable(getattr(value, '_default_value', None))
+    if isinstance(value, FunctionType):
+        # Exported functions are wrapped by the export decorator
+        while value is not None:
+            defaults = (value.__defaults__ or ()) + tuple((value.__kwdefaults__ or {}).values())
+            if not _immutable(defaults):
+                return False
+            value = getattr(value, '__wrapped__', None)
+        return True
+    return _immutable(value)
+
+
+def _body(code):
+    """
+    Return the names a module body reads and assigns and the modules it imports, or None if what it leaves behind
+    can depend on state or on anything but the names it reads.
+    """
+    loads, stores, imports = set(), set(), []
+    instructions = list(dis.get_instructions(code))
+
+    for i, instruction in enumerate(instructions):
+        op = instruction.opname
+
+        if op in STATEFUL_OPS:
+            return None
+        if op == 'LOAD_CONST' and isinstance(instruction.argval, CodeType) and instruction.argval.co_name[0] == '<':
+            # Comprehensions and lambdas could run while the body runs
+            return None
+
+        if op in ('LOAD_NAME', 'LOAD_GLOBAL'):
+            if instruction.argval in stores:
+                return None
+            loads.add(instruction.argval)
+        elif op in ('STORE_NAME', 'STORE_GLOBAL', 'DELETE_NAME', 'DELETE_GLOBAL'):
+            stores.add(instruction.argval)
+        elif op == 'IMPORT_NAME':
+            following = instructions[i + 1] if i + 1 < len(instructions) else None
+            alias = following.argval if following is not None and following.opname == 'STORE_NAME' else None
+            imports.append((instruction.argval, alias))
+
+    return loads, stores, imports
+
+
+class ModuleResidency:
+    """
+    Keeps contract modules loaded between transactions. A transaction still imports a kept module as if it was
+    loaded from state: the code is read, the modules it imports are imported and the stamps its body cost to run are
+    charged, but the body is not run again. Instead the runtime environment, the driver of its ORM objects and the
+    signer of its events are bound again for the transaction.
+
+    Only modules whose body declares functions, ORM objects and constants without reading state are kept, so what a
+    kept module holds is what running its body again would create. A module is loaded again if its code changed, or
+    if a name its body reads from the environment has a different value.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.kept = {}
+        self.taken = {}
+        # Stamps of nested imports, per module body being run
+        self.nested = []
+        # Measures bodies run while the transaction is not metered, in case a later one imports them metered
+        self.tracer = Tracer()
+
+    def keep(self, module):
+        if module.__name__ in self.records:
+            self.kept[module.__name__] = module
+
+    def take(self, name, compiled):
+        module = self.kept.pop(name, None)
+        record = self.records.get(name)
+
+        if module is None or record.compiled != compiled or record.instrumented is not None and \
+                record.instrumented != rt.instrumented:
+            return None
+
+        for key in record.bound:
+            before, now = record.env.get(key, MISSING), rt.env.get(key, MISSING)
+            if before is not now and before != now:
+                return None
+
+        self.taken[name] = module
+        return module
+
+    def resume(self, module):
+        """
+        Import a module returned by take() the way running its body would, without running it.
+        """
+        if self.taken.pop(module.__name__, None) is not module:
+            return False
+
+        record = self.records[module.__name__]
+
+        if record.instrumented is None:
+            rt.trace()
+
+        if rt.tracer.is_started():
+            if self.nested:
+                self.nested[-1] += record.cost
+            rt.tracer.add_cost(record.cost)
+
+        scopes = (record.scope, vars(module))
+
+        stale = record.env.keys() - rt.env.keys() - record.bound
+        if stale:
+            defaults = env.gather()
+            for scope in scopes:
+                for key in stale:
+                    if key in defaults:
+                        scope[key] = defaults[key]
+                    else:
+                        scope.pop(key, None)
+
+        rebound = {key: value for key, value in rt.env.items() if key not in record.bound}
+        for scope in scopes:
+            scope.update(rebound)
+
+        driver = rt.env.get('__Driver') or orm.driver
+        for name in record.data:
+            datum = record.scope[name]
+            datum._driver = driver
+            if isinstance(datum, orm.LogEvent):
+                datum._signer = rt.context.signer
+
+        record.env = dict(rt.env)
+
+        for name, alias in record.imports:
+            imported = import_contract(name)
+            if alias is not None:
+                for scope in scopes:
+                    scope[alias] = imported
+
+        return True
+
+    def run(self, name, compiled, code, scope):
+        """
+        Run a module body and record what importing it costs without the modules it imports.
+        """
+        tracer = rt.tracer if rt.tracer.is_started() else self.tracer
+        own = not tracer.is_started()
+        if own:
+            tracer.set_stamp(MAX_STAMPS)
+            tracer.call_count_rule = rt.call_count_rule
+            # Only the stamps of the body are recorded, so it does not wait for memory metered in another thread
+            tracer.start(hooks=not metered(code), memory=False)
+
+        before = tracer.get_stamp_used()
+        self.nested.append(0)
+        try:
+            exec(code, scope)
+        finally:
+            nested = self.nested.pop()
+            if own:
+                tracer.stop()
+
+        cost = tracer.get_stamp_used() - before
+        if self.nested:
+            self.nested[-1] += cost
+
+        self.records.pop(name, None)
+
+        body = _body(code)
+        if body is None:
+            return
+
+        loads, stores, imports = body
+        if not all(_keepable(scope[store]) for store in stores if store in scope):
+            return
+
+        data = [store for store in stores if isinstance(scope.get(store), orm.Datum)]
+        instrumented = rt.instrumented if metered(code) or not rt.instrumented else None
+        self.records[name] = ResidentModule(compiled, instrumented, scope, dict(rt.env), cost - nested, imports,
+                                            loads | stores, data)
+
+    def clear(self):
+        self.records.clear()
+        self.kept.clear()
+        self.taken.clear()
+
+
 class DatabaseFinder:
     driver = Driver()
 
     def find_spec(self, fullname, path=None, target=None):
-        if DatabaseFinder.driver.get_contract(self) is None:
+        # The driver installed last in the execution context, as another thread may have installed its own since
+        driver = rt.driver or DatabaseFinder.driver
+        if driver.get_contract(self) is None:
             return None
-        return ModuleSpec(self, DatabaseLoader(DatabaseFinder.driver))
+        return ModuleSpec(self, DatabaseLoader(driver))
 
 
 MODULE_CACHE = {}
@@ -90,11 +350,17 @@ class DatabaseLoader(Loader):
         self.d = d
 
     def create_module(self, spec):
-        return None
+        if rt.residency is None or spec is None:
+            return None
+        return rt.residency.take(spec.name, self.d.get_compiled(spec.name))
 
     def exec_module(self, module):
+        if rt.residency is not None and rt.residency.resume(module):
+            rt.loaded_modules.append(module.__name__)
+            return
+
         # fetch the individual contract
-        code = self.d.get_compiled(module.__name__)
+        code = compiled = self.d.get_compiled(module.__name__)
         if code is None:
             raise ImportError("Module {} not found".format(module.__name__))
 
@@ -107,12 +373,26 @@ class DatabaseLoader(Loader):
             raise ImportError("Module {} not found".format(module.__name__))
 
         scope = env.gather()
+
+        instrumented = self.instrument(module.__name__, code) if rt.instrumented else None
+        if instrumented is not None:
+            code = instrumented
+            scope.update(metering.SCOPE)
+        else:
+            # Metering charges from the cost tables of the code, which last as long as it does
+            prepare(code)
+            if rt.instrumented:
+                rt.trace()
+
         scope.update(rt.env)
 
         scope.update({'__contract__': True})
 
         # execute the module with the std env and update the module to pass forward
-        exec(code, scope)
+        if rt.residency is None:
+            exec(code, scope)
+        else:
+            rt.residency.run(module.__name__, compiled, code, scope)
 
         # Update the module's attributes with the new scope
         vars(module).update(scope)
@@ -120,5 +400,23 @@ class DatabaseLoader(Loader):
 
         rt.loaded_modules.append(module.__name__)
 
+    def instrument(self, name, code):
+        """
+        Return code of the module that charges its own stamps, or None if it has to be traced. The source of the
+        contract is instrumented, and used only if it compiles to the code stored for it.
+        """
+        source = self.d.get(self.d.make_key(name, CODE_KEY), save=False)
+        if not isinstance(source, str):
+            return None
+
+        try:
+            compiled = metering.instrument(source)
+        except SyntaxError:
+            return None
+
+        if compiled is None or compiled[0] != code:
+            return None
+        return compiled[1]
+
     def module_repr(self, module):
         return '<module {!r} (smart contract)>'.format(module.__name__)
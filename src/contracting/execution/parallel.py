@@ -0,0 +1,283 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from contracting.execution.executor import Executor
+from contracting.execution.module import DatabaseFinder
+from contracting.storage.driver import Driver, MISSING
+from contracting.storage.encoder import encode
+
+import multiprocessing
+import os
+import pickle
+import sys
+
+# Set up in each worker process by _init_worker
+_driver = None
+_executor = None
+# Generation of the pending writes the worker holds, see _sync
+_generation = None
+
+
+class ScanningDriver(Driver):
+    """
+    Records the prefixes a transaction scanned. A scan can be changed by a write to a key the transaction never read,
+    so its read set alone cannot tell if it conflicts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scans = []
+
+    def items(self, prefix=""):
+        self.scans.append(prefix)
+        return super().items(prefix)
+
+
+class Speculation:
+    __slots__ = ("output", "reads", "writes", "scans")
+
+    def __init__(self, output, reads, writes, scans):
+        self.output = output
+        self.reads = reads
+        self.writes = writes
+        self.scans = scans
+
+    def conflicts(self, written):
+        """
+        Return True if a key written before the transaction in the block changes what it read.
+        """
+        if not written.isdisjoint(self.reads):
+            return True
+        return any(key.startswith(prefix) for prefix in self.scans for key in written)
+
+
+def _written(driver):
+    """
+    Return the keys of the innermost savepoint of the driver whose pending value changed. Values written before the
+    savepoint are journaled when they are read too, since they are copied then, so these are compared by value.
+    """
+    written = {}
+    for key, previous in driver.journal[-1].writes.items():
+        current = driver.pending_writes.get(key, MISSING)
+        if current is previous:
+            continue
+        if current is MISSING or previous is MISSING or encode(current) != encode(previous):
+            written[key] = current
+    return written
+
+
+@contextmanager
+def _without_contract_loader():
+    # The pool imports parts of multiprocessing lazily. Through the contract loader those imports would be recorded
+    # as reads of the driver.
+    installed = DatabaseFinder in sys.meta_path
+    if installed:
+        sys.meta_path.remove(DatabaseFinder)
+    try:
+        yield
+    finally:
+        if installed:
+            sys.meta_path.insert(0, DatabaseFinder)
+
+
+def _worker_options(executor):
+    return {
+        'metering': executor.metering,
+        'instrumented': executor.instrumented,
+        'call_count_rule': executor.call_count_rule,
+        'currency_contract': executor.currency_contract,
+        'balances_hash': executor.balances_hash,
+        'bypass_privates': executor.bypass_privates,
+        'bypass_balance_amount': executor.bypass_balance_amount,
+    }
+
+
+def _init_worker(backend, options):
+    global _driver, _executor
+    backend.share()
+    _driver = ScanningDriver(backend=backend)
+    _executor = Executor(driver=_driver, **options)
+
+
+def _start_workers(executor, workers):
+    """
+    Start a pool of worker processes that execute transactions with an executor like the given one, reading the
+    backend of its driver.
+    """
+    # Forked workers would inherit open file handles and locks, so they are started fresh
+    with _without_contract_loader():
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(executor.driver.backend, _worker_options(executor)),
+        )
+
+
+def _checkpoint(driver):
+    """
+    Prepare the workers to read the state of the driver and return the backend versions to send them.
+    """
+    # Workers read the backend, so everything logged has to be on it
+    driver.checkpoint()
+    return driver.backend.versions()
+
+
+def _sync(base):
+    """
+    Bring the pending writes of the worker up to date. base is a tuple of a generation, the generation it follows
+    and the pending writes that changed since then, or None and all of them. Returns False if the worker does not
+    hold the generation a change follows.
+    """
+    global _generation
+    generation, previous, writes = base
+
+    if previous is None:
+        _driver.pending_writes.clear()
+    elif previous != _generation:
+        return False
+
+    _driver.pending_writes.update(writes)
+    _generation = generation
+    return True
+
+
+def _speculate(txs, environment, base, versions):
+    """
+    Execute each transaction on its own on top of the pending writes in base and the backend at versions, and
+    return what it read and wrote along with its output. Returns None if base follows a generation the worker
+    does not hold.
+    """
+    global _generation
+
+    if not _sync(base):
+        return None
+
+    # Only what was written since the last call is read again
+    _driver.backend.refresh(versions)
+
+    results = []
+    try:
+        for index, tx in txs:
+            savepoint = _driver.savepoint()
+            output = _executor.execute(**tx, environment=environment)
+
+            writes = _written(_driver)
+            output['reads'] = None
+            speculation = Speculation(output, dict(_driver.pending_reads), writes, list(_driver.scans))
+
+            # Outputs that cannot be sent back are executed again by the block executor
+            try:
+                pickle.dumps(speculation)
+            except Exception:
+                speculation = None
+
+            results.append((index, speculation))
+
+            # Leaves the pending writes as they were synced, for the next call to build on
+            _driver.rollback_to(savepoint)
+            _driver.release(savepoint)
+            _driver.pending_reads.clear()
+            _driver.pending_encoded.clear()
+            _driver.scans.clear()
+    except BaseException:
+        # The pending writes may not be the synced ones anymore, so the next call has to send them all
+        _generation = None
+        _driver.flush_cache()
+        _driver.scans.clear()
+        raise
+
+    return results
+
+
+class BlockExecutor:
+    """
+    Executes the transactions of a block in worker processes, each against the state at the start of the block, and
+    then applies them in order. A transaction that read a key written by an earlier one in the block is executed
+    again on the updated state, so the outputs and the pending writes are the same as executing the block serially.
+
+    The writes are left pending on the driver of the executor, like execute() without auto_commit.
+    """
+
+    def __init__(self, executor=None, workers=None):
+        self.executor = executor if executor is not None else Executor()
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+
+    def start(self):
+        if self.pool is not None:
+            return
+
+        self.pool = _start_workers(self.executor, self.workers)
+
+    def close(self):
+        if self.pool is not None:
+            with _without_contract_loader():
+                self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def execute(self, txs, environment={}) -> list:
+        """
+        Execute transactions in order and return their outputs. Each transaction is a dict of the arguments of
+        Executor.execute(): sender, contract_name, function_name, kwargs and optionally stamps and stamp_cost.
+        """
+        driver = self.executor.driver
+        assert not driver.journal, 'Cannot execute a block inside a savepoint.'
+
+        txs = list(txs)
+        if len(txs) == 0:
+            return []
+
+        versions = _checkpoint(driver)
+        self.start()
+
+        indexed = list(enumerate(txs))
+        chunks = [indexed[i::self.workers] for i in range(min(self.workers, len(txs)))]
+        base = (None, None, dict(driver.pending_writes))
+
+        speculations = [None] * len(txs)
+        with _without_contract_loader():
+            for results in self.pool.map(_speculate, chunks, repeat(environment), repeat(base), repeat(versions)):
+                for index, speculation in results:
+                    speculations[index] = speculation
+
+        outputs = []
+        written = set()
+        for tx, speculation in zip(txs, speculations):
+            if speculation is None or speculation.conflicts(written):
+                outputs.append(self.reexecute(tx, environment, written))
+            else:
+                outputs.append(self.apply(speculation, written))
+
+        return outputs
+
+    def apply(self, speculation, written):
+        driver = self.executor.driver
+
+        for key, value in speculation.reads.items():
+            if driver.pending_reads.get(key) is None:
+                driver.pending_reads[key] = value
+
+        driver.pending_writes.update(speculation.writes)
+        written.update(speculation.writes)
+
+        output = speculation.output
+        output['reads'] = driver.pending_reads
+        return output
+
+    def reexecute(self, tx, environment, written):
+        driver = self.executor.driver
+
+        savepoint = driver.savepoint()
+        output = self.executor.execute(**tx, environment=environment)
+        written.update(_written(driver))
+        driver.release(savepoint)
+
+        return output
@@ -1,18 +1,57 @@
 from contracting import constants
-from contracting.execution.tracer import Tracer
+from contracting.execution.tracer import Tracer, trace_active, COUNT_ALL_LINES
 
+import contextvars
 import contracting
+import random
 import sys
 import os
 import math
 
 
+class ContextStates:
+    __slots__ = ('state', 'depth', 'base_state')
+
+    def __init__(self, base_state):
+        self.state = []
+        self.depth = []
+        self.base_state = base_state
+
+
 class Context:
+    """
+    The ctx of contract code: who called the contract being run, on top of the state the transaction started with.
+    The states are kept for each execution context, so that transactions executed in different threads each have
+    their own.
+    """
+
     def __init__(self, base_state, maxlen=constants.RECURSION_LIMIT):
-        self._state = []
-        self._depth = []
-        self._base_state = base_state
+        self._default_state = base_state
         self._maxlen = maxlen
+        self._local = contextvars.ContextVar('context')
+
+    def _states(self):
+        states = self._local.get(None)
+        if states is None:
+            states = ContextStates(self._default_state)
+            self._local.set(states)
+        return states
+
+    @property
+    def _state(self):
+        return self._states().state
+
+    @property
+    def _depth(self):
+        return self._states().depth
+
+    @property
+    def _base_state(self):
+        return self._states().base_state
+
+    @_base_state.setter
+    def _base_state(self, base_state):
+        self._states().base_state = base_state
 
     def _context_changed(self, contract):
         if self._get_state()['this'] == contract:
@@ -41,8 +80,9 @@ class Context:
                 self._depth.pop(-1)
 
     def _reset(self):
-        self._state = []
-        self._depth = []
+        states = self._states()
+        states.state = []
+        states.depth = []
 
     @property
     def this(self):
@@ -80,66 +120,179 @@ _context = Context({
 WRITE_MAX = 1024 * 128
 
 
-class Runtime:
+class Execution:
+    """
+    State of the transactions executed in one execution context. Each thread has one of its own, so that transactions
+    can be executed in several threads at once, like stamp estimates or read only calls next to a block. Metered
+    transactions still wait for each other while their memory is metered, see Tracer.
+    """
+
+    def __init__(self):
+        self.env = {}
+        self.stamps = 0
+        self.writes = 0
+        # Tracing is installed for the thread it starts in
+        self.tracer = Tracer()
+        self.signer = None
+        self.instrumented = False
+        self.traced = False
+        # Set by Executor, see contracting.execution.tracer
+        self.call_count_rule = COUNT_ALL_LINES
+        # Contract modules imported by the transaction, by name, and the names of the modules it loaded
+        self.modules = {}
+        self.loaded_modules = []
+        # Driver contract modules are found with
+        self.driver = None
+        # Set by Executor to keep contract modules loaded between transactions
+        self.residency = None
+        # Random state of the random module of contracts, seeded by the transaction
+        self.random = random.Random()
+        self.seeded = False
+
+
+_execution = contextvars.ContextVar('execution')
+
+
+def execution():
+    """
+    Return the Execution of the current context, starting one if there is none.
+    """
+    state = _execution.get(None)
+    if state is None:
+        state = Execution()
+        _execution.set(state)
+    return state
+
+
+class ExecutionState:
+    """
+    An attribute of Runtime kept in the Execution of the current context.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        return getattr(execution(), self.name)
+
+    def __set__(self, instance, value):
+        setattr(execution(), self.name, value)
+
+
+class RuntimeType(type):
+    """
+    Runtime used to keep its state in class attributes. Setting one on the class still sets it for the current
+    execution context, instead of replacing the attribute for every context.
+    """
+
+    def __setattr__(cls, name, value):
+        if isinstance(cls.__dict__.get(name), ExecutionState):
+            setattr(execution(), name, value)
+        else:
+            super().__setattr__(name, value)
+
+
+class runtime_method:
+    """
+    A method of Runtime that can also be called on the class, as it could when the methods were classmethods.
+    Deprecated: call it on rt instead. Either way it works on the runtime of the current execution context.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, instance, owner=None):
+        return self.func.__get__(instance if instance is not None else rt)
+
+
+class Runtime(metaclass=RuntimeType):
     cu_path = contracting.__path__[0]
     cu_path = os.path.join(cu_path, 'execution', 'metering', 'cu_costs.const')
 
     os.environ['CU_COST_FNAME'] = cu_path
 
-    loaded_modules = []
-
-    env = {}
-    stamps = 0
+    modules = ExecutionState()
+    loaded_modules = ExecutionState()
 
-    writes = 0
+    # Set by Executor to keep contract modules loaded between transactions
+    residency = ExecutionState()
 
-    tracer = Tracer()
+    env = ExecutionState()
+    stamps = ExecutionState()
 
-    signer = None
+    writes = ExecutionState()
 
-    context = _context
+    tracer = ExecutionState()
 
-    @classmethod
-    def set_up(cls, stmps, meter):
-        if meter:
-            cls.stamps = stmps
-            cls.tracer.set_stamp(stmps)
-            cls.tracer.start()
+    # Whether the transaction loads contract modules instrumented to charge their own stamps, and whether one of them
+    # could not be, so that contract code has to be traced
+    instrumented = ExecutionState()
+    traced = ExecutionState()
 
-        cls.context._reset()
+    # Which lines the infinite loop guard of the tracer counts
+    call_count_rule = ExecutionState()
 
-    @classmethod
-    def clean_up(cls):
-        cls.tracer.stop()
-        cls.tracer.reset()
-        cls.stamps = 0
-        cls.writes = 0
+    driver = ExecutionState()
 
-        cls.signer = None
+    random = ExecutionState()
+    seeded = ExecutionState()
 
-        for mod in cls.loaded_modules:
-            if sys.modules.get(mod) is not None:
-                del sys.modules[mod]
+    signer = ExecutionState()
 
-        cls.loaded_modules = []
-        cls.env = {}
+    context = _context
 
-    @classmethod
-    def deduct_read(cls, key, value):
-        if cls.tracer.is_started():
+    @runtime_method
+    def set_up(self, stmps, meter):
+        if meter:
+            self.stamps = stmps
+            self.tracer.set_stamp(stmps)
+            self.tracer.call_count_rule = self.call_count_rule
+            self.tracer.start(hooks=not self.instrumented or self.traced)
+
+        self.context._reset()
+
+    @runtime_method
+    def trace(self):
+        self.traced = True
+        trace_active()
+
+    @runtime_method
+    def clean_up(self):
+        self.tracer.stop()
+        self.tracer.reset()
+        self.stamps = 0
+        self.writes = 0
+        self.instrumented = False
+        self.traced = False
+        self.seeded = False
+
+        self.signer = None
+
+        for mod in self.loaded_modules:
+            module = self.modules.pop(mod, None) or sys.modules.pop(mod, None)
+            if module is not None and self.residency is not None:
+                self.residency.keep(module)
+
+        self.modules = {}
+        self.loaded_modules = []
+        self.env = {}
+
+    @runtime_method
+    def deduct_read(self, key, value):
+        if self.tracer.is_started():
             cost = len(key) + len(value)
             cost *= constants.READ_COST_PER_BYTE
-            cls.tracer.add_cost(cost)
+            self.tracer.add_cost(cost)
 
-    @classmethod
-    def deduct_write(cls, key, value):
-        if key is not None and cls.tracer.is_started():
+    @runtime_method
+    def deduct_write(self, key, value):
+        if key is not None and self.tracer.is_started():
             cost = len(key) + len(value)
-            cls.writes += cost
-            assert cls.writes < WRITE_MAX, 'You have exceeded the maximum write capacity per transaction!'
+            self.writes += cost
+            assert self.writes < WRITE_MAX, 'You have exceeded the maximum write capacity per transaction!'
 
             stamp_cost = cost * constants.WRITE_COST_PER_BYTE
-            cls.tracer.add_cost(stamp_cost)
+            self.tracer.add_cost(stamp_cost)
 
 
 rt = Runtime()
@@ -0,0 +1,162 @@
+from concurrent.futures.process import BrokenProcessPool
+from contracting.execution import parallel
+from contracting.storage.driver import MISSING
+from contracting import constants
+
+
+class Sandbox:
+    """
+    Executes transactions in a worker process that is started once and reused. The worker runs a transaction against
+    the state of the driver of the executor and sends back its output and writes, which are left pending on the
+    driver like execute() does. A transaction that takes the worker down does not take down the process executing
+    it, and is retried once on a new worker.
+
+    The sandbox isolates execution, it does not make it faster: transactions are executed one at a time, each one on
+    the state the previous one left, so a single worker is used. BlockExecutor executes the transactions of a block
+    on several cores.
+
+    The worker keeps its open files, caches and pending writes between transactions. Each transaction sends it only
+    the pending writes that changed and the versions of the backend, so it forgets only what was written since.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.pool = None
+        # Pending writes as last sent to the worker, and the generation they were sent as
+        self.synced = {}
+        self.generation = 0
+
+    def start(self):
+        if self.pool is not None:
+            return
+
+        self.pool = parallel._start_workers(self.executor, 1)
+
+    def terminate(self):
+        if self.pool is not None:
+            with parallel._without_contract_loader():
+                self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.terminate()
+
+    def execute(self, sender, contract_name, function_name, kwargs,
+                environment={},
+                auto_commit=False,
+                stamps=constants.DEFAULT_STAMPS,
+                stamp_cost=constants.STAMPS_PER_TAU,
+                metering=None) -> dict:
+
+        driver = self.executor.driver
+        assert not driver.journal, 'Cannot execute in the sandbox inside a savepoint.'
+
+        tx = {
+            'sender': sender,
+            'contract_name': contract_name,
+            'function_name': function_name,
+            'kwargs': kwargs,
+            'stamps': stamps,
+            'stamp_cost': stamp_cost,
+            'metering': metering,
+        }
+
+        versions = parallel._checkpoint(driver)
+
+        try:
+            speculation = self.run(tx, environment, versions)
+        except BrokenProcessPool:
+            self.terminate()
+            try:
+                speculation = self.run(tx, environment, versions)
+            except BrokenProcessPool as e:
+                self.terminate()
+                # How many stamps it used is lost with the worker, so it pays for all of them
+                return self.fail(sender, e, stamps, stamp_cost, metering, auto_commit)
+
+        # Outputs that cannot be sent back are executed here
+        if speculation is None:
+            return self.executor.execute(**tx, environment=environment, auto_commit=auto_commit)
+
+        output = speculation.output
+        if output['status_code'] == 1 and auto_commit:
+            # Like execute(), a failed transaction drops what is pending and commits only its stamps
+            return self.fail(sender, output['result'], output['stamps_used'], stamp_cost, metering, auto_commit)
+
+        for key, value in speculation.reads.items():
+            if driver.pending_reads.get(key) is None:
+                driver.pending_reads[key] = value
+
+        driver.pending_writes.update(speculation.writes)
+
+        if auto_commit:
+            driver.commit()
+
+        output['reads'] = driver.pending_reads
+        return output
+
+    def fail(self, sender, result, stamps_used, stamp_cost, metering, auto_commit):
+        """
+        Return the output of a failed transaction and charge its stamps the way Executor.execute() does.
+        """
+        driver = self.executor.driver
+        if metering is None:
+            metering = self.executor.metering
+
+        if auto_commit:
+            driver.flush_cache()
+
+        writes = {}
+        if metering:
+            writes = self.executor.deduct_stamps(driver, self.executor.balances_key(sender), stamps_used, stamp_cost)
+            if auto_commit:
+                driver.commit()
+
+        return {
+            'status_code': 1,
+            'result': result,
+            'stamps_used': stamps_used,
+            'writes': writes,
+            'reads': driver.pending_reads,
+            'events': []
+        }
+
+    def base(self, full=False):
+        """
+        Return the pending writes of the driver for parallel._sync, as the changes since they were last sent unless
+        full is True or keys were dropped since.
+        """
+        pending = self.executor.driver.pending_writes
+
+        previous = self.generation
+        if full or not self.synced.keys() <= pending.keys():
+            previous = None
+            writes = dict(pending)
+        else:
+            # Containers can be changed in place, so they are always sent
+            writes = {
+                key: value for key, value in pending.items()
+                if self.synced.get(key, MISSING) is not value or type(value) in (list, dict)
+            }
+
+        self.synced = dict(pending)
+        self.generation += 1
+        return self.generation, previous, writes
+
+    def run(self, tx, environment, versions):
+        self.start()
+
+        with parallel._without_contract_loader():
+            results = self.pool.submit(parallel._speculate, [(0, tx)], environment, self.base(), versions).result()
+            if results is None:
+                # The worker missed earlier changes
+                results = self.pool.submit(
+                    parallel._speculate, [(0, tx)], environment, self.base(full=True), versions
+                ).result()
+
+        [(_, speculation)] = results
+        return speculation
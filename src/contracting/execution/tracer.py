@@ -1,8 +1,12 @@
+from array import array
+from types import CodeType
+
+import contextvars
 import sys
 import dis
 import threading
-import psutil
-import os
+import tracemalloc
+import weakref
 
 # Define the opcode costs
 cu_costs = {
@@ -27,28 +31,265 @@ cu_costs = {
 # Define maximum stamps
 MAX_STAMPS = 6500000
 
+# Stamps charged for a line event at each instruction of a code object, indexed by offset // 2. Built once per code
+# object and kept as long as the code object is.
+COST_TABLES = weakref.WeakKeyDictionary()
+
+
+def cost_table(code):
+    costs = COST_TABLES.get(code)
+    if costs is None:
+        # Offsets without an instruction cost as much as opcode 0
+        costs = array('I', [cu_costs.get(0, 1)]) * (len(code.co_code) // 2)
+        for instruction in dis.get_instructions(code):
+            costs[instruction.offset // 2] = cu_costs.get(instruction.opcode, 1)
+        COST_TABLES[code] = costs
+    return costs
+
+
+def prepare(code):
+    """
+    Build the cost tables of a code object and of the functions defined in it.
+    """
+    cost_table(code)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            prepare(const)
+
+
+# Code objects compiled to charge their own stamps (see contracting.compilation.metering), by id. They are not
+# traced. Equal code objects are not the same code object: a comprehension needing no charges is compiled the same
+# with and without them.
+METERED = weakref.WeakValueDictionary()
+
+
+def metered(code):
+    return METERED.get(id(code)) is code
+
+
+# The tracer instrumented code charges: the one started last in the execution context, if it is still running
+active = contextvars.ContextVar('tracer', default=None)
+
+
+def meter(cost, value=None):
+    """
+    Charge a line event of instrumented code. Returns value, so that a charge can be made after an expression.
+    """
+    tracer = active.get()
+    if tracer is not None:
+        tracer.charge(cost)
+    return value
+
+
+def meter_loop(first, cost, iterable):
+    """
+    Iterate like a loop of instrumented code does, charging the line events before getting the first value, which
+    are given as a tuple, and the line event of getting each value after it.
+    """
+    return _loop(first, cost, iter(iterable))
+
+
+def _loop(first, cost, iterator):
+    for charge in first:
+        meter(charge)
+    for value in iterator:
+        yield value
+        meter(cost)
+
+
+def meter_decorator(before, decorator, after):
+    """
+    Charge the line events before and after applying a decorator of instrumented code.
+    """
+    def apply(function):
+        if before:
+            meter(before)
+        function = decorator(function)
+        if after:
+            meter(after)
+        return function
+
+    return apply
+
+
+def trace_active():
+    """
+    Trace contract code in the running tracer, for contract code loaded that is not instrumented.
+    """
+    tracer = active.get()
+    if tracer is not None:
+        tracer.hook()
+
+
+def meter_frame():
+    """
+    Measure memory when a frame of instrumented code starts or ends, like the tracer does on calls and returns.
+    """
+    tracer = active.get()
+    if tracer is not None:
+        tracer.sample_memory()
+
+
+# Memory a metered transaction may allocate. It is measured with tracemalloc when contract code is called or returns,
+# and every MEMORY_SAMPLE_LINES lines.
+MAX_MEMORY = 500 * 1024 * 1024
+MEMORY_SAMPLE_LINES = 1000
+
+# Rules for the lines the infinite loop guard counts towards max_call_count. Which transactions fail depends on the
+# rule, so every node has to use the same one.
+# - COUNT_ALL_LINES: every line run in the thread while the tracer is started, in contract code or not, except the
+#   tracer's own. This is how the guard counted originally, so it is the default. Code outside contracts is traced to
+#   count its lines, and sys.monitoring is not used.
+# - COUNT_CONTRACT_LINES: only the line events charged to contract code, so code outside contracts is not traced.
+COUNT_ALL_LINES = 1
+COUNT_CONTRACT_LINES = 2
+CALL_COUNT_RULES = (COUNT_ALL_LINES, COUNT_CONTRACT_LINES)
+
+# Python 3.12+ meters through sys.monitoring (PEP 669), which only sends events for contract code. Older versions use
+# sys.settrace. It is only used with COUNT_CONTRACT_LINES. The package supports Python 3.11 only, so this path is
+# dormant until pyproject.toml admits 3.12 and CI checks there that both paths charge the same stamps.
+MONITORING = hasattr(sys, 'monitoring')
+
+if MONITORING:
+    TOOL_ID = sys.monitoring.PROFILER_ID
+    TOOL_NAME = 'contracting'
+    EVENTS = sys.monitoring.events
+    DISABLE = sys.monitoring.DISABLE
+    CONTRACT_EVENTS = EVENTS.LINE | EVENTS.JUMP | EVENTS.PY_RETURN | EVENTS.PY_YIELD
+
+
+# sys.settrace traces the thread it is called in, and a tracer metering through sys.monitoring only charges events of
+# the thread it started in, so tracers in different threads do not see each other's code. What is shared is below.
+lock = threading.Lock()
+
+# The tracer the sys.monitoring callbacks are registered for
+monitoring_tracer = None
+
+# tracemalloc measures the whole process, so it cannot tell which thread allocated what. Memory is metered for one
+# execution context at a time: a tracer starting in another one waits until the running one stops, so a transaction's
+# memory never includes what a metered transaction in another thread allocates. memory_started tells if tracemalloc
+# was started for the running tracer rather than by someone else.
+memory_lock = threading.Lock()
+memory_started = False
+
+
+def release_tool(tracer):
+    global monitoring_tracer
+
+    with lock:
+        if monitoring_tracer is tracer:
+            monitoring_tracer = None
+
+
+def start_tracing_memory():
+    global memory_started
+
+    memory_lock.acquire()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        memory_started = True
+
+
+def stop_tracing_memory():
+    global memory_started
+
+    if memory_started:
+        tracemalloc.stop()
+        memory_started = False
+    memory_lock.release()
+
+
 class Tracer:
-    def __init__(self):
+    """
+    Meters the stamps, lines and memory of the transaction executed in the thread it is started in. Stamps and lines
+    are metered per thread, but memory is not: while a tracer meters memory, a tracer starting to meter it in another
+    execution context waits for it to stop, so metered transactions in different threads are executed one at a time.
+    """
+
+    def __init__(self, max_memory=MAX_MEMORY, call_count_rule=COUNT_ALL_LINES):
         self.cost = 0
         self.stamp_supplied = 0
         self.last_frame_mem_usage = 0
         self.total_mem_usage = 0
+        self.max_memory = max_memory
+        # Traced memory when the tracer started, and whether it keeps tracemalloc tracing
+        self.memory_base = 0
+        self.tracing_memory = False
         self.started = False
         self.call_count = 0
         self.max_call_count = 800000
-        self.instruction_cache = {}
-        self.lock = threading.Lock()
+        self.call_count_rule = call_count_rule
+        # Contract code objects sending events to the monitoring callbacks, with their costs and the line of each
+        # offset
+        self.monitored = {}
+        self.lines = {}
+        self.monitoring = False
+        self.thread = None
+        # Whether contract code is traced, rather than only instrumented code being metered
+        self.hooked = False
 
-    def start(self):
-        sys.settrace(self.trace_func)
+    def start(self, hooks=True, memory=True):
+        """
+        Start metering. Without memory, only stamps and lines are metered, and the tracer does not wait for one
+        metering memory in another execution context.
+        """
+        if memory and not self.tracing_memory:
+            start_tracing_memory()
+            self.tracing_memory = True
+        if self.tracing_memory:
+            self.memory_base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        if hooks or self.call_count_rule == COUNT_ALL_LINES:
+            self.hook()
         self.cost = 0
         self.call_count = 0
         self.started = True
+        active.set(self)
+
+    def hook(self):
+        """
+        Trace contract code that is not instrumented. Can be called while the tracer is running, for code loaded
+        after it started.
+        """
+        if self.hooked:
+            return
+        self.hooked = True
+
+        self.monitoring = MONITORING and self.call_count_rule == COUNT_CONTRACT_LINES and self.claim_tool()
+        if self.monitoring:
+            self.thread = threading.get_ident()
+            sys.monitoring.register_callback(TOOL_ID, EVENTS.PY_START, self.monitor_start)
+            sys.monitoring.register_callback(TOOL_ID, EVENTS.LINE, self.monitor_line)
+            sys.monitoring.register_callback(TOOL_ID, EVENTS.JUMP, self.monitor_jump)
+            # Settrace reports each of these as a return
+            for event in (EVENTS.PY_RETURN, EVENTS.PY_YIELD, EVENTS.PY_UNWIND):
+                sys.monitoring.register_callback(TOOL_ID, event, self.monitor_return)
+            # Unwinding cannot be enabled for some code objects only
+            sys.monitoring.set_events(TOOL_ID, EVENTS.PY_START | EVENTS.PY_UNWIND)
+        else:
+            sys.settrace(self.trace_func)
 
     def stop(self):
         if self.started:
-            sys.settrace(None)
+            if self.hooked and self.monitoring:
+                sys.monitoring.set_events(TOOL_ID, 0)
+                for code in self.monitored:
+                    sys.monitoring.set_local_events(TOOL_ID, code, 0)
+                self.monitored.clear()
+                self.lines.clear()
+                release_tool(self)
+            elif self.hooked:
+                sys.settrace(None)
+            self.hooked = False
             self.started = False
+            if active.get() is self:
+                active.set(None)
+
+            if self.tracing_memory:
+                self.measure_memory()
+                stop_tracing_memory()
+                self.tracing_memory = False
 
     def reset(self):
         self.stop()
@@ -79,68 +320,120 @@ class Tracer:
     def is_started(self):
         return self.started
 
-    def get_memory_usage(self):
-        process = psutil.Process(os.getpid())
-        mem_info = process.memory_info()
-        # Return the RSS (Resident Set Size)
-        return mem_info.rss
+    def measure_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.last_frame_mem_usage = current - self.memory_base
+        self.total_mem_usage = max(self.total_mem_usage, peak - self.memory_base)
+
+    def sample_memory(self):
+        if not self.tracing_memory:
+            return
+        self.measure_memory()
+        if self.total_mem_usage > self.max_memory:
+            self.stop()
+            raise AssertionError(f"Transaction exceeded memory usage! Total usage: {self.total_mem_usage} bytes")
+
+    def claim_tool(self):
+        global monitoring_tracer
+
+        with lock:
+            # Events are sent for every thread, so one tracer at a time meters through them
+            if monitoring_tracer is not None:
+                return False
+
+            tool = sys.monitoring.get_tool(TOOL_ID)
+            if tool is None:
+                sys.monitoring.use_tool_id(TOOL_ID, TOOL_NAME)
+            elif tool != TOOL_NAME:
+                # Another profiler is running, so settrace is used instead
+                return False
+
+            monitoring_tracer = self
+            return True
 
     def trace_func(self, frame, event, arg):
+        if event == 'call':
+            # Only trace code within contracts (if '__contract__' in globals) that does not meter itself
+            if '__contract__' not in frame.f_globals:
+                if self.call_count_rule == COUNT_CONTRACT_LINES or frame.f_globals is globals():
+                    return None
+                return self.count_lines
+            if metered(frame.f_code):
+                return None
+            self.sample_memory()
+
+            costs = cost_table(frame.f_code)
+
+            def trace_lines(frame, event, arg):
+                if event == 'line':
+                    self.charge(costs[frame.f_lasti // 2])
+                elif event == 'return':
+                    self.sample_memory()
+                return trace_lines
+
+            return trace_lines
+
+        return self.trace_func
+
+    def count_lines(self, frame, event, arg):
         if event == 'line':
             self.call_count += 1
             if self.call_count > self.max_call_count:
                 self.stop()
                 raise AssertionError("Call count exceeded threshold! Infinite Loop?")
+        return self.count_lines
 
-            # Check if the function matches the target module and function names
-            code = frame.f_code
-            current_function_name = code.co_name
-            globals_dict = frame.f_globals
-            module_name = globals_dict.get('__name__', '')
+    def monitor_start(self, code, offset):
+        if threading.get_ident() != self.thread:
+            return None
 
-            # Only trace code within contracts (if '__contract__' in globals)
-            if '__contract__' not in globals_dict:
-                return
+        if code not in self.monitored:
+            # Code objects never change globals, so code outside contracts is not sent again
+            if '__contract__' not in sys._getframe(1).f_globals or metered(code):
+                return DISABLE
 
-            # Get the opcode at the current instruction
-            lasti = frame.f_lasti
-            opcode = self.get_opcode(code, lasti)
+            lines = {}
+            for start, end, line in code.co_lines():
+                for i in range(start, end, 2):
+                    lines[i] = line
 
-            # Update memory usage
-            if self.last_frame_mem_usage == 0:
-                self.last_frame_mem_usage = self.get_memory_usage()
+            self.monitored[code] = cost_table(code)
+            self.lines[code] = lines
+            sys.monitoring.set_local_events(TOOL_ID, code, CONTRACT_EVENTS)
 
-            new_memory_usage = self.get_memory_usage()
-            if new_memory_usage > self.last_frame_mem_usage:
-                self.total_mem_usage += (new_memory_usage - self.last_frame_mem_usage)
-            self.last_frame_mem_usage = new_memory_usage
+        self.sample_memory()
 
-            # Check for memory usage limit (set an arbitrary limit, e.g., 500MB)
-            if self.total_mem_usage > 500 * 1024 * 1024:
-                self.stop()
-                raise AssertionError(f"Transaction exceeded memory usage! Total usage: {self.total_mem_usage} bytes")
+    def monitor_line(self, code, line):
+        if threading.get_ident() == self.thread:
+            self.charge(self.monitored[code][sys._getframe(1).f_lasti // 2])
 
-            # Add cost based on opcode
-            opcode_cost = cu_costs.get(opcode, 1)  # Default cost if opcode not found
-            self.cost += opcode_cost
+    def monitor_jump(self, code, source, destination):
+        if destination > source:
+            return DISABLE
 
-            if self.cost > self.stamp_supplied or self.cost > MAX_STAMPS:
-                self.stop()
-                raise AssertionError("The cost has exceeded the stamp supplied!")
+        # Like settrace, a jump back to the same line starts the line again. A jump to another line is a line event.
+        lines = self.lines.get(code)
+        if lines is None or lines.get(source) != lines.get(destination):
+            return DISABLE
 
-        return self.trace_func
+        if threading.get_ident() == self.thread:
+            self.charge(self.monitored[code][sys._getframe(1).f_lasti // 2])
+
+    def monitor_return(self, code, offset, value):
+        if code in self.monitored and threading.get_ident() == self.thread:
+            self.sample_memory()
+
+    def charge(self, cost):
+        self.call_count += 1
+        if self.call_count > self.max_call_count:
+            self.stop()
+            raise AssertionError("Call count exceeded threshold! Infinite Loop?")
+
+        if self.call_count % MEMORY_SAMPLE_LINES == 0:
+            self.sample_memory()
 
-    def get_opcode(self, code, offset):
-        # Cache the instruction map per code object
-        with self.lock:
-            instruction_map = self.instruction_cache.get(code)
-            if instruction_map is None:
-                instruction_map = {}
-                for instr in dis.get_instructions(code):
-                    instruction_map[instr.offset] = instr.opcode
-                self.instruction_cache[code] = instruction_map
-            opcode = instruction_map.get(offset, None)
-            if opcode is None:
-                # Instruction not found; default to 0
-                opcode = 0
-            return opcode
+        self.cost += cost
+
+        if self.cost > self.stamp_supplied or self.cost > MAX_STAMPS:
+            self.stop()
+            raise AssertionError("The cost has exceeded the stamp supplied!")
@@ -4,7 +4,6 @@ from contracting.storage.orm import Datum
 from contracting.storage.driver import Driver, OWNER_KEY
 from contracting.execution.runtime import rt
 
-import importlib
 import sys
 
 
@@ -62,7 +61,9 @@ def import_module(name):
     if _driver.get_contract(name) is None:
         raise ImportError
 
-    return importlib.import_module(name, package=None)
+    # The module importing contracts imports this one through the stdlib
+    from contracting.execution.module import import_contract
+    return import_contract(name)
 
 
 def enforce_interface(m: ModuleType, interface: list):
@@ -11,14 +11,25 @@
     blockchain.
 """
 
-import random
-
 from types import ModuleType
 from contracting.execution.runtime import rt
 
 
-class Seeded:
-    s = False
+class SeededType(type):
+    @property
+    def s(cls):
+        return rt.seeded
+
+    @s.setter
+    def s(cls, value):
+        rt.seeded = value
+
+
+class Seeded(metaclass=SeededType):
+    """
+    Deprecated: use rt.seeded. Seeded.s reads and sets whether the random state of the current execution context was
+    seeded.
+    """
 
 
 def seed(aux_salt=None):
@@ -39,16 +50,17 @@ def seed(aux_salt=None):
 
     s = block_height + block_hash + __input_hash + auxiliary_salt
 
-    random.seed(s)
-    Seeded.s = True
+    # Each execution context has its own random state, seeded by the transaction
+    rt.random.seed(s)
+    rt.seeded = True
 
 
 def getrandbits(k):
-    assert Seeded.s, 'Random state not seeded. Call seed().'
+    assert rt.seeded, 'Random state not seeded. Call seed().'
 
     b_str = ''
     for i in range(k):
-        if random.random() > 0.5:
+        if rt.random.random() > 0.5:
             b_str += '1'
         else:
             b_str += '0'
@@ -57,28 +69,28 @@ def getrandbits(k):
 
 
 def shuffle(l):
-    assert Seeded.s, 'Random state not seeded. Call seed().'
-    random.shuffle(l)
+    assert rt.seeded, 'Random state not seeded. Call seed().'
+    rt.random.shuffle(l)
 
 
 def randrange(k):
-    assert Seeded.s, 'Random state not seeded. Call seed().'
-    return random.randrange(k)
+    assert rt.seeded, 'Random state not seeded. Call seed().'
+    return rt.random.randrange(k)
 
 
 def randint(a, b):
-    assert Seeded.s, 'Random state not seeded. Call seed().'
-    return random.randint(a, b)
+    assert rt.seeded, 'Random state not seeded. Call seed().'
+    return rt.random.randint(a, b)
 
 
 def choice(l):
-    assert Seeded.s, 'Random state not seeded. Call seed().'
-    return random.choice(l)
+    assert rt.seeded, 'Random state not seeded. Call seed().'
+    return rt.random.choice(l)
 
 
 def choices(l, k):
-    assert Seeded.s, 'Random state not seeded. Call seed().'
-    return random.choices(l, k=k)
+    assert rt.seeded, 'Random state not seeded. Call seed().'
+    return rt.random.choices(l, k=k)
 
 
 # Construct module for exposure in the contract runtime
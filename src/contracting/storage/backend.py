@@ -0,0 +1,286 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from pathlib import Path
+from contracting import constants
+from contracting.storage import hdf5
+
+import os
+import shutil
+
+
+def parse_key(key):
+    """
+    Split a state key into the name of the file it is stored in and its group path inside that file,
+    e.g. 'currency.balances:stu' -> ('currency', 'balances/stu').
+    """
+    # Split the key into parts (filename, group, etc.)
+    parts = key.split(constants.INDEX_SEPARATOR, 1)
+
+    # The first part should be the filename (e.g., "currency")
+    filename = parts[0].split(constants.DELIMITER, 1)[0]
+
+    # The rest (after the first '.') becomes the group and attribute inside the HDF5 file
+    if len(parts) > 1:
+        variable = parts[1].replace(constants.DELIMITER, constants.HDF5_GROUP_SEPARATOR)
+    else:
+        variable = parts[0].replace(constants.DELIMITER, constants.HDF5_GROUP_SEPARATOR)
+
+    return filename, variable
+
+
+def unparse_key(filename, variable):
+    """
+    Inverse of parse_key. A key without a separator, e.g. 'foo:bar', is stored in the group 'foo/bar' of the file
+    'foo', which is the same place as 'foo.foo:bar'. The shorter form is returned for these.
+    """
+    variable = variable.replace(constants.HDF5_GROUP_SEPARATOR, constants.DELIMITER)
+    if variable == filename or variable.startswith(filename + constants.DELIMITER):
+        return variable
+    return f"{filename}{constants.INDEX_SEPARATOR}{variable}"
+
+
+def names_for_prefix(prefix, names):
+    """
+    Filter the given file names down to the ones that can hold keys starting with prefix.
+    """
+    filename, _ = parse_key(prefix)
+    if constants.INDEX_SEPARATOR in prefix or constants.DELIMITER in prefix:
+        return [filename] if filename in names else []
+    return [name for name in names if name.startswith(prefix)]
+
+
+def variable_prefix(prefix):
+    """
+    Return the part of a key prefix that is matched against the keys inside a file, written with the state
+    delimiter. A prefix that only names files, e.g. 'curr', matches every key in them.
+    """
+    parts = prefix.split(constants.INDEX_SEPARATOR, 1)
+    if len(parts) > 1:
+        return parts[1]
+    if constants.DELIMITER in prefix:
+        return prefix
+    return ""
+
+
+class StorageBackend(ABC):
+    """
+    Persistent key-value store behind the Driver. Keys are full state keys such as 'currency.balances:stu' and
+    values are decoded Python objects. The name of a key is the part before the first separator ('currency');
+    names starting with '__' hold run state rather than contract state.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """Return the value of a key, or None if it does not exist."""
+
+    def get_many(self, keys):
+        """Return a dictionary of key to value for several keys. Missing keys map to None."""
+        return {key: self.get(key) for key in keys}
+
+    def version(self, key):
+        """
+        Return a number that changes whenever the place a key is stored in is written, so a cached value or miss
+        for the key can be checked for staleness. None if the backend cannot tell, in which case nothing is cached.
+        """
+        return None
+
+    def versions(self):
+        """
+        Return the version of every name, see version(). Workers reading the store from other processes pass them
+        to refresh().
+        """
+        return {}
+
+    @abstractmethod
+    def set_many(self, writes, block_num=None, executor=None, max_workers=None, encoded=None):
+        """
+        Write a dictionary of key to value. A value of None deletes the key. Backends that can write independent
+        files concurrently do so when an executor or worker count is given. Returns the seconds spent per file.
+
+        encoded optionally maps keys to the JSON encoding of their value, which is stored instead of encoding the
+        value again.
+        """
+
+    @abstractmethod
+    def delete_many(self, keys):
+        """Delete several keys."""
+
+    @abstractmethod
+    def iter_prefix(self, prefix="", length=0):
+        """Return the sorted keys starting with prefix, at most length of them if length is not 0."""
+
+    @abstractmethod
+    def snapshot(self, destination):
+        """Write a consistent copy of the store to destination and return a backend opened on it."""
+
+    @abstractmethod
+    def names(self):
+        """Return the sorted names of all contracts and run state entries in the store."""
+
+    @abstractmethod
+    def exists(self, name):
+        """Return True if anything is stored under a name."""
+
+    @abstractmethod
+    def drop(self, name):
+        """Remove everything stored under a name."""
+
+    @abstractmethod
+    def flush(self):
+        """Remove everything from the store."""
+
+    def share(self):
+        """
+        Prepare this process to read the store while another process, which writes it between the reads, keeps
+        it open. Called once in each worker process.
+        """
+
+    def refresh(self, versions=None):
+        """
+        Forget what is known about the stored data, because another process may have written it. Given the
+        versions() of that process, only what changed since the last refresh is forgotten.
+        """
+
+
+class HDF5Backend(StorageBackend):
+    """
+    Stores every contract in its own HDF5 file under storage_home/contract_state, and run state ('__' names)
+    under storage_home/run_state. Each key is a group in its file holding a value and a block attribute.
+
+    Values are written as JSON unless binary is True, in which case the binary format of the encoder is used.
+    Both formats are read either way.
+    """
+
+    def __init__(self, storage_home=constants.STORAGE_HOME, binary=False):
+        self.storage_home = Path(storage_home)
+        self.binary = binary
+        self.contract_state = self.storage_home.joinpath("contract_state")
+        self.run_state = self.storage_home.joinpath("run_state")
+        # Versions of the writing process at the last refresh, see refresh()
+        self.refreshed = {}
+        self.build_directories()
+
+    def build_directories(self):
+        self.contract_state.mkdir(exist_ok=True, parents=True)
+        self.run_state.mkdir(exist_ok=True, parents=True)
+
+    def file_path(self, filename):
+        if filename.startswith("__"):
+            return str(self.run_state.joinpath(filename))
+        else:
+            return str(self.contract_state.joinpath(filename))
+
+    def get(self, key):
+        filename, variable = parse_key(key)
+        return hdf5.get_value_from_disk(self.file_path(filename), variable)
+
+    def get_many(self, keys):
+        groups_per_file = defaultdict(dict)
+        for key in keys:
+            filename, variable = parse_key(key)
+            groups_per_file[self.file_path(filename)][variable] = key
+
+        values = {}
+        for file_path, groups in groups_per_file.items():
+            found = hdf5.get_values_from_disk(file_path, list(groups.keys()))
+            for variable, key in groups.items():
+                values[key] = found[variable]
+
+        return values
+
+    def version(self, key):
+        filename, _ = parse_key(key)
+        return hdf5.get_file_version(self.file_path(filename))
+
+    def versions(self):
+        return {name: hdf5.get_file_version(self.file_path(name)) for name in self.names()}
+
+    def set_many(self, writes, block_num=None, executor=None, max_workers=None, encoded=None):
+        encoded = encoded or {}
+        batch = defaultdict(dict)
+        for key, value in writes.items():
+            filename, variable = parse_key(key)
+            batch[self.file_path(filename)][variable] = (value, block_num, encoded.get(key))
+
+        return hdf5.set_values_to_disk(batch, executor=executor, max_workers=max_workers, binary=self.binary)
+
+    def delete_many(self, keys):
+        writes = {}
+        for key in keys:
+            filename, _ = parse_key(key)
+            if len(filename) < constants.FILENAME_LEN_MAX:
+                writes[key] = None
+        self.set_many(writes)
+
+    def iter_prefix(self, prefix="", length=0):
+        filenames = names_for_prefix(prefix, self.names())
+        variable = variable_prefix(prefix)
+
+        keys = []
+        for filename in filenames:
+            # Keys stored under the file name itself ('foo:bar' in 'foo') can fall in the range but do not match,
+            # so the index can only be asked for length keys when that is impossible.
+            limit = length if len(filenames) == 1 and not variable.startswith(filename) else 0
+
+            for index_key in hdf5.get_keys_with_prefix(self.file_path(filename), variable, limit):
+                key = unparse_key(filename, index_key)
+                if key.startswith(prefix):
+                    keys.append(key)
+
+        # Already sorted when a single file was scanned, so this is linear
+        keys.sort()
+
+        return keys if length == 0 else keys[:length]
+
+    def snapshot(self, destination):
+        snapshot = HDF5Backend(destination, self.binary)
+        names = self.names()
+        file_paths = sorted(self.file_path(name) for name in names)
+
+        # Hold every file lock so no write lands halfway through the copy. Writes are flushed when they
+        # release their lock, so the files on disk are complete.
+        locks = [hdf5.get_file_lock(file_path) for file_path in file_paths]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for name in names:
+                shutil.copy2(self.file_path(name), snapshot.file_path(name))
+        finally:
+            for lock in locks:
+                lock.release()
+
+        return snapshot
+
+    def names(self):
+        return sorted(os.listdir(self.contract_state) + os.listdir(self.run_state))
+
+    def exists(self, name):
+        return Path(self.file_path(name)).is_file()
+
+    def drop(self, name):
+        hdf5.remove_file(self.file_path(name))
+
+    def flush(self):
+        hdf5.close_all()
+        hdf5.clear_key_indexes()
+        shutil.rmtree(self.run_state, ignore_errors=True)
+        shutil.rmtree(self.contract_state, ignore_errors=True)
+        self.build_directories()
+
+    def share(self):
+        # HDF5 locks files against other processes for as long as they are open, and the writing process keeps
+        # its handles open. Reads happen only while it does not write, and files it wrote are reopened.
+        hdf5.read_without_locks()
+
+    def refresh(self, versions=None):
+        if versions is None:
+            hdf5.close_all()
+            hdf5.clear_key_indexes()
+            self.refreshed = {}
+            return
+
+        # Open handles, key indexes and cached values of the files that were not written stay valid
+        for name in self.refreshed.keys() | versions.keys():
+            if self.refreshed.get(name) != versions.get(name):
+                hdf5.forget_file(self.file_path(name))
+        self.refreshed = dict(versions)
@@ -0,0 +1,48 @@
+from hashlib import blake2b
+
+import math
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives. Sized for capacity keys at the given false
+    positive rate; once more keys than that are added the rate degrades and the filter should be rebuilt.
+    Keys cannot be removed.
+    """
+
+    def __init__(self, capacity=1024, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def from_keys(cls, keys, error_rate=0.01, headroom=2):
+        """
+        Build a filter holding keys with room for headroom times as many before it is full.
+        """
+        keys = list(keys)
+        bloom = cls(max(len(keys) * headroom, 1024), error_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, key):
+        # Double hashing: two 64 bit halves of one digest give all the probe positions
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def full(self):
+        return self.count > self.capacity
@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from threading import RLock
+
+import sys
+
+DEFAULT_CAPACITY = 64 * 1024 * 1024
+
+POLICY_LRU = "lru"
+POLICY_TINYLFU = "tinylfu"
+
+# Share of the capacity given to the admission window of the TinyLFU policy
+WINDOW_RATIO = 0.01
+
+# Rough cost of a cache entry on top of its key and value
+ENTRY_OVERHEAD = 100
+
+# Expected average size of an entry, used to size the frequency sketch
+AVERAGE_ENTRY_SIZE = 256
+
+# Translation table halving every counter of the frequency sketch at once
+HALVE = bytes(i >> 1 for i in range(256))
+
+
+def sizeof(value):
+    """
+    Estimate the memory held by a state value in bytes. Containers are walked so that a large list counts as
+    large, but shared objects are not deduplicated.
+    """
+    if isinstance(value, Hit):
+        return sys.getsizeof(value) + sizeof(value.value)
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class Miss:
+    """
+    Cached result of looking up a key that does not exist. Only valid while the backend version of the key is
+    still the one it was looked up at.
+    """
+    __slots__ = ("version",)
+
+    def __init__(self, version):
+        self.version = version
+
+
+class Hit:
+    """
+    Cached value of a key that exists. Like a Miss, only valid while the backend version of the key is still the
+    one it was cached at, since another Driver on the same store may have written the key since.
+    """
+    __slots__ = ("value", "version")
+
+    def __init__(self, value, version):
+        self.value = value
+        self.version = version
+
+
+class FrequencySketch:
+    """
+    Count-min sketch of how often keys were requested, with 4-bit counters that are halved once the number of
+    increments reaches ten times the width, so old popularity fades.
+    """
+    DEPTH = 4
+    MAX_COUNT = 15
+    SEEDS = (0x9E3779B9, 0x85EBCA6B, 0xC2B2AE35, 0x27D4EB2F)
+
+    def __init__(self, width=1024):
+        self.width = 1 << max(width - 1, 1).bit_length()
+        self.mask = self.width - 1
+        self.table = [bytearray(self.width) for _ in range(self.DEPTH)]
+        self.additions = 0
+        self.sample_size = 10 * self.width
+
+    def _indexes(self, key):
+        h = hash(key)
+        return [((h ^ seed) * 0x01000193 >> 8) & self.mask for seed in self.SEEDS]
+
+    def increment(self, key):
+        for row, i in zip(self.table, self._indexes(key)):
+            if row[i] < self.MAX_COUNT:
+                row[i] += 1
+
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def frequency(self, key):
+        return min(row[i] for row, i in zip(self.table, self._indexes(key)))
+
+    def reset(self):
+        for row in self.table:
+            row[:] = row.translate(HALVE)
+        self.additions //= 2
+
+
+class StateCache:
+    """
+    Cache of decoded state values bounded by the estimated bytes it holds rather than by the number of entries.
+
+    With the 'lru' policy the least recently used entries are evicted. With the 'tinylfu' policy new entries go
+    through a small LRU window first and only displace an entry of the main LRU if they were requested more often
+    according to a frequency sketch (W-TinyLFU), so a scan over many cold keys does not flush the hot ones.
+
+    Hits, misses and evictions are counted and reported by stats().
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, policy=POLICY_LRU):
+        if policy not in (POLICY_LRU, POLICY_TINYLFU):
+            raise ValueError(f"Unknown cache policy {policy}.")
+
+        self.capacity = capacity
+        self.policy = policy
+        self.lock = RLock()
+
+        # key -> (value, size), least recently used first
+        self.main = OrderedDict()
+        self.window = OrderedDict()
+        self.main_size = 0
+        self.window_size = 0
+
+        if policy == POLICY_TINYLFU:
+            self.window_capacity = max(int(capacity * WINDOW_RATIO), 1)
+            self.sketch = FrequencySketch(max(capacity // AVERAGE_ENTRY_SIZE, 64))
+        else:
+            self.window_capacity = 0
+            self.sketch = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def size(self):
+        return self.main_size + self.window_size
+
+    def get(self, key, default=None):
+        with self.lock:
+            if self.sketch is not None:
+                self.sketch.increment(key)
+
+            for segment in (self.window, self.main):
+                entry = segment.get(key)
+                if entry is not None:
+                    segment.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+
+            self.misses += 1
+            return default
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            return self.get(key)
+
+    def __setitem__(self, key, value):
+        size = sizeof(key) + sizeof(value) + ENTRY_OVERHEAD
+
+        with self.lock:
+            self._remove(key)
+            if size > self.capacity:
+                return
+
+            if self.sketch is None:
+                self.main[key] = (value, size)
+                self.main_size += size
+            else:
+                self.window[key] = (value, size)
+                self.window_size += size
+                self._evict_window()
+
+            self._evict_main()
+
+    def __delitem__(self, key):
+        with self.lock:
+            if not self._remove(key):
+                raise KeyError(key)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.window.get(key) or self.main.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+
+    def __contains__(self, key):
+        return key in self.main or key in self.window
+
+    def __len__(self):
+        return len(self.main) + len(self.window)
+
+    def items(self):
+        """
+        Return a list of the cached items. Does not count as a use of the entries.
+        """
+        with self.lock:
+            return [(k, v[0]) for k, v in self.main.items()] + [(k, v[0]) for k, v in self.window.items()]
+
+    def keys(self):
+        return [k for k, _ in self.items()]
+
+    def clear(self):
+        with self.lock:
+            self.main.clear()
+            self.window.clear()
+            self.main_size = 0
+            self.window_size = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "size": self.size,
+            "capacity": self.capacity,
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        entry = self.main.pop(key, None)
+        if entry is not None:
+            self.main_size -= entry[1]
+            return True
+
+        entry = self.window.pop(key, None)
+        if entry is not None:
+            self.window_size -= entry[1]
+            return True
+
+        return False
+
+    def _evict_window(self):
+        # Entries leaving the window are admitted to the main segment only if they are more popular than the
+        # entries they would push out
+        while self.window_size > self.window_capacity:
+            key, (value, size) = self.window.popitem(last=False)
+            self.window_size -= size
+
+            candidate_frequency = self.sketch.frequency(key)
+            freed = 0
+            victims = []
+            for victim in self.main:
+                if self.main_size - freed + size <= self.capacity - self.window_capacity:
+                    break
+                victims.append(victim)
+                freed += self.main[victim][1]
+
+            if victims and any(self.sketch.frequency(v) > candidate_frequency for v in victims):
+                self.evictions += 1
+                continue
+
+            self.main[key] = (value, size)
+            self.main_size += size
+
+    def _evict_main(self):
+        while self.size > self.capacity and self.main:
+            _, (_, size) = self.main.popitem(last=False)
+            self.main_size -= size
+            self.evictions += 1
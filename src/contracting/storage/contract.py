@@ -1,4 +1,5 @@
 from contracting.compilation.compiler import ContractingCompiler
+from contracting.compilation import metering
 from contracting.storage.driver import Driver
 from contracting.execution.runtime import rt
 from contracting.stdlib import env
@@ -23,7 +24,14 @@ class Contract:
         scope.update({'__contract__': True})
         scope.update(rt.env)
 
-        exec(code_obj, scope)
+        instrumented = metering.instrument(code_obj) if rt.instrumented else None
+        if instrumented is not None:
+            scope.update(metering.SCOPE)
+            exec(instrumented[1], scope)
+        else:
+            if rt.instrumented:
+                rt.trace()
+            exec(code_obj, scope)
 
         if scope.get(constants.INIT_FUNC_NAME) is not None:
             if constructor_args is None:
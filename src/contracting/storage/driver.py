@@ -1,17 +1,17 @@
-from contracting.storage.encoder import encode_kv
+from contracting.storage.encoder import encode
 from contracting.execution.runtime import rt
-from contracting.stdlib.bridge.time import Datetime
+from contracting.stdlib.bridge.time import Datetime, Timedelta
 from contracting.stdlib.bridge.decimal import ContractingDecimal
 from datetime import datetime
-from pathlib import Path
-from cachetools import TTLCache
 from contracting import constants
-from contracting.storage import hdf5
+from contracting.storage.backend import StorageBackend, HDF5Backend
+from contracting.storage.wal import WriteAheadLog
+from contracting.storage.cache import StateCache, Miss, Hit
 
+import copy
 import marshal
 import decimal
-import os
-import shutil
+import time
 
 FILE_EXT = ".d"
 HASH_EXT = ".x"
@@ -27,52 +27,67 @@ TIME_KEY = "__submitted__"
 COMPILED_KEY = "__compiled__"
 DEVELOPER_KEY = "__developer__"
 
+# Distinguishes a key deleted in the write-ahead log from one that is not in it
+MISSING = object()
+
+class JournalFrame:
+    """
+    What a savepoint needs to undo the writes made after it: the previous pending write and transaction write of
+    every key written since, and the number of events logged before it.
+    """
+    __slots__ = ("writes", "transaction_writes", "events")
+
+    def __init__(self, events=0):
+        self.writes = {}
+        self.transaction_writes = {}
+        self.events = events
+
+
+# Values that cannot change after they are set, so their encoding can be kept until they are written to disk
+IMMUTABLE_TYPES = {str, int, bool, bytes, ContractingDecimal, Datetime, Timedelta}
+
 
 class Driver:
-    def __init__(self, bypass_cache=False, storage_home=constants.STORAGE_HOME):
+    def __init__(
+        self,
+        bypass_cache=False,
+        storage_home=constants.STORAGE_HOME,
+        backend: StorageBackend = None,
+        wal: WriteAheadLog = None,
+        cache: StateCache = None,
+    ):
         self.pending_deltas = {}
         self.pending_writes = {}
+        # key -> (value, encoding) of pending writes, see set()
+        self.pending_encoded = {}
         self.pending_reads = {}
+        # One frame per open savepoint, innermost last
+        self.journal = []
         self.transaction_writes = {}
         self.log_events = []
-        self.cache = TTLCache(maxsize=1000, ttl=6*3600)
+        # Values known to be on disk, with the backend version they were read at. Kept across commits, so it is
+        # bounded by bytes rather than by age.
+        self.cache = cache if cache is not None else StateCache()
         self.bypass_cache = bypass_cache
-        self.contract_state = storage_home.joinpath("contract_state")
-        self.run_state = storage_home.joinpath("run_state")
-        self.__build_directories()
-
-    def __build_directories(self):
-        self.contract_state.mkdir(exist_ok=True, parents=True)
-        self.run_state.mkdir(exist_ok=True, parents=True)
-
-    def __parse_key(self, key):
-        # Split the key into parts (filename, group, etc.)
-        parts = key.split(constants.INDEX_SEPARATOR, 1)  # Ensure key contains the INDEX_SEPARATOR
-        
-        # The first part should be the filename (e.g., "currency")
-        filename = parts[0].split(constants.DELIMITER, 1)[0]  # Get only 'currency' from 'currency.balances'
-        
-        # The rest (after the first '.') becomes the group and attribute inside the HDF5 file
-        if len(parts) > 1:
-            variable = parts[1].replace(constants.DELIMITER, constants.HDF5_GROUP_SEPARATOR)
-        else:
-            variable = parts[0].replace(constants.DELIMITER, constants.HDF5_GROUP_SEPARATOR)
-        
-        return filename, variable
+        self.backend = backend if backend is not None else HDF5Backend(storage_home)
 
+        # With a write-ahead log, hard_apply only appends to the log and the backend is updated in the background.
+        # Whatever a previous process logged but did not checkpoint is applied first.
+        self.wal = wal
+        if self.wal is not None:
+            self.wal.recover(self.backend)
+            self.wal.start(self.backend)
 
-    def __filename_to_path(self, filename):
-        if filename.startswith("__"):
-            return str(self.run_state.joinpath(filename))
-        else:
-            return str(self.contract_state.joinpath(filename))
+    @property
+    def contract_state(self):
+        return self.backend.contract_state
+
+    @property
+    def run_state(self):
+        return self.backend.run_state
 
-    def __get_files(self):
-        return sorted(os.listdir(self.contract_state) + os.listdir(self.run_state))
-    
     def is_file(self, filename):
-        file_path = Path(self.__filename_to_path(filename))
-        return file_path.is_file()
+        return self.backend.exists(filename)
 
     def get(self, key: str, save: bool = True):
         """
@@ -89,11 +104,21 @@ class Driver:
 
 
     def set(self, key, value, is_txn_write=False):
-        rt.deduct_write(*encode_kv(key, value))
+        encoded = encode(value)
+        rt.deduct_write(key.encode(), encoded.encode())
         if self.pending_reads.get(key) is None:
             self.get(key)
+        if self.journal:
+            frame = self.journal[-1]
+            if key not in frame.writes:
+                frame.writes[key] = self.pending_writes.get(key, MISSING)
+            if is_txn_write and key not in frame.transaction_writes:
+                frame.transaction_writes[key] = self.transaction_writes.get(key, MISSING)
         if type(value) in [decimal.Decimal, float]:
             value = ContractingDecimal(str(value))
+        elif type(value) in IMMUTABLE_TYPES:
+            # Reused when the value is written to disk, as long as the pending write is still this object
+            self.pending_encoded[key] = (value, encoded)
         self.pending_writes[key] = value
         if is_txn_write:
             self.transaction_writes[key] = value
@@ -105,69 +130,124 @@ class Driver:
         it will look it up from the disk.
         """
         if self.bypass_cache:
-            # Parse the key to get the filename and group
-            filename, variable = self.__parse_key(key)
-            value = hdf5.get_value_from_disk(self.__filename_to_path(filename), variable)
-            return value
+            return self.backend.get(key)
+
+        value = self.find_in_memory(key)
+        if value is MISSING:
+            # Taken before the read, so a write landing in between makes the cached miss stale rather than wrong
+            version = self.backend.version(key)
+            value = self.backend.get(key)
+            self.cache_disk_value(key, value, version)
+        return value
 
+    def find_in_memory(self, key: str):
+        """
+        Find the value for a given key in the pending writes, cache or write-ahead log. Returns MISSING if it has
+        to be read from disk.
+        """
         value = self.pending_writes.get(key)
-        if value is None:
-            value = self.cache.get(key)
-        if value is None:
-            # Parse the key to get the filename and group for disk lookup
-            filename, variable = self.__parse_key(key)
-            value = hdf5.get_value_from_disk(self.__filename_to_path(filename), variable)
-        return value
+        if value is not None:
+            if self.journal and type(value) in (list, dict) and key not in self.journal[-1].writes:
+                # Written before the innermost savepoint. The code after it works on a copy, so changing the value in
+                # place cannot leak past the savepoint if it is rolled back.
+                self.journal[-1].writes[key] = value
+                value = copy.deepcopy(value)
+                self.pending_writes[key] = value
+            return value
 
+        entry = self.cache.get(key)
+        if entry is not None and entry.version == self.backend.version(key):
+            if type(entry) is Miss:
+                return None
+            # The cached object outlives this block, so it must not be mutated in place by a contract
+            value = entry.value
+            return copy.deepcopy(value) if type(value) in (list, dict) else value
 
-    def __get_keys_from_file(self, filename):
-        return hdf5.get_groups(self.__filename_to_path(filename))
+        if self.wal is not None:
+            value = self.wal.get(key, MISSING)
+            return copy.deepcopy(value) if type(value) in (list, dict) else value
+        return MISSING
 
-    def keys_from_disk(self, prefix=None, length=0):
+    def cache_disk_value(self, key, value, version):
         """
-        Get all keys from disk with a given prefix
+        Cache a value read from disk, or a miss if there was none.
         """
-        keys = set()
-        try:
-            for filename in self.__get_files():
-                for key in self.__get_keys_from_file(filename):
-                    if prefix and key.startswith(prefix):
-                        keys.add(key)
-                    elif not prefix:
-                        keys.add(key)
-
-                    if 0 < length <= len(keys):
-                        raise AssertionError("Length threshold has been hit. Continuing.")
-        except AssertionError:
-            pass
+        self.cache_value(key, copy.deepcopy(value) if type(value) in (list, dict) else value, version)
 
+    def cache_value(self, key, value, version):
+        """
+        Cache the value a key has at the given backend version, or a miss if the value is None. Nothing is cached
+        if the backend cannot tell versions apart, since the entry could not be checked for staleness.
+        """
+        if version is None:
+            self.cache.pop(key)
+        elif value is not None:
+            self.cache[key] = Hit(value, version)
+        else:
+            self.cache[key] = Miss(version)
+
+    def get_many(self, keys, save: bool = True):
+        """
+        Get the values of several keys. Keys that are not in memory are read from disk together, with one open of
+        each file. Returns a dictionary of key to value in the order of keys; missing keys map to None. If save is
+        True, the values are saved to pending_reads.
+        """
         keys = list(keys)
-        keys.sort()
-        return keys
 
-    def iter_from_disk(self, prefix="", length=0):
-        try:
-            filename, _ = self.__parse_key(prefix)
-        except Exception:
-            return self.keys(prefix=prefix)
+        if self.bypass_cache:
+            values = self.backend.get_many(keys)
+        else:
+            values = {}
+            missing = []
+            for key in keys:
+                value = self.find_in_memory(key)
+                if value is MISSING:
+                    missing.append(key)
+                else:
+                    values[key] = value
+
+            if missing:
+                versions = {key: self.backend.version(key) for key in missing}
+                for key, value in self.backend.get_many(missing).items():
+                    self.cache_disk_value(key, value, versions[key])
+                    values[key] = value
+
+        if save:
+            for key in keys:
+                if self.pending_reads.get(key) is None:
+                    self.pending_reads[key] = values[key]
+
+        return {key: values[key] for key in keys}
+
+    def checkpoint(self):
+        """
+        Apply everything in the write-ahead log to the backend.
+        """
+        if self.wal is not None:
+            self.wal.checkpoint(self.backend)
 
-        if not self.is_file(filename=filename):
-            return []
+    def close(self):
+        """
+        Stop the background checkpoints of the write-ahead log after a final checkpoint.
+        """
+        if self.wal is not None:
+            self.wal.stop(self.backend)
 
-        keys_from_file = self.__get_keys_from_file(filename)
 
-        keys = [key for key in keys_from_file if key.startswith(prefix)]
-        keys.sort()
+    def keys_from_disk(self, prefix=None, length=0):
+        """
+        Get all keys from disk with a given prefix
+        """
+        return self.backend.iter_prefix(prefix=prefix or "", length=length)
 
-        return keys if length == 0 else keys[:length]
+    def iter_from_disk(self, prefix="", length=0):
+        return self.backend.iter_prefix(prefix=prefix, length=length)
 
     def value_from_disk(self, key):
         """
-        Retrieve a value from the disk based on the parsed key.
+        Retrieve a value from the disk.
         """
-        # Parse the key to get the filename and group
-        filename, variable = self.__parse_key(key)
-        return hdf5.get_value_from_disk(self.__filename_to_path(filename), variable)
+        return self.backend.get(key)
 
     def items(self, prefix=""):
         """
@@ -182,18 +262,23 @@ class Driver:
                 _items[k] = v
                 keys.add(k)
 
-        # Collect cache items with matching prefix
-        for k, v in self.cache.items():
-            if k.startswith(prefix) and v is not None:
+        # Collect writes from the write-ahead log that are not on disk yet
+        wal_items = dict(self.wal.items()) if self.wal is not None else {}
+        for k, v in wal_items.items():
+            if k.startswith(prefix) and v is not None and k not in keys and k not in self.pending_writes:
                 _items[k] = v
                 keys.add(k)
 
-        # Collect keys from the disk
+        # Collect keys from the disk. Committed values are on disk, so their keys come from the backend's index
+        # rather than a walk over the whole cache, and are read through the cache.
         db_keys = set(self.iter_from_disk(prefix=prefix))
 
-        # Subtract already collected keys and add missing ones from disk
+        # Subtract already collected keys and add missing ones from disk. Keys deleted in the pending
+        # writes or the write-ahead log are still on disk until they are applied, so they are skipped.
         for k in db_keys - keys:
-            _items[k] = self.get(k)  # Cache get will add the keys to the cache
+            if k in self.pending_writes or k in wal_items:
+                continue
+            _items[k] = self.get(k)  # Reading from disk adds the keys to the cache
 
         return _items
 
@@ -202,7 +287,6 @@ class Driver:
         return list(self.items(prefix).keys())
 
     def values(self, prefix=""):
-        l = list(self.items(prefix).values())
         return list(self.items(prefix).values())
 
     def make_key(self, contract, variable, args=[]):
@@ -266,8 +350,7 @@ class Driver:
         Fully delete a contract from the caches and disk
         """
         for key in self.keys(name):
-            if self.cache.get(key) is not None:
-                del self.cache[key]
+            self.cache.pop(key)
 
             if self.pending_writes.get(key) is not None:
                 del self.pending_writes[key]
@@ -278,19 +361,102 @@ class Driver:
         """
         Get all contract files as a list of strings
         """
-        return sorted(os.listdir(self.contract_state))
+        return [name for name in self.backend.names() if not name.startswith("__")]
 
     def delete_key_from_disk(self, key):
         """
-        Delete a key from the disk by parsing the filename and group from the key.
+        Delete a key from the disk.
         """
-        # Parse the key to get the filename and group
-        filename, variable = self.__parse_key(key)
-        if len(filename) < constants.FILENAME_LEN_MAX:
-            hdf5.delete_key_from_disk(self.__filename_to_path(filename), variable)
+        self.checkpoint()
+        self.backend.delete_many([key])
+        self.cache.pop(key)
+
+    def savepoint(self):
+        """
+        Mark the current pending writes, transaction writes and events so that everything after the mark can be
+        undone by rollback_to(). Savepoints nest. The journal costs one entry per key written after the mark
+        instead of a copy of the block. Returns the savepoint to pass to release() and rollback_to().
+        """
+        self.journal.append(JournalFrame(len(self.log_events)))
+        return len(self.journal)
+
+    def release(self, savepoint):
+        """
+        Keep everything written since the savepoint and forget it, along with the savepoints nested in it. The
+        writes can still be undone by rolling back an enclosing savepoint.
+        """
+        assert 0 < savepoint <= len(self.journal), "Unknown savepoint."
+
+        while len(self.journal) >= savepoint:
+            frame = self.journal.pop()
+            if self.journal:
+                parent = self.journal[-1]
+                # The parent keeps the older previous value of keys it journaled itself
+                for key, previous in frame.writes.items():
+                    parent.writes.setdefault(key, previous)
+                for key, previous in frame.transaction_writes.items():
+                    parent.transaction_writes.setdefault(key, previous)
+
+    def rollback_to(self, savepoint):
+        """
+        Undo everything written since the savepoint and release the savepoints nested in it. The savepoint itself
+        stays open.
+        """
+        assert 0 < savepoint <= len(self.journal), "Unknown savepoint."
+
+        while len(self.journal) >= savepoint:
+            frame = self.journal.pop()
+            self._undo(frame.writes, self.pending_writes)
+            self._undo(frame.transaction_writes, self.transaction_writes)
+            del self.log_events[frame.events:]
+
+        self.journal.append(JournalFrame(len(self.log_events)))
+
+    @staticmethod
+    def _undo(previous_values, target):
+        for key, previous in previous_values.items():
+            if previous is MISSING:
+                target.pop(key, None)
+            else:
+                target[key] = previous
+
+    def begin_transaction(self):
+        """
+        Start journaling a transaction. Everything it writes until end_transaction() can be undone by
+        revert_transaction().
+        """
+        self.journal.clear()
+        return self.savepoint()
+
+    def end_transaction(self):
+        """
+        Keep the writes of the current transaction.
+        """
+        self.journal.clear()
+
+    def revert_transaction(self):
+        """
+        Undo the writes of the current transaction.
+        """
+        if self.journal:
+            self.rollback_to(1)
+        self.journal.clear()
+
+    def encoded_writes(self, writes):
+        """
+        Return the encodings kept by set() that are still valid for the given writes.
+        """
+        encoded = {}
+        for key, value in writes.items():
+            memo = self.pending_encoded.get(key)
+            if memo is not None and memo[0] is value:
+                encoded[key] = memo[1]
+        return encoded
 
     def flush_cache(self):
+        self.journal.clear()
         self.pending_writes.clear()
+        self.pending_encoded.clear()
         self.pending_reads.clear()
         self.pending_deltas.clear()
         self.transaction_writes.clear()
@@ -298,14 +464,17 @@ class Driver:
         self.cache.clear()
 
     def flush_disk(self):
-        shutil.rmtree(self.run_state, ignore_errors=True)
-        shutil.rmtree(self.contract_state, ignore_errors=True)
-        self.__build_directories()
+        if self.wal is not None:
+            self.wal.clear()
+        self.backend.flush()
+        self.cache.clear()
 
     def flush_file(self, filename):
-        file_path = self.__filename_to_path(filename)
-        if os.path.isfile(file_path):
-            os.unlink(file_path)
+        self.checkpoint()
+        self.backend.drop(filename)
+        for key in self.cache.keys():
+            if key == filename or key.startswith((filename + DELIMITER, filename + HASH_DEPTH_DELIMITER)):
+                self.cache.pop(key)
             
     def set_event(self, event):
         self.log_events.append(event)
@@ -332,6 +501,7 @@ class Driver:
             self.cache.clear()
             self.pending_reads.clear()
             self.pending_writes.clear()
+            self.pending_encoded.clear()
             self.pending_deltas.clear()
         else:
             to_delete = []
@@ -339,32 +509,48 @@ class Driver:
                 if _nanos < nanos:
                     break
                 to_delete.append(_nanos)
-                for key, delta in _deltas['writes'].items():
-                    self.cache[key] = delta[0]  # Restoring the value before the write
+                for key in _deltas['writes']:
+                    # The cache holds what was on disk after the write, so it is read again
+                    self.cache.pop(key)
 
             for _nanos in to_delete:
                 self.pending_deltas.pop(_nanos, None)
 
-    def commit(self):
+    def commit(self, executor=None, max_workers=None):
         """
-        Save the current state to disk and clear the L1 and L2 caches.
+        Save the current state to disk, write it through to the L2 cache and clear the L1 cache.
+        Files are flushed concurrently if an executor or worker count is given.
+        Returns the seconds spent writing each file.
         """
-        for k, v in self.pending_writes.items():
-            # Parse the key before applying to HDF5
-            filename, variable = self.__parse_key(k)
-            if v is None:
-                hdf5.delete_key_from_disk(self.__filename_to_path(filename), variable)
-            else:
-                hdf5.set_value_to_disk(self.__filename_to_path(filename), variable, v, None)
+        # The logged blocks are older than the pending writes, so they are applied first
+        self.checkpoint()
+
+        # A value of None deletes the key
+        timings = self.backend.set_many(
+            self.pending_writes,
+            executor=executor,
+            max_workers=max_workers,
+            encoded=self.encoded_writes(self.pending_writes),
+        )
+
+        for key, value in self.pending_writes.items():
+            self.cache_value(key, value, self.backend.version(key))
 
-        self.cache.clear()
         self.pending_writes.clear()
+        self.pending_encoded.clear()
         self.pending_reads.clear()
 
+        return timings
 
-    def hard_apply(self, nanos):
+
+    def hard_apply(self, nanos, executor=None, max_workers=None):
         """
         Save the current state to disk and L1 cache and clear the L2 cache.
+        Files are flushed concurrently if an executor or worker count is given.
+        Returns the seconds spent writing each file.
+
+        With a write-ahead log the writes are appended to the log with a single fsync instead, and the seconds
+        spent doing so are returned under the log directory.
         """
 
         deltas = {}
@@ -372,59 +558,74 @@ class Driver:
             current = self.pending_reads.get(k)
             deltas[k] = (current, v)
 
-            self.cache[k] = v
-
         self.pending_deltas[nanos] = {"writes": deltas, "reads": self.pending_reads}
 
+        # The writes of this block are the newest in the batch below, so their encodings stay valid
+        encoded = self.encoded_writes(self.pending_writes)
+
         # Clear the top cache
         self.pending_reads = {}
         self.pending_writes.clear()
+        self.pending_encoded.clear()
 
-        # Run through the sorted HCLs from oldest to newest applying each one
+        # Run through the sorted HCLs from oldest to newest, collecting the writes into one batch.
+        # Later deltas overwrite earlier ones for the same key.
+        writes = {}
         to_delete = []
         for _nanos, _deltas in sorted(self.pending_deltas.items()):
             # Run through all state changes, taking the second value, which is the post delta
             for key, delta in _deltas["writes"].items():
-                # Parse the key before applying to HDF5
-                filename, variable = self.__parse_key(key)
-                hdf5.set_value_to_disk(self.__filename_to_path(filename), variable, delta[1], nanos)
+                writes[key] = delta[1]
 
             to_delete.append(_nanos)
             if _nanos == nanos:
                 break
 
+        if self.wal is not None:
+            start = time.perf_counter()
+            self.wal.append(nanos, writes)
+            timings = {str(self.wal.directory): time.perf_counter() - start}
+        else:
+            timings = self.backend.set_many(
+                writes, block_num=nanos, executor=executor, max_workers=max_workers, encoded=encoded
+            )
+
         # Remove the deltas from the set
         [self.pending_deltas.pop(key) for key in to_delete]
 
+        # Versions are taken after the write, so the entries stay valid until the next write of their file
+        for key, value in writes.items():
+            self.cache_value(key, value, self.backend.version(key))
+
+        return timings
+
 
     def get_all_contract_state(self):
         """
-        Queries the disk storage and returns a dictionary with all the state from the contract storage directory.
+        Queries the disk storage and returns a dictionary with all the state from the contract storage.
         """
+        self.checkpoint()
+
         all_contract_state = {}
-        for file_path in self.contract_state.iterdir():
-            filename = file_path.name
-            keys = hdf5.get_all_keys_from_file(self.__filename_to_path(filename))
-            for key in keys:
-                full_key = f"{filename}{DELIMITER}{key}"
-                value = self.get(full_key)
-                all_contract_state[full_key] = value
+        for name in self.get_contract_files():
+            for key in self.backend.iter_prefix(f"{name}{DELIMITER}"):
+                all_contract_state[key] = self.get(key)
 
         return all_contract_state
-    
+
 
     def get_run_state(self):
         """
-        Retrieves the latest state information from the run state directory.
+        Retrieves the latest state information from the run state storage.
         """
+        self.checkpoint()
+
         run_state = {}
-        for file_path in self.run_state.iterdir():
-            filename = file_path.name
-            keys = self.__get_keys_from_file(self.__filename_to_path(filename))
-            for key in keys:
-                full_key = f"{filename}{DELIMITER}{key}"
-                value = hdf5.get_value_from_disk(self.__filename_to_path(filename), key)
-                run_state[full_key] = value
+        for name in self.backend.names():
+            if not name.startswith("__"):
+                continue
+            keys = self.backend.iter_prefix(f"{name}{DELIMITER}")
+            run_state.update(self.backend.get_many(keys))
 
         return run_state
 
@@ -1,5 +1,8 @@
 import json
 import decimal
+import struct
+
+from json.encoder import encode_basestring_ascii
 
 from contracting.stdlib.bridge.time import Datetime, Timedelta
 from contracting.stdlib.bridge.decimal import ContractingDecimal, MAX_LOWER_PRECISION, fix_precision
@@ -8,6 +11,8 @@ from contracting.constants import INDEX_SEPARATOR, DELIMITER
 MONGO_MIN_INT = -(2 ** 63)
 MONGO_MAX_INT = 2 ** 63 - 1
 
+MISSING = object()
+
 ##
 # ENCODER CLASS
 # Add to this to encode Python types for storage.
@@ -88,6 +93,69 @@ def encode_ints_in_dict(data: dict):
     return d
 
 
+##
+# FAST PATHS
+# Most values are ints, short strings and decimals, or flat lists and dicts of them. These are written and read
+# directly instead of going through json with the Encoder class and the as_object hook. The output is exactly what
+# the generic path produces, which matters because metering charges for the length of the encoding.
+##
+
+def _encode_scalar(data, in_dict=False):
+    """
+    Return the encoding of a scalar, or None if it needs the generic path. Big ints are only converted inside dicts
+    (and at the top level), like encode_ints_in_dict does.
+    """
+    t = type(data)
+    if t is str:
+        return encode_basestring_ascii(data)
+    elif t is int:
+        if in_dict and not MONGO_MIN_INT < data < MONGO_MAX_INT:
+            return '{"__big_int__":"' + int.__repr__(data) + '"}'
+        return int.__repr__(data)
+    elif t is ContractingDecimal:
+        # Decimal strings never need escaping
+        return '{"__fixed__":"' + str(fix_precision(data._d)) + '"}'
+    elif data is None:
+        return 'null'
+    elif data is True:
+        return 'true'
+    elif data is False:
+        return 'false'
+    return None
+
+
+def _encode_fast(data):
+    t = type(data)
+    if t is list:
+        parts = []
+        for item in data:
+            part = _encode_scalar(item)
+            if part is None:
+                return None
+            parts.append(part)
+        return '[' + ','.join(parts) + ']'
+    elif t is dict:
+        parts = []
+        for key, value in data.items():
+            if type(key) is not str:
+                return None
+            part = _encode_scalar(value, in_dict=True)
+            if part is None:
+                return None
+            parts.append(encode_basestring_ascii(key) + ':' + part)
+        return '{' + ','.join(parts) + '}'
+    return _encode_scalar(data, in_dict=True)
+
+
+def _encode_generic(data):
+    if isinstance(data, int):
+        data = encode_int(data)
+    elif isinstance(data, dict):
+        data = encode_ints_in_dict(data)
+
+    return json.dumps(data, cls=Encoder, separators=(',', ':'))
+
+
 # JSON library from Python 3 doesn't let you instantiate your custom Encoder. You have to pass it as an obj to json
 def encode(data: str):
     """ NOTE:
@@ -97,12 +165,11 @@ def encode(data: str):
     
     Due to MongoDB integer limitation (8 bytes), we need to preprocess 'big' integers.
     """
-    if isinstance(data, int):
-        data = encode_int(data)
-    elif isinstance(data, dict):
-        data = encode_ints_in_dict(data)
+    encoded = _encode_fast(data)
+    if encoded is not None:
+        return encoded
 
-    return json.dumps(data, cls=Encoder, separators=(',', ':'))
+    return _encode_generic(data)
 
 
 def as_object(d):
@@ -119,14 +186,52 @@ def as_object(d):
     return dict(d)
 
 
+FIXED_PREFIX = '{"__fixed__":"'
+FIXED_SUFFIX = '"}'
+LITERALS = {'null': None, 'true': True, 'false': False}
+
+
+def _decode_fast(data: str):
+    """
+    Decode the common scalar encodings without json. Returns MISSING if the generic path is needed.
+    """
+    if not data or not data.isascii():
+        return MISSING
+
+    first = data[0]
+    if first == '"':
+        body = data[1:-1]
+        if len(data) > 1 and data[-1] == '"' and '"' not in body and '\\' not in body and body.isprintable():
+            return body
+    elif first.isdigit() or first == '-':
+        digits = data[1:] if first == '-' else data
+        # JSON does not allow leading zeros
+        if digits.isdigit() and (digits[0] != '0' or len(digits) == 1):
+            return int(data)
+    elif data.startswith(FIXED_PREFIX) and data.endswith(FIXED_SUFFIX):
+        body = data[len(FIXED_PREFIX):-len(FIXED_SUFFIX)]
+        if '"' not in body and '\\' not in body:
+            return ContractingDecimal(body)
+    elif data in LITERALS:
+        return LITERALS[data]
+
+    return MISSING
+
+
 # Decode has a hook for JSON objects, which are just Python dictionaries. You have to specify the logic in this hook.
 # This is not uniform, but this is how Python made it.
 def decode(data):
     if data is None:
         return None
 
-    if isinstance(data, bytes):
-        data = data.decode()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        if is_binary(data):
+            return decode_binary(bytes(data))
+        data = bytes(data).decode()
+
+    value = _decode_fast(data)
+    if value is not MISSING:
+        return value
 
     try:
         return json.loads(data, object_hook=as_object)
@@ -134,6 +239,250 @@ def decode(data):
         return None
 
 
+##
+# BINARY FORMAT
+# A compact alternative to the JSON encoding for storing values. Values start with BINARY_TAG, which no JSON text
+# starts with, so decode() reads both formats. A value decodes to exactly what its JSON encoding decodes to: tuples
+# become lists, dict keys become strings the way json.dumps writes them, decimals become ContractingDecimals and
+# timedeltas keep only days and seconds. Dicts using one of the reserved keys in TYPES are stored as their JSON
+# encoding so they are converted the same way. Metering keeps measuring the JSON encoding.
+##
+
+BINARY_VERSION = 1
+BINARY_TAG = bytes((0, BINARY_VERSION))
+
+T_NONE = 0
+T_TRUE = 1
+T_FALSE = 2
+T_INT = 3
+T_FLOAT = 4
+T_STR = 5
+T_BYTES = 6
+T_LIST = 7
+T_DICT = 8
+T_FIXED = 9
+T_TIME = 10
+T_DELTA = 11
+T_JSON = 12
+
+DOUBLE = struct.Struct('>d')
+
+
+def _write_uint(buf, n):
+    while n > 0x7F:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _write_int(buf, n):
+    # Zigzag, so small negative numbers stay short too
+    _write_uint(buf, n << 1 if n >= 0 else (-n << 1) - 1)
+
+
+def _write_str(buf, s):
+    data = s.encode('utf-8', 'surrogatepass')
+    _write_uint(buf, len(data))
+    buf += data
+
+
+def _json_key(key):
+    # Same conversion json.dumps applies to dict keys
+    if isinstance(key, str):
+        return key
+    if isinstance(key, float):
+        return json.dumps(key)
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, int):
+        return int.__repr__(key)
+    raise TypeError(f'keys must be str, int, float, bool or None, not {key.__class__.__name__}')
+
+
+def _is_type(o, t):
+    return isinstance(o, t) or o.__class__.__name__ == t.__name__
+
+
+def _write_value(buf, o):
+    t = type(o)
+    if t is str:
+        buf.append(T_STR)
+        _write_str(buf, o)
+    elif o is None:
+        buf.append(T_NONE)
+    elif o is True:
+        buf.append(T_TRUE)
+    elif o is False:
+        buf.append(T_FALSE)
+    elif t is int:
+        buf.append(T_INT)
+        _write_int(buf, o)
+    elif t is ContractingDecimal:
+        buf.append(T_FIXED)
+        _write_str(buf, str(fix_precision(o._d)))
+    elif t is dict:
+        if not TYPES.isdisjoint(o):
+            buf.append(T_JSON)
+            _write_str(buf, encode(o))
+            return
+        buf.append(T_DICT)
+        _write_uint(buf, len(o))
+        for k, v in o.items():
+            _write_str(buf, _json_key(k))
+            _write_value(buf, v)
+    elif t is list or t is tuple:
+        buf.append(T_LIST)
+        _write_uint(buf, len(o))
+        for v in o:
+            _write_value(buf, v)
+    elif t is float:
+        buf.append(T_FLOAT)
+        buf += DOUBLE.pack(o)
+    elif isinstance(o, str):
+        _write_value(buf, str(o))
+    elif isinstance(o, int):
+        _write_value(buf, int(o))
+    elif isinstance(o, float):
+        _write_value(buf, float(o))
+    elif isinstance(o, (list, tuple)):
+        _write_value(buf, list(o))
+    elif isinstance(o, dict):
+        _write_value(buf, dict(o))
+    # The same checks and order as Encoder.default
+    elif _is_type(o, Datetime):
+        buf.append(T_TIME)
+        for part in (o.year, o.month, o.day, o.hour, o.minute, o.second, o.microsecond):
+            _write_int(buf, part)
+    elif _is_type(o, Timedelta):
+        buf.append(T_DELTA)
+        _write_int(buf, o._timedelta.days)
+        _write_int(buf, o._timedelta.seconds)
+    elif isinstance(o, bytes):
+        buf.append(T_BYTES)
+        _write_uint(buf, len(o))
+        buf += o
+    elif _is_type(o, decimal.Decimal):
+        buf.append(T_FIXED)
+        _write_str(buf, str(fix_precision(o)))
+    elif _is_type(o, ContractingDecimal):
+        buf.append(T_FIXED)
+        _write_str(buf, str(fix_precision(o._d)))
+    else:
+        raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
+
+
+def encode_binary(data) -> bytes:
+    """
+    Encode a value in the binary format. Raises TypeError for the same values encode() does.
+    """
+    buf = bytearray(BINARY_TAG)
+    _write_value(buf, data)
+    return bytes(buf)
+
+
+def _read_uint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _read_int(data, pos):
+    n, pos = _read_uint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+
+def _read_str(data, pos):
+    length, pos = _read_uint(data, pos)
+    end = pos + length
+    if end > len(data):
+        raise ValueError('Truncated value')
+    return data[pos:end].decode('utf-8', 'surrogatepass'), end
+
+
+def _read_value(data, pos):
+    t = data[pos]
+    pos += 1
+
+    if t == T_STR:
+        return _read_str(data, pos)
+    elif t == T_INT:
+        return _read_int(data, pos)
+    elif t == T_FIXED:
+        s, pos = _read_str(data, pos)
+        return ContractingDecimal(s), pos
+    elif t == T_NONE:
+        return None, pos
+    elif t == T_TRUE:
+        return True, pos
+    elif t == T_FALSE:
+        return False, pos
+    elif t == T_DICT:
+        count, pos = _read_uint(data, pos)
+        d = {}
+        for _ in range(count):
+            k, pos = _read_str(data, pos)
+            d[k], pos = _read_value(data, pos)
+        return d, pos
+    elif t == T_LIST:
+        count, pos = _read_uint(data, pos)
+        items = []
+        for _ in range(count):
+            v, pos = _read_value(data, pos)
+            items.append(v)
+        return items, pos
+    elif t == T_FLOAT:
+        return DOUBLE.unpack_from(data, pos)[0], pos + DOUBLE.size
+    elif t == T_BYTES:
+        length, pos = _read_uint(data, pos)
+        if pos + length > len(data):
+            raise ValueError('Truncated value')
+        return bytes(data[pos:pos + length]), pos + length
+    elif t == T_TIME:
+        parts = []
+        for _ in range(7):
+            part, pos = _read_int(data, pos)
+            parts.append(part)
+        return Datetime(*parts), pos
+    elif t == T_DELTA:
+        days, pos = _read_int(data, pos)
+        seconds, pos = _read_int(data, pos)
+        return Timedelta(days=days, seconds=seconds), pos
+    elif t == T_JSON:
+        s, pos = _read_str(data, pos)
+        return json.loads(s, object_hook=as_object), pos
+
+    raise ValueError(f'Unknown type tag {t}')
+
+
+def decode_binary(data: bytes):
+    """
+    Decode a value written by encode_binary. Returns None if it is malformed, like decode().
+    """
+    if data[:len(BINARY_TAG)] != BINARY_TAG:
+        return None
+
+    try:
+        value, pos = _read_value(data, len(BINARY_TAG))
+    except (IndexError, ValueError, struct.error):
+        return None
+
+    return value if pos == len(data) else None
+
+
+def is_binary(data):
+    return isinstance(data, (bytes, bytearray, memoryview)) and data[:len(BINARY_TAG)] == BINARY_TAG
+
+
 def make_key(contract, variable, args=[]):
     contract_variable = INDEX_SEPARATOR.join((contract, variable))
     if args:
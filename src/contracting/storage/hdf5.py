@@ -1,24 +1,289 @@
+import atexit
+import time
+import os
 import h5py
+import numpy as np
 
+from itertools import count
 from threading import Lock
-from collections import defaultdict
-from contracting.storage.encoder import encode, decode
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from contracting.storage.encoder import encode, encode_binary, decode
+from contracting.storage.index import KeyIndex
+from contracting.storage.bloom import BloomFilter
 from contracting import constants
 
 # A dictionary to maintain file-specific locks
 file_locks = defaultdict(Lock)
 
+# Sorted indexes of the keys that hold a value in each file, one per top-level group (a Variable or a Hash).
+# {file_path: {group_name: KeyIndex}}. They are loaded on first use and kept up to date by every write that goes
+# through this module.
+key_indexes = {}
+
+# Bloom filters of the groups that hold a value in each file, so that reads of missing keys do not open the file.
+# {file_path: BloomFilter}. They are built on the first read of a file and dropped to be rebuilt once full.
+bloom_filters = {}
+
+# A number that changes whenever a file is written, so callers can tell whether something they learned about the
+# file, e.g. that a key is missing, may be outdated. {file_path: int}
+file_versions = {}
+versions = count(1)
+
 # Constants
 ATTR_LEN_MAX = 64000
 ATTR_VALUE = "value"
 ATTR_BLOCK = "block"
 
+MODE_READ = "r"
+MODE_WRITE = "a"
+POOL_SIZE_MAX = 64
+
+
+class HandlePool:
+    """
+    A bounded pool of open HDF5 file handles keyed by file path.
+
+    Callers must hold the file lock of a path while they use its handle. When
+    the pool is full the least recently used handle that is not locked is closed.
+    A handle opened read-only is reopened in append mode on the first write.
+    Files are opened with HDF5 file locking unless locking is False.
+    """
+    def __init__(self, maxsize=POOL_SIZE_MAX):
+        self.maxsize = maxsize
+        self.handles = OrderedDict()
+        self.lock = Lock()
+        self.locking = None
+
+    def get(self, file_path, mode=MODE_READ):
+        with self.lock:
+            f = self.handles.get(file_path)
+            if f is not None:
+                if mode == MODE_READ or f.mode != MODE_READ:
+                    self.handles.move_to_end(file_path)
+                    return f
+
+                # Upgrade a read-only handle so it can be written to
+                del self.handles[file_path]
+                f.close()
+
+        f = h5py.File(file_path, mode, locking=self.locking)
+
+        with self.lock:
+            self.handles[file_path] = f
+            self._evict()
+
+        return f
+
+    def _evict(self):
+        for file_path in list(self.handles.keys()):
+            if len(self.handles) <= self.maxsize:
+                return
+
+            lock = get_file_lock(file_path)
+            if not lock.acquire(blocking=False):
+                # Handle is in use. Try the next least recently used one.
+                continue
+            try:
+                self.handles.pop(file_path).close()
+            finally:
+                lock.release()
+
+    def close(self, file_path):
+        with self.lock:
+            f = self.handles.pop(file_path, None)
+        if f is not None:
+            f.close()
+
+    def close_all(self):
+        with self.lock:
+            handles = list(self.handles.values())
+            self.handles.clear()
+        for f in handles:
+            f.close()
+
+    def __contains__(self, file_path):
+        return file_path in self.handles
+
+    def __len__(self):
+        return len(self.handles)
+
+
+pool = HandlePool()
+atexit.register(pool.close_all)
+
 
 def get_file_lock(file_path):
     """Retrieve a lock for a specific file path."""
     return file_locks[file_path]
 
 
+@contextmanager
+def open_file(file_path, mode=MODE_READ, timeout=20):
+    """
+    Yield a pooled handle for the file while holding its file lock.
+    """
+    lock = get_file_lock(file_path)
+    if not lock.acquire(timeout=timeout):
+        raise TimeoutError("Lock acquisition timed out")
+    try:
+        f = pool.get(file_path, mode)
+        try:
+            yield f
+        except OSError:
+            # The handle may be unusable after a failed HDF5 operation
+            pool.close(file_path)
+            raise
+        if mode != MODE_READ:
+            f.flush()
+    finally:
+        lock.release()
+
+
+def close_file(file_path):
+    """Close the pooled handle of a file, e.g. before it is removed from disk."""
+    lock = get_file_lock(file_path)
+    with lock:
+        pool.close(file_path)
+
+
+def close_all():
+    """Close every pooled handle."""
+    pool.close_all()
+
+
+def read_without_locks():
+    """
+    Open files without HDF5 file locks from now on, so that another process can keep them open for writing. Only
+    for processes that read the files while nothing writes them, and that forget_file() every file written since
+    their last read.
+    """
+    pool.locking = False
+
+
+def forget_file(file_path):
+    """Close a file and forget its key index and bloom filter, e.g. because another process wrote it."""
+    lock = get_file_lock(file_path)
+    with lock:
+        _forget(file_path)
+
+
+def remove_file(file_path):
+    """Close a file, forget its key index and delete it from disk."""
+    lock = get_file_lock(file_path)
+    with lock:
+        _forget(file_path)
+        if os.path.isfile(file_path):
+            os.unlink(file_path)
+
+
+def _forget(file_path):
+    pool.close(file_path)
+    key_indexes.pop(file_path, None)
+    bloom_filters.pop(file_path, None)
+    file_versions[file_path] = next(versions)
+
+
+def clear_key_indexes():
+    """Forget every key index and bloom filter, e.g. after the storage directories were removed."""
+    key_indexes.clear()
+    bloom_filters.clear()
+    for file_path in file_versions:
+        file_versions[file_path] = next(versions)
+
+
+def get_file_version(file_path):
+    """Return a number that changes whenever the file is written through this module."""
+    return file_versions.get(file_path, 0)
+
+
+def might_contain(file_path, group_name):
+    """
+    Return False if the group surely holds no value in the file, True if it may. Missing files are left to the
+    caller.
+    """
+    bloom = bloom_filters.get(file_path)
+    if bloom is None:
+        if not os.path.isfile(file_path):
+            return True
+        try:
+            with open_file(file_path, MODE_READ) as f:
+                bloom = bloom_filters.get(file_path)
+                if bloom is None:
+                    bloom = BloomFilter.from_keys(_visit_keys(f))
+                    bloom_filters[file_path] = bloom
+        except OSError:
+            return True
+    return _normalize(group_name) in bloom
+
+
+def _normalize(group_name):
+    """
+    Return the name HDF5 stores a group under. Empty hash components make paths like 'h/a//b' or 'h/x/', which HDF5
+    resolves to 'h/a/b' and 'h/x', so the bloom filters and key indexes hold the normalized names that visiting the
+    file returns.
+    """
+    separator = constants.HDF5_GROUP_SEPARATOR
+    if separator * 2 not in group_name and not group_name.endswith(separator) and not group_name.startswith(separator):
+        return group_name
+    return separator.join(part for part in group_name.split(separator) if part)
+
+
+def _to_index_key(group_name):
+    # Index keys use the state delimiter so they sort in the same order as full state keys
+    return group_name.replace(constants.HDF5_GROUP_SEPARATOR, constants.DELIMITER)
+
+
+def _record_write(file_path, group_name, has_value):
+    """
+    Bring the key index, bloom filter and version of a file up to date with a write. Called with the file lock held.
+    """
+    group_name = _normalize(group_name)
+    added = _update_key_index(file_path, group_name, has_value)
+    file_versions[file_path] = next(versions)
+
+    bloom = bloom_filters.get(file_path)
+    if bloom is None or not has_value or added is False:
+        return
+    # Without a loaded key index the filter itself tells whether the key is known. Adding a key whose bits are all
+    # set would only count towards capacity, so overwriting hot keys does not fill the filter.
+    if added is None and group_name in bloom:
+        return
+    bloom.add(group_name)
+    if bloom.full:
+        # Rebuilt from disk on the next read, without the keys deleted since
+        del bloom_filters[file_path]
+
+
+def _update_key_index(file_path, group_name, has_value):
+    """
+    Returns whether the write changed the key set of a loaded index, or None if the index is not loaded. The group
+    name must be normalized.
+    """
+    index = key_indexes.get(file_path, {}).get(group_name.split(constants.HDF5_GROUP_SEPARATOR, 1)[0])
+    if index is None:
+        # Not loaded yet. It will be built from disk, which already has this write.
+        return None
+    key = _to_index_key(group_name)
+    if has_value:
+        if key in index:
+            return False
+        index.add(key)
+        return True
+    if key not in index:
+        return False
+    index.remove(key)
+    return True
+
+
+def _from_attr(value):
+    # Binary values are stored as opaque data, so they are not cut off at NUL bytes like byte strings would be
+    if isinstance(value, np.void):
+        return value.tobytes()
+    return value.decode() if isinstance(value, bytes) else value
+
+
 def get_value(file_path, group_name):
     return get_attr(file_path, group_name, ATTR_VALUE)
 
@@ -28,11 +293,12 @@ def get_block(file_path, group_name):
 
 
 def get_attr(file_path, group_name, attr_name):
+    if not might_contain(file_path, group_name):
+        return None
     try:
-        with h5py.File(file_path, 'r') as f:
+        with open_file(file_path, MODE_READ) as f:
             try:
-                value = f[group_name].attrs[attr_name]
-                return value.decode() if isinstance(value, bytes) else value
+                return _from_attr(f[group_name].attrs[attr_name])
             except KeyError:
                 return None
     except OSError:
@@ -43,7 +309,7 @@ def get_attr(file_path, group_name, attr_name):
 
 def get_groups(file_path):
     try:
-        with h5py.File(file_path, 'r') as f:
+        with open_file(file_path, MODE_READ) as f:
             return list(f.keys())
     except OSError:
         # File doesn't exist
@@ -56,19 +322,18 @@ def set(file_path, group_name, value, blocknum, timeout=20):
     Set the value and blocknum attributes in the HDF5 file for the given group.
     """
     # Acquire a file lock to prevent concurrent writes
-    lock = get_file_lock(file_path if isinstance(file_path, str) else file_path.filename)
-    if lock.acquire(timeout=timeout):
-        try:
-            with h5py.File(file_path, 'a') as f:
-
-                # Write value and blocknum to the group attributes
-                write_attr(f, group_name, ATTR_VALUE, value, timeout)
-                write_attr(f, group_name, ATTR_BLOCK, blocknum, timeout)
-        finally:
-            # Always release the lock after operation
-            lock.release()
-    else:
-        raise TimeoutError("Lock acquisition timed out")
+    if not isinstance(file_path, str):
+        # An already opened file, the caller is responsible for locking it
+        write_attr(file_path, group_name, ATTR_VALUE, value, timeout)
+        write_attr(file_path, group_name, ATTR_BLOCK, blocknum, timeout)
+        _record_write(file_path.filename, group_name, value is not None)
+        return
+
+    with open_file(file_path, MODE_WRITE, timeout) as f:
+        # Write value and blocknum to the group attributes
+        write_attr(f, group_name, ATTR_VALUE, value, timeout)
+        write_attr(f, group_name, ATTR_BLOCK, blocknum, timeout)
+        _record_write(file_path, group_name, value is not None)
 
 
 def write_attr(file_or_path, group_name, attr_name, value, timeout=20):
@@ -78,8 +343,10 @@ def write_attr(file_or_path, group_name, attr_name, value, timeout=20):
 
     # Open the file and ensure group exists, then write the attribute
     if isinstance(file_or_path, str):
-        with h5py.File(file_or_path, 'a') as f:
+        with open_file(file_or_path, MODE_WRITE, timeout) as f:
             _write_attr_to_file(f, group_name, attr_name, value, timeout)
+            if attr_name == ATTR_VALUE:
+                _record_write(file_or_path, group_name, value is not None)
     else:
         _write_attr_to_file(file_or_path, group_name, attr_name, value, timeout)
 
@@ -100,19 +367,23 @@ def _write_attr_to_file(file, group_name, attr_name, value, timeout):
 
 
 def delete(file_path, group_name, timeout=20):
-    lock = get_file_lock(file_path if isinstance(file_path, str) else file_path.filename)
-    if lock.acquire(timeout=timeout):
-        try:
-            with h5py.File(file_path, 'a') as f:
-                try:
-                    del f[group_name].attrs[ATTR_VALUE]
-                    del f[group_name].attrs[ATTR_BLOCK]
-                except KeyError:
-                    pass
-        finally:
-            lock.release()
-    else:
-        raise TimeoutError("Lock acquisition timed out")
+    if not isinstance(file_path, str):
+        # An already opened file, the caller is responsible for locking it
+        _delete_from_file(file_path, group_name)
+        _record_write(file_path.filename, group_name, False)
+        return
+
+    with open_file(file_path, MODE_WRITE, timeout) as f:
+        _delete_from_file(f, group_name)
+        _record_write(file_path, group_name, False)
+
+
+def _delete_from_file(file, group_name):
+    try:
+        del file[group_name].attrs[ATTR_VALUE]
+        del file[group_name].attrs[ATTR_BLOCK]
+    except KeyError:
+        pass
 
 
 def set_value_to_disk(file_path, group_name, value, block_num=None, timeout=20):
@@ -124,6 +395,93 @@ def set_value_to_disk(file_path, group_name, value, block_num=None, timeout=20):
     set(file_path, group_name, encoded_value, block_num if block_num is not None else -1, timeout)
 
 
+def set_values_to_disk(batch, timeout=20, executor=None, max_workers=None, binary=False):
+    """
+    Save a batch of values to disk, grouped by file.
+
+    Files are written one after another unless an executor or more than one worker is given, in which case
+    different files are written concurrently. The call returns only once every file has been written, and any
+    failures are raised together as an ExceptionGroup.
+
+    :param batch: Mapping of file path to {group_name: (value, block_num)}. A value of None deletes the group's attributes.
+        The tuples may carry the JSON encoding of the value as a third item, which is then stored as is.
+    :param timeout: Seconds to wait for each file lock.
+    :param executor: Optional concurrent.futures executor to write the files on.
+    :param max_workers: Number of threads to use when no executor is given.
+    :param binary: Store the values in the binary format of the encoder instead of JSON.
+    :return: Mapping of file path to the seconds spent writing that file.
+    """
+    if executor is None and (max_workers is None or max_workers < 2 or len(batch) < 2):
+        timings = {}
+        for file_path, groups in batch.items():
+            timings[file_path] = write_groups_to_disk(file_path, groups, timeout, binary)
+        return timings
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(batch)))
+
+    try:
+        futures = {
+            file_path: executor.submit(write_groups_to_disk, file_path, groups, timeout, binary)
+            for file_path, groups in batch.items()
+        }
+        wait(futures.values())
+    finally:
+        if owns_executor:
+            executor.shutdown()
+
+    timings = {}
+    errors = []
+    for file_path, future in futures.items():
+        error = future.exception()
+        if error is not None:
+            errors.append(error)
+        else:
+            timings[file_path] = future.result()
+
+    if errors:
+        raise ExceptionGroup(f"Failed to write {len(errors)} of {len(batch)} files to disk", errors)
+
+    return timings
+
+
+def write_groups_to_disk(file_path, groups, timeout=20, binary=False):
+    """
+    Apply every set and delete for a single file with one lock hold and one open handle.
+    Values are stored as JSON strings, or as opaque binary attributes if binary is True.
+    Returns the seconds spent, including encoding.
+    """
+    start = time.perf_counter()
+
+    # Encode before taking the lock so it is held only for the HDF5 writes
+    encoded = {}
+    for group_name, (value, block_num, *known) in groups.items():
+        if value is None:
+            encoded[group_name] = None
+        else:
+            if binary:
+                data = np.void(encode_binary(value))
+            elif known and known[0] is not None:
+                data = known[0]
+            else:
+                data = encode(value)
+            encoded[group_name] = (data, block_num if block_num is not None else -1)
+
+    with open_file(file_path, MODE_WRITE, timeout) as f:
+        for group_name, item in encoded.items():
+            if item is None:
+                _delete_from_file(f, group_name)
+            else:
+                write_attr(f, group_name, ATTR_VALUE, item[0], timeout)
+                write_attr(f, group_name, ATTR_BLOCK, item[1], timeout)
+
+        for group_name, item in encoded.items():
+            _record_write(file_path, group_name, item is not None)
+
+    return time.perf_counter() - start
+
+
 def delete_key_from_disk(file_path, group_name, timeout=20):
     delete(file_path, group_name, timeout)
 
@@ -132,6 +490,132 @@ def get_value_from_disk(file_path, group_name):
     return decode(get_value(file_path, group_name))
 
 
+def get_values_from_disk(file_path, group_names):
+    """
+    Read and decode the values of several groups with a single open of the file.
+    Returns a dictionary of group name to value. Missing groups map to None.
+    """
+    values = dict.fromkeys(group_names)
+    group_names = [group_name for group_name in group_names if might_contain(file_path, group_name)]
+    if not group_names:
+        return values
+
+    try:
+        with open_file(file_path, MODE_READ) as f:
+            for group_name in group_names:
+                try:
+                    values[group_name] = f[group_name].attrs[ATTR_VALUE]
+                except KeyError:
+                    pass
+    except OSError:
+        # File doesn't exist
+        return values
+
+    for group_name, value in values.items():
+        if value is not None:
+            values[group_name] = decode(_from_attr(value))
+
+    return values
+
+
+def get_keys_from_file(file_path):
+    """
+    Retrieve the paths of all groups in an HDF5 file that hold a value.
+    """
+    try:
+        with open_file(file_path, MODE_READ) as f:
+            return _visit_keys(f)
+    except OSError:
+        # File doesn't exist
+        return []
+
+
+def get_keys_with_prefix(file_path, prefix="", length=0):
+    """
+    Retrieve the sorted keys of a file that start with prefix.
+
+    Keys are group paths written with the state delimiter (':') instead of the group separator, so they sort the
+    same way as full state keys. Only the part of the file the prefix can match is read:
+
+    - A prefix inside a nested hash, e.g. 'allowances:stu:', walks just the 'allowances/stu' subgroup unless the
+      index of 'allowances' is already loaded.
+    - A prefix inside a single top-level group, e.g. 'balances:', loads the index of that group.
+    - Any other prefix loads the indexes of the top-level groups whose names start with it.
+
+    :param file_path: Path to the HDF5 file.
+    :param prefix: Prefix of the keys, e.g. 'balances:'.
+    :param length: Maximum number of keys to return, 0 for all of them.
+    """
+    parts = prefix.split(constants.DELIMITER)
+    complete = parts[:-1]
+
+    try:
+        with open_file(file_path, MODE_READ) as f:
+            indexes = key_indexes.setdefault(file_path, {})
+
+            if complete:
+                top = complete[0]
+                if top not in indexes and len(complete) > 1:
+                    keys = [key for key in _visit_subtree_keys(f, complete) if key.startswith(prefix)]
+                    keys.sort()
+                    return keys if length == 0 else keys[:length]
+                tops = [top]
+            else:
+                tops = [name for name in f.keys() if name.startswith(prefix)]
+
+            keys = []
+            for top in tops:
+                index = indexes.get(top)
+                if index is None:
+                    index = KeyIndex(_visit_subtree_keys(f, [top]))
+                    indexes[top] = index
+                keys.extend(index.prefix(prefix, length))
+    except OSError:
+        # File doesn't exist
+        return []
+
+    if len(tops) > 1:
+        # Groups like 'balances' and 'balances2' interleave once their keys are written with ':'
+        keys.sort()
+
+    return keys if length == 0 else keys[:length]
+
+
+def _visit_keys(file):
+    keys = []
+
+    def visit_func(name, node):
+        if isinstance(node, h5py.Group) and ATTR_VALUE in node.attrs:
+            keys.append(name)
+
+    file.visititems(visit_func)
+    return keys
+
+
+def _visit_subtree_keys(file, path):
+    """
+    Return the keys that hold a value in the subgroup at path (a list of group names), including the subgroup
+    itself, written with the state delimiter.
+    """
+    try:
+        group = file[constants.HDF5_GROUP_SEPARATOR.join(path)]
+    except (KeyError, ValueError):
+        return []
+
+    if not isinstance(group, h5py.Group):
+        return []
+
+    base = constants.DELIMITER.join(path)
+    keys = [base] if ATTR_VALUE in group.attrs else []
+
+    def visit_func(name, node):
+        if isinstance(node, h5py.Group) and ATTR_VALUE in node.attrs:
+            keys.append(base + constants.DELIMITER + _to_index_key(name))
+
+    group.visititems(visit_func)
+    return keys
+
+
         
 def get_all_keys_from_file(file_path):
     """
@@ -146,7 +630,7 @@ def get_all_keys_from_file(file_path):
     def visit_func(name, node):
         keys.append(name.replace(constants.HDF5_GROUP_SEPARATOR, constants.DELIMITER))
 
-    with h5py.File(file_path, 'r') as f:
+    with open_file(file_path, MODE_READ) as f:
         f.visititems(visit_func)
 
     return keys
@@ -0,0 +1,53 @@
+from bisect import bisect_left
+
+
+def prefix_upper_bound(prefix):
+    """
+    Return the smallest string greater than every string starting with prefix, or None if there is none.
+    """
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            return prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+class KeyIndex:
+    """
+    A sorted list of keys that is updated in place. Membership tests cost O(log n) and a prefix range
+    costs O(log n + k) for k matching keys.
+    """
+    def __init__(self, keys=()):
+        self.keys = sorted(set(keys))
+
+    def add(self, key):
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            self.keys.insert(i, key)
+
+    def remove(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def prefix(self, prefix="", length=0):
+        """
+        Return the keys starting with prefix in sorted order, at most length of them if length is not 0.
+        """
+        lo = bisect_left(self.keys, prefix)
+
+        upper = prefix_upper_bound(prefix)
+        hi = len(self.keys) if upper is None else bisect_left(self.keys, upper, lo)
+
+        if length > 0:
+            hi = min(hi, lo + length)
+
+        return self.keys[lo:hi]
+
+    def __contains__(self, key):
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __len__(self):
+        return len(self.keys)
@@ -50,7 +50,9 @@ class Hash(Datum):
 
     def _get(self, item):
         value = self._driver.get(f"{self._key}{self._delimiter}{item}")
+        return self._value_or_default(value)
 
+    def _value_or_default(self, value):
         # Add Python defaultdict behavior for easier smart contracting
         if value is None:
             value = self._default_value
@@ -98,6 +100,14 @@ class Hash(Datum):
 
         return prefix
 
+    def get_many(self, keys):
+        """
+        Return the values of several keys at once, in the same order, with the default value for missing ones.
+        """
+        full_keys = [f"{self._key}{self._delimiter}{self._validate_key(key)}" for key in keys]
+        values = self._driver.get_many(full_keys)
+        return [self._value_or_default(values[key]) for key in full_keys]
+
     def all(self, *args):
         prefix = self._prefix_for_args(args)
         return self._driver.values(prefix=prefix)
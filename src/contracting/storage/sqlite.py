@@ -0,0 +1,171 @@
+from itertools import count
+from pathlib import Path
+from threading import Lock
+from contracting import constants
+from contracting.storage.backend import StorageBackend, parse_key
+from contracting.storage.encoder import encode, encode_binary, decode
+from contracting.storage.index import prefix_upper_bound
+
+import sqlite3
+import time
+
+DB_FILENAME = "state.db"
+
+# SQLite caps the number of host parameters in a single statement
+MAX_VARIABLES = 900
+
+# Changes whenever a database is written, see StorageBackend.version. {db_path: int}
+db_versions = {}
+versions = count(1)
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Stores all state in a single SQLite table keyed by the full state key. Prefix scans are range scans on the
+    primary key, so they cost O(log n + k) without any in-memory index.
+
+    Values are written as JSON text unless binary is True, in which case they are written as blobs in the binary
+    format of the encoder. Both formats are read either way.
+    """
+
+    def __init__(self, storage_home=constants.STORAGE_HOME, filename=DB_FILENAME, binary=False):
+        self.storage_home = Path(storage_home)
+        self.storage_home.mkdir(exist_ok=True, parents=True)
+        self.db_path = self.storage_home.joinpath(filename)
+        self.encode = encode_binary if binary else encode
+        self.binary = binary
+
+        # Versions of the writing process at the last refresh, see refresh()
+        self.refreshed = {}
+
+        self.lock = Lock()
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, name TEXT NOT NULL, value BLOB NOT NULL, block INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS state_name ON state (name)")
+
+    def __reduce__(self):
+        # Connections cannot be pickled, so another process opens its own
+        return SQLiteBackend, (self.storage_home, self.db_path.name, self.binary)
+
+    def version(self, key):
+        return db_versions.get(self.db_path, 0)
+
+    def versions(self):
+        return {str(self.db_path): self.version(None)}
+
+    def refresh(self, versions=None):
+        # Reads always see the latest transaction, so only the cached values of this process become stale
+        if versions is None or versions != self.refreshed:
+            self._bump_version()
+        self.refreshed = dict(versions or {})
+
+    def _bump_version(self):
+        db_versions[self.db_path] = next(versions)
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return decode(row[0]) if row is not None else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = dict.fromkeys(keys)
+        with self.lock:
+            for i in range(0, len(keys), MAX_VARIABLES):
+                chunk = keys[i:i + MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(f"SELECT key, value FROM state WHERE key IN ({placeholders})", chunk)
+                for key, value in rows:
+                    values[key] = value
+
+        for key, value in values.items():
+            if value is not None:
+                values[key] = decode(value)
+
+        return values
+
+    def set_many(self, writes, block_num=None, executor=None, max_workers=None, encoded=None):
+        # Everything goes into one transaction, so there is nothing to parallelize
+        start = time.perf_counter()
+        block_num = block_num if block_num is not None else constants.BLOCK_NUM_DEFAULT
+
+        # Encodings passed in are JSON, so the binary format has to encode again
+        encoded = encoded if encoded is not None and not self.binary else {}
+
+        rows = []
+        deletes = []
+        for key, value in writes.items():
+            if value is None:
+                deletes.append((key,))
+            else:
+                data = encoded.get(key)
+                if data is None:
+                    data = self.encode(value)
+                rows.append((key, parse_key(key)[0], data, block_num))
+
+        with self.lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT INTO state (key, name, value, block) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value, block = excluded.block",
+                    rows
+                )
+                self.conn.executemany("DELETE FROM state WHERE key = ?", deletes)
+            self._bump_version()
+
+        return {str(self.db_path): time.perf_counter() - start}
+
+    def delete_many(self, keys):
+        self.set_many({key: None for key in keys})
+
+    def iter_prefix(self, prefix="", length=0):
+        query = "SELECT key FROM state WHERE key >= ?"
+        params = [prefix]
+
+        upper = prefix_upper_bound(prefix)
+        if upper is not None:
+            query += " AND key < ?"
+            params.append(upper)
+
+        query += " ORDER BY key"
+        if length > 0:
+            query += " LIMIT ?"
+            params.append(length)
+
+        with self.lock:
+            return [row[0] for row in self.conn.execute(query, params)]
+
+    def snapshot(self, destination):
+        snapshot = SQLiteBackend(destination, self.db_path.name, self.binary)
+        with self.lock:
+            self.conn.backup(snapshot.conn)
+        return snapshot
+
+    def names(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT name FROM state ORDER BY name")]
+
+    def exists(self, name):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM state WHERE name = ? LIMIT 1", (name,)).fetchone() is not None
+
+    def drop(self, name):
+        with self.lock:
+            self.conn.execute("DELETE FROM state WHERE name = ?", (name,))
+            self._bump_version()
+
+    def flush(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM state")
+            self._bump_version()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,211 @@
+from pathlib import Path
+from contracting.storage.encoder import encode, decode
+
+import logging
+import os
+import struct
+import threading
+import zlib
+
+# Every record is framed by its payload length and CRC32 so a torn write at the end of the log is detected
+HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".log"
+CHECKPOINT_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class WriteAheadLog:
+    """
+    Append-only log of the writes applied by Driver.hard_apply.
+
+    Each block is appended as one record and fsynced once, after which the block is durable. A background thread
+    checkpoints the logged writes into the storage backend every interval seconds and then removes them from the
+    log. Until a write is checkpointed it is served from memory through get(). Records left over by a crash are
+    replayed into the backend by recover().
+
+    The log is a directory of numbered segment files. A checkpoint closes the current segment so new blocks can be
+    appended while the closed segments are applied.
+    """
+
+    def __init__(self, directory, interval=CHECKPOINT_INTERVAL):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.interval = interval
+
+        # Guards pending, last_nanos and the current segment
+        self.lock = threading.Lock()
+        # Only one checkpoint runs at a time
+        self.checkpoint_lock = threading.Lock()
+
+        self.pending = {}
+        self.last_nanos = None
+        self.segment = None
+
+        self.thread = None
+        self.stopped = threading.Event()
+        self.last_error = None
+
+    def segments(self):
+        return sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def _open_segment(self):
+        existing = self.segments()
+        number = int(existing[-1].stem) + 1 if existing else 1
+        self.segment = open(self.directory.joinpath(f"{number:012d}{SEGMENT_SUFFIX}"), "ab")
+        # The new file's directory entry must be durable too, or a crash can lose the whole segment
+        self._sync_directory()
+
+    def _sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def append(self, nanos, writes):
+        """
+        Durably log the writes of one block. A value of None deletes the key.
+        """
+        payload = encode({"nanos": nanos, "writes": writes}).encode()
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self.lock:
+            if self.segment is None:
+                self._open_segment()
+
+            self.segment.write(record)
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+
+            self.pending.update(writes)
+            self.last_nanos = nanos
+
+    def get(self, key, default=None):
+        """
+        Return the logged value of a key that is not checkpointed yet, or default.
+        """
+        return self.pending.get(key, default)
+
+    def items(self):
+        with self.lock:
+            return list(self.pending.items())
+
+    def checkpoint(self, backend):
+        """
+        Apply every logged write to the backend and remove it from the log.
+        """
+        with self.checkpoint_lock:
+            with self.lock:
+                self._close_segment()
+                paths = self.segments()
+                applied = dict(self.pending)
+                nanos = self.last_nanos
+
+            if not paths:
+                return
+
+            if applied:
+                backend.set_many(applied, block_num=nanos)
+
+            for path in paths:
+                path.unlink()
+
+            with self.lock:
+                # Keys written again since the segments were closed stay pending
+                for key, value in applied.items():
+                    if key in self.pending and self.pending[key] is value:
+                        del self.pending[key]
+
+    def recover(self, backend):
+        """
+        Replay the records left in the log into the backend, e.g. after a crash. Reading stops at the first torn
+        or corrupted record.
+        """
+        with self.checkpoint_lock:
+            with self.lock:
+                self._close_segment()
+                paths = self.segments()
+
+            writes = {}
+            nanos = None
+            for path in paths:
+                for record in self.read(path):
+                    writes.update(record["writes"])
+                    nanos = record["nanos"]
+
+            if writes:
+                backend.set_many(writes, block_num=nanos)
+
+            for path in paths:
+                path.unlink()
+
+    @staticmethod
+    def read(path):
+        """
+        Yield the decoded records of a segment file.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, offset)
+            payload = data[offset + HEADER.size:offset + HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            yield decode(payload)
+            offset += HEADER.size + length
+
+    def start(self, backend):
+        """
+        Start checkpointing into the backend in the background.
+        """
+        if self.thread is not None:
+            return
+
+        def run():
+            while not self.stopped.wait(self.interval):
+                try:
+                    self.checkpoint(backend)
+                    self.last_error = None
+                except Exception as e:
+                    # The writes stay in the log and are retried on the next interval
+                    self.last_error = e
+                    logger.exception("Background checkpoint of %s failed", self.directory)
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=run, name="wal-checkpoint", daemon=True)
+        self.thread.start()
+
+    def stop(self, backend=None):
+        """
+        Stop the background checkpoints, running a final one if a backend is given.
+        """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+        if backend is not None:
+            self.checkpoint(backend)
+
+        with self.lock:
+            self._close_segment()
+
+    def clear(self):
+        """
+        Drop every logged write without applying it.
+        """
+        with self.checkpoint_lock:
+            with self.lock:
+                self._close_segment()
+                for path in self.segments():
+                    path.unlink()
+                self.pending.clear()
+                self.last_nanos = None
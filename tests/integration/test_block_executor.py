@@ -0,0 +1,142 @@
+from unittest import TestCase, mock
+from contracting.storage.driver import Driver
+from contracting.execution.executor import Executor
+from contracting.execution.parallel import BlockExecutor, Speculation, _written
+
+import os
+
+
+def submission_kwargs_for_file(f):
+    split = f.split('/')
+    split = split[-1]
+    split = split.split('.')
+    contract_name = split[0]
+
+    with open(f) as file:
+        contract_code = file.read()
+
+    return {
+        'name': f'con_{contract_name}',
+        'code': contract_code,
+    }
+
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+
+def transfer(sender, to, amount, stamps=1000):
+    return {'sender': sender, 'contract_name': 'con_currency', 'function_name': 'transfer',
+            'kwargs': {'amount': amount, 'to': to}, 'stamps': stamps}
+
+
+class TestBlockExecutor(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush_full()
+
+        submission_path = os.path.join(os.path.dirname(__file__), "test_contracts", "submission.s.py")
+
+        with open(submission_path) as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        self.e = Executor(driver=self.d, currency_contract='con_currency')
+
+        currency_path = os.path.join(os.path.dirname(__file__), "test_contracts", "currency.s.py")
+        self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs=submission_kwargs_for_file(currency_path), metering=False,
+                       auto_commit=True)
+
+        for account in ['colin', 'raghu', 'tejas', 'alex']:
+            self.d.set(f'con_currency.balances:{account}', 1000)
+        self.d.commit()
+
+        self.block = BlockExecutor(self.e, workers=2)
+
+    def tearDown(self):
+        self.block.close()
+        self.d.flush_full()
+
+    def test_block_matches_serial_execution(self):
+        import_this_path = os.path.join(os.path.dirname(__file__), "test_contracts", "import_this.s.py")
+
+        txs = [
+            transfer('stu', 'jeff', 10),
+            transfer('colin', 'mario', 10),
+            transfer('raghu', 'luigi', 10),
+            # Same sender as the first transaction
+            transfer('stu', 'jeff', 20),
+            # Spends what the second transaction sent
+            transfer('mario', 'peach', 5, stamps=100),
+            # Fails, but still pays for its stamps
+            transfer('tejas', 'bowser', 5000),
+            transfer('alex', 'toad', 10, stamps=1),
+            {**TEST_SUBMISSION_KWARGS, 'kwargs': submission_kwargs_for_file(import_this_path), 'stamps': 5000},
+            {'sender': 'alex', 'contract_name': 'con_import_this', 'function_name': 'howdy', 'kwargs': {},
+             'stamps': 1000},
+        ]
+        self.d.set('con_currency.balances:mario', 0)
+
+        expected = [self.e.execute(**tx) for tx in txs]
+        expected_reads = list(self.d.pending_reads.items())
+        expected_writes = dict(self.d.pending_writes)
+        self.d.flush_cache()
+
+        self.d.set('con_currency.balances:mario', 0)
+
+        with mock.patch.object(BlockExecutor, 'reexecute', autospec=True,
+                               side_effect=BlockExecutor.reexecute) as reexecute:
+            outputs = self.block.execute(txs)
+
+        self.assertEqual(self.d.pending_writes, expected_writes)
+        self.assertEqual(list(self.d.pending_reads.items()), expected_reads)
+        self.assertEqual(self.d.journal, [])
+
+        for output, serial_output in zip(outputs, expected):
+            result = output.pop('result')
+            serial_result = serial_output.pop('result')
+            if isinstance(serial_result, Exception):
+                self.assertEqual(repr(result), repr(serial_result))
+            else:
+                self.assertEqual(result, serial_result)
+            self.assertEqual(output, serial_output)
+
+        self.assertEqual([output['status_code'] for output in outputs], [0, 0, 0, 0, 0, 1, 1, 0, 0])
+
+        # The second transfer from stu, the transfer from mario, the submission (stu pays for stamps) and the call
+        # to the submitted contract
+        reexecuted = [call.args[1] for call in reexecute.call_args_list]
+        self.assertEqual(reexecuted, [txs[3], txs[4], txs[7], txs[8]])
+
+    def test_empty_block(self):
+        self.assertEqual(self.block.execute([]), [])
+        self.assertIsNone(self.block.pool)
+
+
+class TestSpeculation(TestCase):
+    def test_conflicts(self):
+        speculation = Speculation({}, {'con_currency.balances:stu': 100}, {}, ['con_thing.items:'])
+
+        self.assertFalse(speculation.conflicts({'con_currency.balances:jeff'}))
+        self.assertTrue(speculation.conflicts({'con_currency.balances:stu'}))
+        self.assertTrue(speculation.conflicts({'con_thing.items:1'}))
+
+    def test_containers_read_in_a_savepoint_are_not_written(self):
+        driver = Driver()
+        driver.set('con_thing.items', [1])
+        driver.set('con_thing.owner', 'stu')
+
+        driver.savepoint()
+        driver.get('con_thing.items')
+        driver.set('con_thing.owner', 'stu')
+        self.assertEqual(_written(driver), {})
+
+        driver.get('con_thing.items').append(2)
+        driver.set('con_thing.count', 1)
+        self.assertEqual(_written(driver), {'con_thing.items': [1, 2], 'con_thing.count': 1})
+
@@ -0,0 +1,146 @@
+from unittest import TestCase, mock
+from contracting.storage.driver import Driver, COMPILED_KEY
+from contracting.execution.executor import Executor
+from contracting.execution import executor, module, runtime
+
+import marshal
+import os
+
+
+def submission_kwargs_for_file(f):
+    split = f.split('/')
+    split = split[-1]
+    split = split.split('.')
+    contract_name = split[0]
+
+    with open(f) as file:
+        contract_code = file.read()
+
+    return {
+        'name': f'con_{contract_name}',
+        'code': contract_code,
+    }
+
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+TXS = [
+    {'sender': 'stu', 'contract_name': 'con_currency', 'function_name': 'transfer',
+     'kwargs': {'amount': 100, 'to': 'colin'}},
+    # Loads con_stubucks while metered
+    {'sender': 'stu', 'contract_name': 'con_dynamic_importing', 'function_name': 'balance_for_token',
+     'kwargs': {'tok': 'con_stubucks', 'account': 'stu'}},
+    # Loads con_importing_that and con_import_this before metering starts
+    {'sender': 'stu', 'contract_name': 'con_importing_that', 'function_name': 'test', 'kwargs': {}},
+    {'sender': 'colin', 'contract_name': 'con_dynamic_importing', 'function_name': 'balance_for_token',
+     'kwargs': {'tok': 'con_stubucks', 'account': 'colin'}, 'stamps': 1000},
+    {'sender': 'stu', 'contract_name': 'con_dynamic_importing', 'function_name': 'is_erc20_compatible',
+     'kwargs': {'tok': 'con_importing_that'}},
+    {'sender': 'stu', 'contract_name': 'con_currency', 'function_name': 'transfer',
+     'kwargs': {'amount': 100, 'to': 'colin'}, 'stamps': 1},
+    {'sender': 'stu', 'contract_name': 'con_dynamic_importing', 'function_name': 'balance_for_token',
+     'kwargs': {'tok': 'con_tejastokens', 'account': 'stu'}},
+]
+
+
+class TestExecuteBatch(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush_full()
+
+        submission_path = os.path.join(os.path.dirname(__file__), "test_contracts", "submission.s.py")
+
+        with open(submission_path) as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        self.e = Executor(driver=self.d, currency_contract='con_currency')
+
+        for name in ['currency', 'stubucks', 'tejastokens', 'dynamic_importing', 'import_this', 'importing_that']:
+            path = os.path.join(os.path.dirname(__file__), "test_contracts", f"{name}.s.py")
+            self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs=submission_kwargs_for_file(path), metering=False,
+                           auto_commit=True)
+
+        self.d.set('con_currency.balances:colin', 1000)
+        self.d.commit()
+
+        runtime.rt.residency.clear()
+
+    def tearDown(self):
+        self.d.flush_full()
+
+    def run_and_trace(self, run):
+        costs = []
+        tracer = runtime.rt.tracer
+        reset = tracer.reset
+
+        # The tracer is reset after each transaction, record what it cost first
+        def record():
+            costs.append(tracer.cost)
+            reset()
+
+        with mock.patch.object(tracer, 'reset', side_effect=record), \
+                mock.patch.object(module.marshal, 'loads', wraps=marshal.loads) as loads:
+            outputs = run()
+
+        return outputs, costs, loads.call_count
+
+    def test_outputs_match_sequential_execution(self):
+        def sequential():
+            return [self.e.execute(**tx) for tx in TXS]
+
+        expected, expected_costs, expected_loads = self.run_and_trace(sequential)
+        expected_reads = list(self.d.pending_reads.items())
+        expected_writes = dict(self.d.pending_writes)
+        self.d.flush_cache()
+
+        outputs, costs, loads = self.run_and_trace(lambda: self.e.execute_batch(TXS))
+
+        # Every output refers to the pending reads of the driver, which are cleared by flush_cache()
+        self.assertEqual(list(self.d.pending_reads.items()), expected_reads)
+        for output in expected:
+            output['reads'] = self.d.pending_reads
+
+        self.assertEqual(costs, expected_costs)
+        self.assertEqual(len(outputs), len(expected))
+        for output, sequential_output in zip(outputs, expected):
+            result = output.pop('result')
+            sequential_result = sequential_output.pop('result')
+            if isinstance(sequential_result, Exception):
+                self.assertEqual(repr(result), repr(sequential_result))
+            else:
+                self.assertEqual(result, sequential_result)
+            self.assertEqual(output, sequential_output)
+
+        self.assertEqual(self.d.pending_writes, expected_writes)
+        self.assertEqual([output['status_code'] for output in outputs], [0, 0, 0, 0, 0, 1, 0])
+
+        # Each contract is loaded once, by the first transaction that imports it
+        self.assertEqual(expected_loads, 6)
+        self.assertEqual(loads, 0)
+
+    def test_changed_code_is_loaded_again(self):
+        tx = {'sender': 'stu', 'contract_name': 'con_import_this', 'function_name': 'howdy', 'kwargs': {}}
+
+        def txs():
+            yield tx
+            code = compile('def howdy():\n    return 54321\n', '', 'exec')
+            self.d.set_var('con_import_this', COMPILED_KEY, value=marshal.dumps(code))
+            yield tx
+
+        outputs = self.e.execute_batch(txs(), metering=False)
+        self.assertEqual([o['result'] for o in outputs], [12345, 54321])
+
+    def test_loader_is_installed_once(self):
+        with mock.patch.object(executor, 'install_database_loader', wraps=executor.install_database_loader) as install:
+            outputs = self.e.execute_batch(TXS[:3])
+
+        self.assertEqual([o['status_code'] for o in outputs], [0, 0, 0])
+        install.assert_called_once_with(driver=self.d)
+
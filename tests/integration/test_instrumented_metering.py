@@ -0,0 +1,137 @@
+from unittest import TestCase, mock, skipUnless
+from contracting.storage.driver import Driver
+from contracting.execution.executor import Executor
+from contracting.execution.tracer import Tracer, COUNT_ALL_LINES, COUNT_CONTRACT_LINES
+from contracting.execution import runtime
+from contracting.compilation import metering
+
+import os
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+LEDGER_CODE = '''
+import con_currency
+
+balances = Hash(default_value=0)
+Paid = LogEvent(event='Paid', params={'to': {'type': str}})
+
+def credit(account, amount):
+    balances[account] += amount
+    Paid({'to': account})
+
+@export
+def spread(accounts: list, amount: int):
+    for account in accounts:
+        if account == ctx.caller:
+            continue
+        credit(account, amount)
+    paid = [a for a in accounts
+        if balances[a] > amount]
+    i = 0
+    while i < len(accounts):
+        i += 1
+    return len(paid) + i
+
+@export
+def top_up(amount: int, to: str):
+    assert amount > 0, 'Amount must be positive!'
+    return con_currency.balance(account=to) + amount
+
+@export
+def spin():
+    i = 0
+    while True:
+        i += 1
+'''
+
+TRANSACTIONS = [
+    ('con_ledger', 'spread', {'accounts': ['stu', 'colin', 'raghu'], 'amount': 5}, 1000),
+    ('con_ledger', 'spread', {'accounts': ['raghu'] * 50, 'amount': 1}, 1000),
+    ('con_ledger', 'top_up', {'amount': 10, 'to': 'colin'}, 1000),
+    ('con_ledger', 'top_up', {'amount': -1, 'to': 'raghu'}, 1000),
+    ('con_ledger', 'spin', {}, 300),
+    ('con_currency', 'transfer', {'amount': 100, 'to': 'colin'}, 1000),
+    ('con_currency', 'transfer', {'amount': 100, 'to': 'colin'}, 1),
+]
+
+
+class TestInstrumentedMetering(TestCase):
+    def setUp(self):
+        self.d = Driver()
+
+    def tearDown(self):
+        self.d.flush_full()
+
+    def run_transactions(self, instrumented, call_count_rule=COUNT_ALL_LINES):
+        self.d.flush_full()
+
+        submission_path = os.path.join(os.path.dirname(__file__), "test_contracts", "submission.s.py")
+        currency_path = os.path.join(os.path.dirname(__file__), "test_contracts", "currency.s.py")
+
+        with open(submission_path) as f:
+            self.d.set_contract(name='submission', code=f.read())
+        self.d.commit()
+
+        executor = Executor(driver=self.d, currency_contract='con_currency', instrumented=instrumented,
+                            call_count_rule=call_count_rule)
+        runtime.rt.residency.clear()
+
+        with open(currency_path) as f:
+            executor.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': 'con_currency', 'code': f.read()},
+                             metering=False, auto_commit=True)
+        executor.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': 'con_ledger', 'code': LEDGER_CODE},
+                         metering=False, auto_commit=True)
+
+        outputs = []
+        for contract, function, kwargs, stamps in TRANSACTIONS:
+            output = executor.execute('stu', contract, function, kwargs=kwargs, stamps=stamps, auto_commit=True)
+            outputs.append((output['status_code'], output['stamps_used'], output['writes'], output['events']))
+
+        return outputs
+
+    def test_call_count_rule_decides_the_infinite_loop_guard(self):
+        # Spreading to 50 accounts charges a few hundred contract lines, but runs thousands of lines in the runtime
+        with mock.patch.object(runtime.rt.tracer, 'max_call_count', 1000):
+            all_lines = self.run_transactions(instrumented=False)
+            contract_lines = self.run_transactions(instrumented=False, call_count_rule=COUNT_CONTRACT_LINES)
+
+        self.assertEqual(all_lines[1][0], 1)
+        self.assertEqual(contract_lines[1][0], 0)
+
+    def test_unknown_call_count_rule(self):
+        with self.assertRaises(AssertionError):
+            Executor(driver=self.d, call_count_rule=3)
+
+    @skipUnless(metering.INSTRUMENTABLE, 'Line events are modelled for Python 3.11')
+    def test_instrumented_contracts_charge_the_stamps_tracing_charges(self):
+        traced = self.run_transactions(instrumented=False)
+
+        self.assertEqual(self.run_transactions(instrumented=True), traced)
+
+        # Without counting lines outside contracts, instrumented contracts are not traced at all
+        with mock.patch.object(Tracer, 'hook', autospec=True, side_effect=Tracer.hook) as hook:
+            instrumented = self.run_transactions(instrumented=True, call_count_rule=COUNT_CONTRACT_LINES)
+
+        self.assertEqual(hook.call_count, 0)
+        self.assertEqual(instrumented, traced)
+        self.assertEqual([status for status, *_ in traced], [0, 0, 0, 1, 1, 0, 1])
+
+    def test_contracts_that_cannot_be_instrumented_are_traced(self):
+        traced = self.run_transactions(instrumented=False)
+
+        with mock.patch.object(metering, 'instrument', return_value=None):
+            with mock.patch.object(Tracer, 'hook', autospec=True, side_effect=Tracer.hook) as hook:
+                instrumented = self.run_transactions(instrumented=True)
+
+        self.assertGreater(hook.call_count, 0)
+        self.assertEqual(instrumented, traced)
+
+    def test_modules_are_loaded_again_for_the_other_mode(self):
+        traced = self.run_transactions(instrumented=False)
+        instrumented = self.run_transactions(instrumented=True)
+        self.assertEqual(self.run_transactions(instrumented=False), traced)
+        self.assertEqual(instrumented, traced)
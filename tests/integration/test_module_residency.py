@@ -0,0 +1,136 @@
+from unittest import TestCase, mock
+from contracting.storage.driver import Driver
+from contracting.execution.executor import Executor
+from contracting.execution import module, runtime
+
+import marshal
+import os
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+ENV_CODE = '''
+@export
+def env_var():
+    return block_num
+'''
+
+COUNTER_CODE = '''
+counter = Variable()
+start = counter.get()
+
+@export
+def increment():
+    counter.set((counter.get() or 0) + 1)
+    return start
+'''
+
+MUTABLE_CODE = '''
+items = []
+
+@export
+def add():
+    items.append(1)
+    return len(items)
+'''
+
+EVENT_CODE = '''
+owner = Variable()
+Ping = LogEvent(event='Ping', params={'n': {'type': int}})
+
+@export
+def ping(n: int):
+    owner.set(ctx.signer)
+    Ping({'n': n})
+'''
+
+
+class TestModuleResidency(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush_full()
+
+        submission_path = os.path.join(os.path.dirname(__file__), "test_contracts", "submission.s.py")
+
+        with open(submission_path) as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        self.e = Executor(driver=self.d, metering=False)
+        runtime.rt.residency.clear()
+
+    def tearDown(self):
+        self.d.flush_full()
+
+    def submit(self, name, code):
+        output = self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': name, 'code': code}, auto_commit=True)
+        self.assertEqual(output['status_code'], 0)
+
+    def call(self, contract, function, sender='stu', kwargs={}, environment={}, executor=None):
+        executor = executor or self.e
+        return executor.execute(sender=sender, contract_name=contract, function_name=function, kwargs=dict(kwargs),
+                                environment=environment)
+
+    def count_loads(self, run):
+        with mock.patch.object(module.marshal, 'loads', wraps=marshal.loads) as loads:
+            outputs = run()
+        return outputs, loads.call_count
+
+    def test_environment_is_bound_again(self):
+        self.submit('con_env', ENV_CODE)
+
+        outputs, loads = self.count_loads(lambda: [
+            self.call('con_env', 'env_var', environment={'block_num': 1}),
+            self.call('con_env', 'env_var', environment={'block_num': 2}),
+            self.call('con_env', 'env_var'),
+        ])
+
+        self.assertEqual(loads, 1)
+        self.assertEqual([o['result'] for o in outputs[:2]], [1, 2])
+        self.assertIsInstance(outputs[2]['result'], NameError)
+
+    def test_body_reading_state_is_loaded_again(self):
+        self.submit('con_counter', COUNTER_CODE)
+
+        outputs, loads = self.count_loads(lambda: [self.call('con_counter', 'increment') for _ in range(3)])
+
+        self.assertEqual(loads, 3)
+        self.assertEqual([o['result'] for o in outputs], [None, 1, 2])
+
+    def test_mutable_module_values_are_loaded_again(self):
+        self.submit('con_mutable', MUTABLE_CODE)
+
+        outputs, loads = self.count_loads(lambda: [self.call('con_mutable', 'add') for _ in range(3)])
+
+        self.assertEqual(loads, 3)
+        self.assertEqual([o['result'] for o in outputs], [1, 1, 1])
+
+    def test_orm_objects_are_bound_to_the_transaction(self):
+        self.submit('con_events', EVENT_CODE)
+        other = Driver()
+        other_executor = Executor(driver=other, metering=False)
+
+        outputs, loads = self.count_loads(lambda: [
+            self.call('con_events', 'ping', sender='stu', kwargs={'n': 1}),
+            self.call('con_events', 'ping', sender='jeff', kwargs={'n': 2}, executor=other_executor),
+        ])
+
+        self.assertEqual(loads, 1)
+        self.assertEqual([o['events'][0]['signer'] for o in outputs], ['stu', 'jeff'])
+        self.assertEqual(self.d.pending_writes['con_events.owner'], 'stu')
+        self.assertEqual(other.pending_writes['con_events.owner'], 'jeff')
+
+    def test_changed_code_is_loaded_again(self):
+        self.submit('con_env', ENV_CODE)
+        self.call('con_env', 'env_var', environment={'block_num': 1})
+
+        code = compile('def env_var():\n    return 54321\n', '', 'exec')
+        self.d.set_var('con_env', '__compiled__', value=marshal.dumps(code))
+
+        output = self.call('con_env', 'env_var', environment={'block_num': 1})
+        self.assertEqual(output['result'], 54321)
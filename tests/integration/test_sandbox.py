@@ -0,0 +1,179 @@
+from unittest import TestCase, mock
+from concurrent.futures.process import BrokenProcessPool
+from contracting.storage.driver import Driver
+from contracting.execution.executor import Executor
+from contracting.execution.sandbox import Sandbox
+
+import os
+
+
+def submission_kwargs_for_file(f):
+    split = f.split('/')
+    split = split[-1]
+    split = split.split('.')
+    contract_name = split[0]
+
+    with open(f) as file:
+        contract_code = file.read()
+
+    return {
+        'name': f'con_{contract_name}',
+        'code': contract_code,
+    }
+
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+
+def transfer(sender, to, amount, stamps=1000):
+    return {'sender': sender, 'contract_name': 'con_currency', 'function_name': 'transfer',
+            'kwargs': {'amount': amount, 'to': to}, 'stamps': stamps}
+
+
+class TestSandbox(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush_full()
+
+        submission_path = os.path.join(os.path.dirname(__file__), "test_contracts", "submission.s.py")
+
+        with open(submission_path) as f:
+            contract = f.read()
+
+        self.d.set_contract(name='submission', code=contract)
+        self.d.commit()
+
+        self.e = Executor(driver=self.d, currency_contract='con_currency', production=True)
+
+        currency_path = os.path.join(os.path.dirname(__file__), "test_contracts", "currency.s.py")
+        self.e.execute(**TEST_SUBMISSION_KWARGS, kwargs=submission_kwargs_for_file(currency_path), metering=False,
+                       auto_commit=True)
+
+    def tearDown(self):
+        self.e.sandbox.terminate()
+        self.d.flush_full()
+
+    def test_executor_has_sandbox_in_production(self):
+        self.assertIsInstance(self.e.sandbox, Sandbox)
+        self.assertIsNone(Executor(driver=self.d).sandbox)
+
+    def test_outputs_match_local_execution(self):
+        txs = [
+            transfer('stu', 'jeff', 10),
+            transfer('jeff', 'mario', 5, stamps=100),
+            # Fails, but still pays for its stamps
+            transfer('stu', 'bowser', 10 ** 12),
+        ]
+
+        expected = [self.e.execute(**tx) for tx in txs]
+        expected_writes = dict(self.d.pending_writes)
+        self.d.flush_cache()
+
+        outputs = [self.e.sandbox.execute(**tx) for tx in txs]
+
+        self.assertEqual(self.d.pending_writes, expected_writes)
+        for output, local_output in zip(outputs, expected):
+            result = output.pop('result')
+            local_result = local_output.pop('result')
+            if isinstance(local_result, Exception):
+                self.assertEqual(repr(result), repr(local_result))
+            else:
+                self.assertEqual(result, local_result)
+            output.pop('reads')
+            local_output.pop('reads')
+            self.assertEqual(output, local_output)
+
+        self.assertEqual([output['status_code'] for output in outputs], [0, 0, 1])
+        self.assertEqual(self.d.journal, [])
+
+    def test_auto_commit(self):
+        self.e.sandbox.execute(**transfer('stu', 'jeff', 10), auto_commit=True)
+
+        self.assertFalse(self.d.pending_writes)
+        self.assertEqual(self.d.get('con_currency.balances:jeff'), 10)
+
+    def test_workers_are_reused(self):
+        self.e.sandbox.execute(**transfer('stu', 'jeff', 10))
+        pool = self.e.sandbox.pool
+        processes = set(pool._processes)
+
+        self.e.sandbox.execute(**transfer('stu', 'jeff', 10))
+
+        self.assertIs(self.e.sandbox.pool, pool)
+        self.assertEqual(set(pool._processes), processes)
+        self.assertEqual(self.d.get('con_currency.balances:jeff'), 20)
+
+    def test_dead_workers_are_replaced(self):
+        self.e.sandbox.execute(**transfer('stu', 'jeff', 10))
+        pool = self.e.sandbox.pool
+
+        for process in list(pool._processes.values()):
+            process.kill()
+            process.join()
+
+        output = self.e.sandbox.execute(**transfer('stu', 'jeff', 10))
+
+        self.assertEqual(output['status_code'], 0)
+        self.assertIsNot(self.e.sandbox.pool, pool)
+        self.assertEqual(self.d.get('con_currency.balances:jeff'), 20)
+
+    def test_workers_read_what_was_committed_since(self):
+        self.e.sandbox.execute(**transfer('stu', 'jeff', 10), auto_commit=True)
+        self.d.set('con_currency.balances:jeff', 100)
+        self.d.commit()
+
+        output = self.e.sandbox.execute(**transfer('jeff', 'mario', 60), auto_commit=True)
+
+        self.assertEqual(output['status_code'], 0)
+        self.assertEqual(self.d.get('con_currency.balances:jeff'), 40 - output['stamps_used'] / 20)
+        self.assertEqual(self.d.get('con_currency.balances:mario'), 60)
+
+    def test_only_changed_pending_writes_are_sent(self):
+        self.e.sandbox.execute(**transfer('stu', 'jeff', 10))
+        self.e.sandbox.base()
+        self.d.set('con_currency.balances:mario', 5)
+
+        generation, previous, writes = self.e.sandbox.base()
+
+        self.assertEqual(previous, generation - 1)
+        self.assertEqual(writes, {'con_currency.balances:mario': 5})
+
+        self.d.commit()
+        _, previous, writes = self.e.sandbox.base()
+
+        self.assertIsNone(previous)
+        self.assertEqual(writes, {})
+
+    def test_crashed_transaction_pays_for_its_stamps(self):
+        balance = self.d.get('con_currency.balances:stu')
+
+        with mock.patch.object(Sandbox, 'run', side_effect=BrokenProcessPool()):
+            output = self.e.sandbox.execute(**transfer('stu', 'jeff', 10, stamps=500))
+
+        self.assertEqual(output['status_code'], 1)
+        self.assertEqual(output['stamps_used'], 500)
+        self.assertEqual(output['writes'], {'con_currency.balances:stu': balance - 500 / 20})
+        self.assertEqual(self.d.get('con_currency.balances:stu'), balance - 500 / 20)
+
+    def test_failed_transaction_with_auto_commit_matches_local_execution(self):
+        failing = transfer('stu', 'bowser', 10 ** 12)
+
+        self.e.execute(**transfer('stu', 'jeff', 10))
+        expected = self.e.execute(**failing, auto_commit=True)
+        expected_state = self.d.get_all_contract_state()
+
+        self.d.flush_full()
+        self.setUp()
+
+        self.e.sandbox.execute(**transfer('stu', 'jeff', 10))
+        output = self.e.sandbox.execute(**failing, auto_commit=True)
+
+        self.assertEqual(output['stamps_used'], expected['stamps_used'])
+        self.assertEqual(output['writes'], expected['writes'])
+        self.assertFalse(self.d.pending_writes)
+        self.assertEqual(self.d.get_all_contract_state(), expected_state)
+
@@ -0,0 +1,152 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from contracting.storage.driver import Driver
+from contracting.execution.executor import Executor
+from contracting.execution import runtime, tracer
+
+import os
+import threading
+
+TEST_SUBMISSION_KWARGS = {
+    'sender': 'stu',
+    'contract_name': 'submission',
+    'function_name': 'submit_contract'
+}
+
+LEDGER_CODE = '''
+import con_currency
+
+balances = Hash(default_value=0)
+
+@export
+def spread(accounts: list, amount: int):
+    for account in accounts:
+        balances[account] += amount
+    return [balances[account] for account in accounts]
+
+@export
+def env_var():
+    return block_num
+
+@export
+def roll(n: int):
+    random.seed()
+    return [random.randint(0, 1000) for i in range(n)]
+
+@export
+def caller():
+    return ctx.caller, ctx.signer, con_currency.balance(account=ctx.signer)
+
+@export
+def spin():
+    i = 0
+    while True:
+        i += 1
+'''
+
+
+def transactions(n):
+    return [
+        ('stu', 'con_ledger', 'spread', {'accounts': ['a', 'b', f'c{n}'], 'amount': n}, {}, 1000),
+        ('colin', 'con_ledger', 'env_var', {}, {'block_num': n}, 1000),
+        ('stu', 'con_ledger', 'roll', {'n': 5}, {'block_num': n, 'block_hash': 'ab' * n}, 1000),
+        ('colin', 'con_ledger', 'caller', {}, {}, 1000),
+        ('stu', 'con_ledger', 'spin', {}, {}, 100 + n),
+        ('stu', 'con_currency', 'transfer', {'amount': n, 'to': 'colin'}, {}, 1000),
+    ] * 3
+
+
+class TestThreadedExecution(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush_full()
+
+        submission_path = os.path.join(os.path.dirname(__file__), "test_contracts", "submission.s.py")
+        currency_path = os.path.join(os.path.dirname(__file__), "test_contracts", "currency.s.py")
+
+        with open(submission_path) as f:
+            self.d.set_contract(name='submission', code=f.read())
+        self.d.commit()
+
+        executor = Executor(driver=self.d, currency_contract='con_currency', metering=False)
+        with open(currency_path) as f:
+            contracts = {'con_currency': f.read(), 'con_ledger': LEDGER_CODE}
+
+        for name, code in contracts.items():
+            output = executor.execute(**TEST_SUBMISSION_KWARGS, kwargs={'name': name, 'code': code}, auto_commit=True)
+            self.assertEqual(output['status_code'], 0)
+
+    def tearDown(self):
+        self.d.flush_full()
+
+    def execute(self, txs, barrier=None):
+        # Each simulation executes on its own driver, leaving its writes pending on it
+        executor = Executor(driver=Driver(), currency_contract='con_currency')
+        if barrier is not None:
+            barrier.wait()
+
+        outputs = []
+        for sender, contract, function, kwargs, environment, stamps in txs:
+            output = executor.execute(sender, contract, function, kwargs=dict(kwargs), environment=environment,
+                                      stamps=stamps)
+            result = output['result']
+            outputs.append((output['status_code'], repr(result) if isinstance(result, Exception) else result,
+                            output['stamps_used'], output['writes'], output['events']))
+
+        return outputs
+
+    def test_threads_execute_like_one_thread(self):
+        simulations = [transactions(n) for n in range(1, 5)]
+        expected = [self.execute(txs) for txs in simulations]
+
+        barrier = threading.Barrier(len(simulations))
+        with ThreadPoolExecutor(max_workers=len(simulations)) as pool:
+            outputs = list(pool.map(lambda txs: self.execute(txs, barrier), simulations))
+
+        self.assertEqual(outputs, expected)
+        self.assertEqual([output[1] for output in outputs[1][1::6]], [2, 2, 2])
+        self.assertEqual([output[0] for output in outputs[1][4::6]], [1, 1, 1])
+
+    def test_only_metered_transactions_wait_for_each_other(self):
+        # Like a stamp estimate
+        executor = Executor(driver=Driver(), currency_contract='con_currency', bypass_balance_amount=True)
+
+        def execute(metering):
+            return executor.execute('colin', 'con_ledger', 'env_var', kwargs={}, environment={'block_num': 1},
+                                    metering=metering)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # As if a metered transaction were running in another thread
+            tracer.start_tracing_memory()
+            try:
+                self.assertEqual(pool.submit(execute, False).result(timeout=10)['result'], 1)
+
+                metered = pool.submit(execute, True)
+                with self.assertRaises(TimeoutError):
+                    metered.result(timeout=0.5)
+            finally:
+                tracer.stop_tracing_memory()
+
+            self.assertEqual(metered.result(timeout=10)['result'], 1)
+
+    def test_threads_have_their_own_runtime(self):
+        barrier = threading.Barrier(2)
+        states = {}
+
+        def run(name):
+            runtime.rt.env['name'] = name
+            barrier.wait()
+            states[name] = (dict(runtime.rt.env), runtime.rt.tracer, runtime.rt.random)
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(states['a'][0], {'name': 'a'})
+        self.assertEqual(states['b'][0], {'name': 'b'})
+        self.assertNotIn('name', runtime.rt.env)
+        for a, b, main in zip(states['a'][1:], states['b'][1:], (runtime.rt.tracer, runtime.rt.random)):
+            self.assertIsNot(a, b)
+            self.assertIsNot(a, main)
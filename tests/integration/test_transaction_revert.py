@@ -0,0 +1,56 @@
+from unittest import TestCase
+from contracting.client import ContractingClient
+
+CONTRACT = '''
+items = Hash()
+
+@export
+def add(key: str, value: int, fail: bool):
+    values = items[key]
+    if values is None:
+        values = []
+    values.append(value)
+    items[key] = values
+    assert not fail, 'Failing on purpose.'
+'''
+
+
+class TestTransactionRevert(TestCase):
+    def setUp(self):
+        self.c = ContractingClient()
+        self.c.flush()
+        self.c.submit(CONTRACT, name="con_journal")
+        self.c.executor.driver.commit()
+        self.driver = self.c.executor.driver
+
+    def tearDown(self):
+        self.c.raw_driver.flush_full()
+
+    def add(self, value, fail=False):
+        return self.c.executor.execute(
+            contract_name="con_journal",
+            function_name="add",
+            kwargs={"key": "a", "value": value, "fail": fail},
+            sender="stu",
+        )
+
+    def test_failed_transaction_is_reverted(self):
+        first = self.add(1)
+        self.assertEqual(first["status_code"], 0)
+
+        failed = self.add(2, fail=True)
+        self.assertEqual(failed["status_code"], 1)
+        self.assertEqual(failed["writes"], {})
+
+        # The in-place append of the failed transaction does not leak into the block or earlier outputs
+        self.assertEqual(self.driver.pending_writes["con_journal.items:a"], [1])
+        self.assertEqual(first["writes"], {"con_journal.items:a": [1]})
+        self.assertEqual(self.driver.journal, [])
+
+        second = self.add(3)
+        self.assertEqual(second["writes"], {"con_journal.items:a": [1, 3]})
+        self.assertEqual(first["writes"], {"con_journal.items:a": [1]})
+
+    def test_failed_first_write_is_removed(self):
+        self.add(1, fail=True)
+        self.assertNotIn("con_journal.items:a", self.driver.pending_writes)
@@ -0,0 +1,181 @@
+from unittest import TestCase
+from contracting.compilation.analysis import analyze, analyze_contract, resolve_key
+from contracting.compilation.compiler import ContractingCompiler
+from contracting.storage.driver import Driver
+
+import os
+
+CODE = '''
+import con_currency
+
+balances = Hash()
+allowances = Hash(default_value=0)
+owner = Variable()
+supply = ForeignVariable(foreign_contract='con_other', foreign_name='supply')
+other_balances = ForeignHash(foreign_contract='con_other', foreign_name='balances')
+
+def debit(account: str, amount: float):
+    balances[account] -= amount
+
+@export
+def send(amount: float, to: str):
+    debit(ctx.caller, amount)
+    balances[to] += amount
+
+@export
+def approve(amount: float, to: str):
+    allowances[ctx.caller, to] = amount
+
+@export
+def set_owner(new: str):
+    assert owner.get() == ctx.caller
+    owner.set(new)
+
+@export
+def mirror(account: str):
+    balances[account] = other_balances[account] + supply.get()
+
+@export
+def reset(account: str):
+    allowances.clear(account)
+
+@export
+def pay(amount: float, token: str):
+    con_currency.transfer(amount=amount, to=ctx.caller)
+    importlib.import_module(token).transfer(amount=amount, to=ctx.caller)
+'''
+
+
+def arg(name):
+    return {'arg': name}
+
+
+def access(name, key, contract='con_test'):
+    return {'contract': contract, 'name': name, 'key': key}
+
+
+class TestAnalysis(TestCase):
+    def setUp(self):
+        self.analysis = analyze(CODE, 'con_test')
+
+    def test_only_exported_functions(self):
+        self.assertEqual(set(self.analysis), {'send', 'approve', 'set_owner', 'mirror', 'reset', 'pay'})
+
+    def test_helper_arguments_are_substituted(self):
+        send = self.analysis['send']
+        self.assertCountEqual(send['reads'], [access('balances', [{'ctx': 'caller'}]), access('balances', [arg('to')])])
+        self.assertCountEqual(send['writes'], send['reads'])
+
+    def test_multi_dimensional_hash(self):
+        approve = self.analysis['approve']
+        self.assertEqual(approve['reads'], [])
+        self.assertEqual(approve['writes'], [access('allowances', [{'ctx': 'caller'}, arg('to')])])
+
+    def test_variables(self):
+        set_owner = self.analysis['set_owner']
+        self.assertEqual(set_owner['reads'], [access('owner', [])])
+        self.assertEqual(set_owner['writes'], [access('owner', [])])
+
+    def test_foreign_orm(self):
+        mirror = self.analysis['mirror']
+        self.assertEqual(mirror['reads'], [access('balances', [arg('account')], 'con_other'),
+                                           access('supply', [], 'con_other')])
+        self.assertEqual(mirror['writes'], [access('balances', [arg('account')])])
+
+    def test_clear_is_a_prefix(self):
+        reset = self.analysis['reset']
+        self.assertEqual(reset['writes'], [access('allowances', [arg('account'), None])])
+
+    def test_calls(self):
+        self.assertEqual(self.analysis['pay']['calls'], [{'contract': 'con_currency', 'function': 'transfer'},
+                                                         {'contract': None, 'function': None}])
+
+    def test_compiled_code_matches_source(self):
+        compiled = ContractingCompiler(module_name='con_test').parse_to_code(CODE)
+        self.assertEqual(analyze(compiled, 'con_test'), self.analysis)
+
+    def test_resolve_key(self):
+        approve = self.analysis['approve']['writes'][0]
+        self.assertEqual(resolve_key(approve, {'to': 'jeff'}, {'caller': 'stu'}),
+                         ('con_test.allowances:stu:jeff', True))
+        self.assertEqual(resolve_key(approve, {}, {'caller': 'stu'}), ('con_test.allowances:stu:', False))
+
+        reset = self.analysis['reset']['writes'][0]
+        self.assertEqual(resolve_key(reset, {'account': 'stu'}, {}), ('con_test.allowances:stu:', False))
+
+        owner = self.analysis['set_owner']['writes'][0]
+        self.assertEqual(resolve_key(owner, {}, {}), ('con_test.owner', True))
+
+
+ESCAPING = '''
+balances = Hash()
+owner = Variable()
+
+def give(h: Any):
+    h[ctx.caller] = 1
+
+@export
+def alias(to: str):
+    h = balances
+    h[to] = 5
+
+@export
+def argument():
+    give(balances)
+
+@export
+def variable():
+    return [owner]
+
+@export
+def contains(account: str):
+    return account in balances
+'''
+
+
+class TestEscapingORM(TestCase):
+    def setUp(self):
+        self.analysis = analyze(ESCAPING, 'con_test')
+
+    def test_alias_reads_and_writes_everything(self):
+        alias = self.analysis['alias']
+        self.assertEqual(alias['reads'], [access('balances', [None])])
+        self.assertEqual(alias['writes'], [access('balances', [None])])
+
+    def test_argument_reads_and_writes_everything(self):
+        self.assertEqual(self.analysis['argument']['writes'], [access('balances', [None])])
+
+    def test_escaping_variable(self):
+        self.assertEqual(self.analysis['variable']['writes'], [access('owner', [])])
+
+    def test_contains_is_a_read(self):
+        contains = self.analysis['contains']
+        self.assertEqual(contains['reads'], [access('balances', [arg('account')])])
+        self.assertEqual(contains['writes'], [])
+
+
+class TestAnalyzeContract(TestCase):
+    def setUp(self):
+        self.d = Driver()
+        self.d.flush_full()
+
+    def tearDown(self):
+        self.d.flush_full()
+
+    def test_analyze_submitted_contract(self):
+        path = os.path.join(os.path.dirname(__file__), 'contracts', 'currency.s.py')
+
+        with open(path) as f:
+            code = ContractingCompiler(module_name='con_currency').parse_to_code(f.read())
+
+        self.d.set_contract(name='con_currency', code=code)
+        self.d.commit()
+        self.d.pending_reads.clear()
+
+        transfer = analyze_contract(self.d, 'con_currency')['transfer']
+        self.assertIn(access('balances', [{'ctx': 'signer'}], 'con_currency'), transfer['writes'])
+        self.assertIn(access('balances', [arg('to')], 'con_currency'), transfer['writes'])
+        self.assertFalse(self.d.pending_reads)
+
+    def test_missing_contract(self):
+        self.assertIsNone(analyze_contract(self.d, 'con_missing'))
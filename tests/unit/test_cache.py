@@ -0,0 +1,242 @@
+import unittest
+
+from unittest import mock
+
+from contracting.storage.cache import StateCache, FrequencySketch, Miss, Hit, sizeof, ENTRY_OVERHEAD
+from contracting.storage.driver import Driver
+
+
+def entry_size(key, value):
+    return sizeof(key) + sizeof(value) + ENTRY_OVERHEAD
+
+
+class TestStateCache(unittest.TestCase):
+    def test_mapping_interface(self):
+        cache = StateCache()
+        cache['a'] = 1
+        cache['b'] = [1, 2]
+
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache.get('b'), [1, 2])
+        self.assertIsNone(cache.get('c'))
+        self.assertIn('a', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(sorted(cache.items()), [('a', 1), ('b', [1, 2])])
+
+        del cache['a']
+        self.assertEqual(cache.pop('b'), [1, 2])
+        self.assertIsNone(cache.pop('b'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+        with self.assertRaises(KeyError):
+            del cache['a']
+
+    def test_size_is_tracked_on_overwrite(self):
+        cache = StateCache()
+        cache['a'] = 'x'
+        cache['a'] = 'x' * 1000
+        self.assertEqual(cache.size, entry_size('a', 'x' * 1000))
+
+    def test_lru_evicts_by_bytes(self):
+        capacity = 3 * entry_size('a', 'x' * 100)
+        cache = StateCache(capacity=capacity)
+
+        cache['a'] = 'x' * 100
+        cache['b'] = 'x' * 100
+        cache['c'] = 'x' * 100
+        cache.get('a')
+        cache['d'] = 'x' * 100
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertLessEqual(cache.size, capacity)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_value_larger_than_capacity_is_not_cached(self):
+        cache = StateCache(capacity=200)
+        cache['a'] = 'x' * 1000
+        self.assertNotIn('a', cache)
+
+    def test_stats(self):
+        cache = StateCache()
+        cache['a'] = 1
+        cache.get('a')
+        cache.get('b')
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+        cache.reset_stats()
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    def test_tinylfu_keeps_hot_keys_during_scan(self):
+        size = entry_size('hot0000', 1)
+        cache = StateCache(capacity=200 * size, policy='tinylfu')
+
+        hot = [f'hot{i:04d}' for i in range(50)]
+        for _ in range(5):
+            for key in hot:
+                if cache.get(key) is None:
+                    cache[key] = 1
+
+        # A scan over cold keys while the hot keys keep being read
+        for i in range(2000):
+            key = f'scan{i:04d}'
+            if cache.get(key) is None:
+                cache[key] = 1
+            hot_key = hot[i % len(hot)]
+            if cache.get(hot_key) is None:
+                cache[hot_key] = 1
+
+        cache.reset_stats()
+        for key in hot:
+            cache.get(key)
+
+        self.assertGreaterEqual(cache.hits, 45)
+        self.assertLessEqual(cache.size, cache.capacity)
+
+    def test_lru_loses_hot_keys_during_scan(self):
+        size = entry_size('hot0000', 1)
+        cache = StateCache(capacity=200 * size)
+
+        hot = [f'hot{i:04d}' for i in range(50)]
+        for key in hot:
+            cache[key] = 1
+        for i in range(2000):
+            cache[f'scan{i:04d}'] = 1
+
+        self.assertFalse(any(key in cache for key in hot))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            StateCache(policy='fifo')
+
+
+class TestFrequencySketch(unittest.TestCase):
+    def test_counts_saturate_and_age(self):
+        sketch = FrequencySketch(16)
+        for _ in range(20):
+            sketch.increment('a')
+        self.assertEqual(sketch.frequency('a'), 15)
+
+        sketch.reset()
+        self.assertEqual(sketch.frequency('a'), 7)
+
+
+class TestDriverCache(unittest.TestCase):
+    def setUp(self):
+        self.driver = Driver(cache=StateCache(capacity=1024 * 1024))
+        self.driver.flush_full()
+
+    def tearDown(self):
+        self.driver.flush_full()
+
+    def test_cache_survives_commit(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('currency.balances:jeff', 50)
+        self.driver.commit()
+
+        self.assertEqual(self.driver.cache.get('currency.balances:stu').value, 100)
+
+        self.driver.delete('currency.balances:jeff')
+        self.driver.commit()
+        self.assertIsInstance(self.driver.cache.get('currency.balances:jeff'), Miss)
+        self.assertIsNone(self.driver.get('currency.balances:jeff'))
+
+    def test_disk_reads_fill_cache(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.commit()
+        self.driver.cache.clear()
+
+        self.driver.get('currency.balances:stu')
+        self.driver.cache.reset_stats()
+        self.driver.get('currency.balances:stu')
+
+        self.assertEqual(self.driver.cache.stats()['hits'], 1)
+
+    def test_cached_containers_are_copied(self):
+        self.driver.set('currency.list', [1, 2])
+        self.driver.commit()
+
+        self.driver.get('currency.list').append(3)
+        self.assertEqual(self.driver.get('currency.list'), [1, 2])
+
+    def test_misses_are_cached_until_the_file_is_written(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.commit()
+
+        self.assertIsNone(self.driver.get('currency.balances:jeff'))
+        self.assertIsInstance(self.driver.cache.get('currency.balances:jeff'), Miss)
+
+        other = Driver()
+        other.set('currency.balances:jeff', 50)
+        other.commit()
+
+        self.assertEqual(self.driver.get('currency.balances:jeff'), 50)
+
+    def test_values_are_cached_until_the_file_is_written(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.commit()
+        self.assertEqual(self.driver.get('currency.balances:stu'), 100)
+
+        other = Driver()
+        other.set('currency.balances:stu', 200)
+        other.commit()
+
+        self.assertEqual(self.driver.get('currency.balances:stu'), 200)
+        self.assertEqual(self.driver.items('currency.balances'), {'currency.balances:stu': 200})
+
+        other.delete('currency.balances:stu')
+        other.commit()
+
+        self.assertIsNone(self.driver.get('currency.balances:stu'))
+        self.assertEqual(self.driver.items('currency.balances'), {})
+
+    def test_hard_apply_caches_deletes_as_misses(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.hard_apply(1)
+        self.assertIsInstance(self.driver.cache.get('currency.balances:stu'), Hit)
+
+        self.driver.delete('currency.balances:stu')
+        self.driver.hard_apply(2)
+
+        self.assertIsInstance(self.driver.cache.get('currency.balances:stu'), Miss)
+        self.assertIsNone(self.driver.get('currency.balances:stu'))
+
+    def test_prefix_scans_do_not_walk_the_cache(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('currency.owner', 'stu')
+        self.driver.commit()
+        self.driver.get('currency.owner')
+        self.driver.set('currency.balances:jeff', 50)
+
+        with mock.patch.object(self.driver.cache, 'items', side_effect=AssertionError('cache walked')):
+            self.assertEqual(self.driver.items('currency.balances:'),
+                             {'currency.balances:stu': 100, 'currency.balances:jeff': 50})
+            self.assertEqual(sorted(self.driver.values('currency.balances:')), [50, 100])
+
+    def test_rollback_evicts_written_keys(self):
+        self.driver.set('currency.balances:stu', 50)
+        self.driver.commit()
+        self.driver.pending_deltas[2] = {'writes': {'currency.balances:stu': (100, 50)}, 'reads': {}}
+
+        self.driver.rollback(2)
+
+        self.assertNotIn('currency.balances:stu', self.driver.cache)
+        self.assertEqual(self.driver.get('currency.balances:stu'), 50)
+
+    def test_flush_file_drops_cached_keys(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('currency_two.balances:stu', 100)
+        self.driver.commit()
+
+        self.driver.flush_file('currency')
+        self.assertIsNone(self.driver.get('currency.balances:stu'))
+        self.assertEqual(self.driver.get('currency_two.balances:stu'), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
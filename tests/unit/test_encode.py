@@ -1,5 +1,7 @@
 from unittest import TestCase
-from contracting.storage.encoder import encode, decode, safe_repr, convert_dict, MONGO_MAX_INT, MONGO_MIN_INT
+import json
+from contracting.storage.encoder import encode, decode, safe_repr, convert_dict, MONGO_MAX_INT, MONGO_MIN_INT, \
+    encode_binary, BINARY_TAG, as_object, _encode_generic
 from contracting.stdlib.bridge.time import Datetime, Timedelta
 from datetime import datetime
 from contracting.stdlib.bridge.decimal import ContractingDecimal
@@ -340,3 +342,73 @@ class TestEncode(TestCase):
         d2 = convert_dict(d)
 
         self.assertEqual(expected, d2)
+
+
+class TestBinaryEncode(TestCase):
+    VALUES = [
+        None, True, False, 0, -1, 1000, MONGO_MAX_INT + 1, MONGO_MIN_INT - 1, 2 ** 300, -(2 ** 300),
+        1.5, -0.0, '', 'hello', 'üñí\ud800', b'\x00\x01\xff',
+        ContractingDecimal('1.10'), ContractingDecimal('-0.0044997618965276'),
+        Datetime(2024, 2, 29, 13, 14, 15, 16), Timedelta(days=2, seconds=30),
+        [1, 'a', [2, [3]], {'b': None}], (1, 2),
+        {'a': 1, 'b': {'c': [ContractingDecimal('2.5'), 2 ** 70]}},
+        {1: 'int key', 1.5: 'float key', True: 'bool key', None: 'null key'},
+        {'__fixed__': '1.5'}, {'x': {'__big_int__': '12'}}, {'__time__': [2020, 1, 1]},
+    ]
+
+    def test_decodes_like_json(self):
+        for value in self.VALUES:
+            with self.subTest(value=value):
+                data = encode_binary(value)
+                self.assertTrue(data.startswith(BINARY_TAG))
+                self.assertEqual(decode(data), decode(encode(value)))
+                self.assertEqual(type(decode(data)), type(decode(encode(value))))
+
+    def test_json_still_decodes(self):
+        self.assertEqual(decode('{"__fixed__":"1.5"}'), ContractingDecimal('1.5'))
+        self.assertEqual(decode(b'[1,2]'), [1, 2])
+
+    def test_is_smaller_than_json(self):
+        value = {'balances': [ContractingDecimal('123.456')] * 10, 'owner': 'a' * 64, 'n': 2 ** 40}
+        self.assertLess(len(encode_binary(value)), len(encode(value).encode()))
+
+    def test_malformed_returns_none(self):
+        data = encode_binary(['hello', 1])
+        self.assertIsNone(decode(data[:-2]))
+        self.assertIsNone(decode(data + b'\x00'))
+        self.assertIsNone(decode(BINARY_TAG + b'\xff'))
+
+    def test_unsupported_type_raises(self):
+        with self.assertRaises(TypeError):
+            encode_binary({1, 2})
+        with self.assertRaises(TypeError):
+            encode_binary({(1, 2): 'tuple key'})
+
+
+class TestFastPaths(TestCase):
+    VALUES = [
+        0, 1, -1, 1000, MONGO_MAX_INT, MONGO_MAX_INT - 1, MONGO_MIN_INT, 2 ** 100, True, False, None,
+        '', 'hello', 'quote " backslash \\ newline \n', 'ü ', '\x7f',
+        ContractingDecimal('1.10'), ContractingDecimal('-123.0044997618965276'), ContractingDecimal('0'),
+        [], [1, 'a', None, True, ContractingDecimal('2.5'), 2 ** 70], [1.5], [[1]],
+        {}, {'a': 1, 'b': 'x', 'c': ContractingDecimal('1'), 'd': 2 ** 70, 'e': False}, {'a': [1]}, {1: 'a'},
+        {'__fixed__': '1.5'}, 1.5,
+    ]
+
+    def test_encode_matches_generic(self):
+        for value in self.VALUES:
+            with self.subTest(value=value):
+                self.assertEqual(encode(value), _encode_generic(value))
+
+    def test_decode_matches_json(self):
+        encodings = [encode(value) for value in self.VALUES] + [
+            '-0', '-', '012', '-012', '1e5', '"unterminated', '"', ' 1', '"\\u00fc"', '{"__fixed__":"1","x":"2"}',
+        ]
+        for data in encodings:
+            with self.subTest(data=data):
+                try:
+                    expected = json.loads(data, object_hook=as_object)
+                except json.decoder.JSONDecodeError:
+                    expected = None
+                self.assertEqual(decode(data), expected)
+                self.assertEqual(type(decode(data)), type(expected))
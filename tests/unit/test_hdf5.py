@@ -0,0 +1,314 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from unittest import mock
+
+from contracting.storage import hdf5
+from contracting.storage.bloom import BloomFilter
+
+
+class TestHandlePool(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.dir, 'currency')
+
+    def tearDown(self):
+        hdf5.close_all()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_handle_is_reused_between_calls(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        handle = hdf5.pool.handles[self.file_path]
+
+        hdf5.set_value_to_disk(self.file_path, 'balances/jeff', 50)
+        self.assertEqual(hdf5.get_value_from_disk(self.file_path, 'balances/stu'), 100)
+        self.assertIs(hdf5.pool.handles[self.file_path], handle)
+
+    def test_read_handle_is_upgraded_on_write(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        hdf5.close_file(self.file_path)
+
+        self.assertEqual(hdf5.get_value_from_disk(self.file_path, 'balances/stu'), 100)
+        self.assertEqual(hdf5.pool.handles[self.file_path].mode, hdf5.MODE_READ)
+
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 25)
+        self.assertNotEqual(hdf5.pool.handles[self.file_path].mode, hdf5.MODE_READ)
+        self.assertEqual(hdf5.get_value_from_disk(self.file_path, 'balances/stu'), 25)
+
+    def test_missing_file_returns_none(self):
+        self.assertIsNone(hdf5.get_value_from_disk(self.file_path, 'balances/stu'))
+        self.assertNotIn(self.file_path, hdf5.pool)
+
+    def test_least_recently_used_handle_is_evicted(self):
+        pool = hdf5.HandlePool(maxsize=2)
+        paths = [os.path.join(self.dir, name) for name in ('a', 'b', 'c')]
+
+        for path in paths:
+            with hdf5.get_file_lock(path):
+                pool.get(path, hdf5.MODE_WRITE)
+
+        self.assertEqual(len(pool), 2)
+        self.assertNotIn(paths[0], pool)
+        self.assertIn(paths[2], pool)
+
+        pool.close_all()
+
+    def test_writes_are_visible_after_close(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        hdf5.close_all()
+        self.assertEqual(hdf5.get_value_from_disk(self.file_path, 'balances/stu'), 100)
+
+
+class TestBatchWrites(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.currency = os.path.join(self.dir, 'currency')
+        self.stamps = os.path.join(self.dir, 'stamps')
+
+    def tearDown(self):
+        hdf5.close_all()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_set_values_to_disk_writes_every_file(self):
+        timings = hdf5.set_values_to_disk({
+            self.currency: {'balances/stu': (100, 5), 'balances/jeff': (50, None)},
+            self.stamps: {'rate': (20, 5)}
+        })
+
+        self.assertEqual(set(timings.keys()), {self.currency, self.stamps})
+        self.assertEqual(hdf5.get_value_from_disk(self.currency, 'balances/stu'), 100)
+        self.assertEqual(hdf5.get_value_from_disk(self.currency, 'balances/jeff'), 50)
+        self.assertEqual(hdf5.get_value_from_disk(self.stamps, 'rate'), 20)
+        self.assertEqual(hdf5.get_block(self.currency, 'balances/stu'), 5)
+        self.assertEqual(hdf5.get_block(self.currency, 'balances/jeff'), -1)
+
+    def test_none_value_deletes_key(self):
+        hdf5.set_value_to_disk(self.currency, 'balances/stu', 100)
+        hdf5.set_values_to_disk({self.currency: {'balances/stu': (None, 5)}})
+
+        self.assertIsNone(hdf5.get_value_from_disk(self.currency, 'balances/stu'))
+        self.assertIsNone(hdf5.get_block(self.currency, 'balances/stu'))
+
+    def test_files_are_written_concurrently(self):
+        batch = {
+            os.path.join(self.dir, f'con_{i}'): {'balances/stu': (i, 1)} for i in range(8)
+        }
+        timings = hdf5.set_values_to_disk(batch, max_workers=4)
+
+        self.assertEqual(list(timings.keys()), list(batch.keys()))
+        for i, file_path in enumerate(batch):
+            self.assertEqual(hdf5.get_value_from_disk(file_path, 'balances/stu'), i)
+
+    def test_given_executor_is_used_and_left_running(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            hdf5.set_values_to_disk({
+                self.currency: {'balances/stu': (100, 1)},
+                self.stamps: {'rate': (20, 1)}
+            }, executor=executor)
+
+            executor.submit(lambda: None).result()
+
+        self.assertEqual(hdf5.get_value_from_disk(self.stamps, 'rate'), 20)
+
+    def test_errors_are_aggregated(self):
+        bad_1 = os.path.join(self.dir, 'bad_1')
+        bad_2 = os.path.join(self.dir, 'bad_2')
+        os.mkdir(bad_1)
+        os.mkdir(bad_2)
+
+        with self.assertRaises(ExceptionGroup) as e:
+            hdf5.set_values_to_disk({
+                bad_1: {'x': (1, 1)},
+                self.currency: {'balances/stu': (100, 1)},
+                bad_2: {'x': (1, 1)}
+            }, max_workers=3)
+
+        self.assertEqual(len(e.exception.exceptions), 2)
+        self.assertEqual(hdf5.get_value_from_disk(self.currency, 'balances/stu'), 100)
+
+
+class TestKeyIndexes(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.dir, 'currency')
+
+    def tearDown(self):
+        hdf5.remove_file(self.file_path)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_index_is_built_from_file(self):
+        hdf5.set_values_to_disk({self.file_path: {
+            'balances/b': (2, 1), 'balances/a': (1, 1), 'balances/a/x': (3, 1), 'owner': ('stu', 1)
+        }})
+
+        self.assertNotIn(self.file_path, hdf5.key_indexes)
+        self.assertEqual(
+            hdf5.get_keys_with_prefix(self.file_path, 'balances:'),
+            ['balances:a', 'balances:a:x', 'balances:b']
+        )
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path, 'balances:', length=2), ['balances:a', 'balances:a:x'])
+
+    def test_index_holds_names_as_stored(self):
+        hdf5.set_values_to_disk({self.file_path: {'balances/z': (1, 1)}})
+        hdf5.get_keys_with_prefix(self.file_path)
+
+        # Empty hash components name the same groups as the collapsed paths
+        hdf5.set_values_to_disk({self.file_path: {'balances/a//b': (1, 1), 'balances/x/': (2, 1)}})
+        keys = hdf5.get_keys_with_prefix(self.file_path, 'balances:')
+        self.assertEqual(keys, ['balances:a:b', 'balances:x', 'balances:z'])
+
+        hdf5.key_indexes.clear()
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path, 'balances:'), keys)
+
+        hdf5.set_value_to_disk(self.file_path, 'balances/x/', None)
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path, 'balances:'), ['balances:a:b', 'balances:z'])
+
+    def test_index_is_maintained_by_writes(self):
+        hdf5.set_values_to_disk({self.file_path: {'balances/a': (1, 1)}})
+        hdf5.get_keys_with_prefix(self.file_path)
+
+        hdf5.set_values_to_disk({self.file_path: {'balances/b': (2, 1), 'balances/a': (None, 1)}})
+        hdf5.set_value_to_disk(self.file_path, 'balances/c', 3)
+        hdf5.delete_key_from_disk(self.file_path, 'balances/b')
+
+        self.assertEqual(hdf5.key_indexes[self.file_path]['balances'].keys, ['balances:c'])
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path), ['balances:c'])
+
+    def test_nested_prefix_reads_only_its_subtree(self):
+        hdf5.set_values_to_disk({self.file_path: {
+            'allowances/stu/jeff': (1, 1),
+            'allowances/stu/raghu': (2, 1),
+            'allowances/stu': (3, 1),
+            'allowances/jeff/stu': (4, 1),
+            'owner': ('stu', 1)
+        }})
+
+        self.assertEqual(
+            hdf5.get_keys_with_prefix(self.file_path, 'allowances:stu:'),
+            ['allowances:stu:jeff', 'allowances:stu:raghu']
+        )
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path, 'allowances:stu:r'), ['allowances:stu:raghu'])
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path, 'allowances:nobody:'), [])
+        self.assertEqual(hdf5.key_indexes[self.file_path], {})
+
+    def test_top_level_prefix_loads_matching_group_indexes(self):
+        hdf5.set_values_to_disk({self.file_path: {
+            'balances/a': (1, 1), 'balances2': (2, 1), 'owner': ('stu', 1)
+        }})
+
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path, 'balances'), ['balances2', 'balances:a'])
+        self.assertEqual(set(hdf5.key_indexes[self.file_path].keys()), {'balances', 'balances2'})
+
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path), ['balances2', 'balances:a', 'owner'])
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path, length=1), ['balances2'])
+
+    def test_loaded_index_serves_nested_prefix(self):
+        hdf5.set_values_to_disk({self.file_path: {'allowances/stu/jeff': (1, 1)}})
+        hdf5.get_keys_with_prefix(self.file_path, 'allowances:')
+        hdf5.set_values_to_disk({self.file_path: {'allowances/stu/raghu': (2, 1)}})
+
+        self.assertEqual(
+            hdf5.get_keys_with_prefix(self.file_path, 'allowances:stu:'),
+            ['allowances:stu:jeff', 'allowances:stu:raghu']
+        )
+
+    def test_remove_file_forgets_index(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/a', 1)
+        hdf5.get_keys_with_prefix(self.file_path)
+        hdf5.remove_file(self.file_path)
+
+        self.assertNotIn(self.file_path, hdf5.key_indexes)
+        self.assertEqual(hdf5.get_keys_with_prefix(self.file_path), [])
+
+
+class TestBloomFilters(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.dir, 'currency')
+
+    def tearDown(self):
+        hdf5.remove_file(self.file_path)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        for i in range(1000):
+            bloom.add(f'balances/{i}')
+
+        self.assertTrue(all(f'balances/{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'missing/{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertFalse(bloom.full)
+
+    def test_missing_key_does_not_open_file(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        self.assertEqual(hdf5.get_value_from_disk(self.file_path, 'balances/stu'), 100)
+
+        with mock.patch.object(hdf5.pool, 'get', side_effect=AssertionError('file opened')):
+            self.assertIsNone(hdf5.get_value_from_disk(self.file_path, 'balances/jeff'))
+            self.assertEqual(hdf5.get_values_from_disk(self.file_path, ['balances/jeff']), {'balances/jeff': None})
+
+    def test_writes_update_filter(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        self.assertTrue(hdf5.might_contain(self.file_path, 'balances/stu'))
+
+        hdf5.write_groups_to_disk(self.file_path, {'balances/jeff': (50, 1)})
+        self.assertEqual(hdf5.get_value_from_disk(self.file_path, 'balances/jeff'), 50)
+
+    def test_overwrites_do_not_fill_filter(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        hdf5.might_contain(self.file_path, 'balances/stu')
+        count = hdf5.bloom_filters[self.file_path].count
+
+        for i in range(10):
+            hdf5.set_value_to_disk(self.file_path, 'balances/stu', i)
+        self.assertEqual(hdf5.bloom_filters[self.file_path].count, count)
+
+        hdf5.get_keys_with_prefix(self.file_path, 'balances')
+        self.assertIn('balances', hdf5.key_indexes[self.file_path])
+        for i in range(10):
+            hdf5.set_value_to_disk(self.file_path, 'balances/stu', i)
+        self.assertEqual(hdf5.bloom_filters[self.file_path].count, count)
+
+        hdf5.set_value_to_disk(self.file_path, 'balances/jeff', 50)
+        self.assertEqual(hdf5.bloom_filters[self.file_path].count, count + 1)
+
+    def test_empty_hash_components_are_found(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        hdf5.might_contain(self.file_path, 'balances/stu')
+
+        groups = {'balances/a//b': (5, 1), 'balances/x/': (5, 1), 'balances//y': (5, 1)}
+        hdf5.write_groups_to_disk(self.file_path, groups)
+        self.assertEqual(hdf5.get_values_from_disk(self.file_path, list(groups)), dict.fromkeys(groups, 5))
+
+        # Rebuilt from the names HDF5 stores the groups under, as after a restart
+        hdf5.bloom_filters.clear()
+        self.assertEqual(hdf5.get_values_from_disk(self.file_path, list(groups)), dict.fromkeys(groups, 5))
+        for group_name in groups:
+            self.assertEqual(hdf5.get_value_from_disk(self.file_path, group_name), 5)
+
+    def test_full_filter_is_rebuilt(self):
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        hdf5.might_contain(self.file_path, 'balances/stu')
+        hdf5.bloom_filters[self.file_path].count = hdf5.bloom_filters[self.file_path].capacity
+
+        hdf5.set_value_to_disk(self.file_path, 'balances/jeff', 50)
+        self.assertNotIn(self.file_path, hdf5.bloom_filters)
+        self.assertEqual(hdf5.get_value_from_disk(self.file_path, 'balances/jeff'), 50)
+
+    def test_version_changes_on_write(self):
+        version = hdf5.get_file_version(self.file_path)
+        hdf5.set_value_to_disk(self.file_path, 'balances/stu', 100)
+        written = hdf5.get_file_version(self.file_path)
+        self.assertNotEqual(version, written)
+
+        hdf5.remove_file(self.file_path)
+        self.assertNotEqual(hdf5.get_file_version(self.file_path), written)
+
+
+if __name__ == '__main__':
+    unittest.main()
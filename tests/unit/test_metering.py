@@ -0,0 +1,117 @@
+from unittest import TestCase, skipUnless
+from contracting.compilation import metering
+from contracting.compilation.compiler import ContractingCompiler
+from contracting.execution.tracer import Tracer, metered
+
+CODE = '''
+def export(contract):
+    def decorate(f):
+        return f
+    return decorate
+
+@export('con_test')
+def helper(n):
+    return [i * 2 for i in range(n) if i > 0]
+
+@export('con_test')
+def work(n):
+    total = 0
+    for i in range(n):
+        if i == 3:
+            continue
+        total += i
+    i = 0
+    while i < n:
+        i += 1
+    if n > 3 and \\
+       n < 100:
+        total += sum(helper(n))
+    elif n == 2:
+        total = outside(n,
+            n)
+    else:
+        total = -1
+    assert n > -5, 'bad {}'.format(
+        total)
+    return total + len(helper(n))
+
+def spin():
+    while True:
+        pass
+
+pairs = [[a, b] for a in range(3) for b in range(a)]
+'''
+
+
+def outside(a, b):
+    return a + b
+
+
+def run(code, hooks, function=None, args=(), stamps=1000000):
+    scope = {'__contract__': True, 'outside': outside}
+    scope.update(metering.SCOPE)
+
+    tracer = Tracer()
+    tracer.set_stamp(stamps)
+    tracer.start(hooks=hooks)
+    try:
+        exec(code, scope)
+        result = scope[function](*args) if function is not None else scope['pairs']
+    except AssertionError as e:
+        result = str(e)
+    finally:
+        tracer.stop()
+
+    return result, tracer.cost, tracer.call_count
+
+
+@skipUnless(metering.INSTRUMENTABLE, 'Line events are modelled for Python 3.11')
+class TestMetering(TestCase):
+    def setUp(self):
+        self.reference, self.instrumented = metering.instrument(CODE)
+
+    def assert_charged_alike(self, *args, **kwargs):
+        traced = run(self.reference, True, *args, **kwargs)
+        self.assertEqual(run(self.instrumented, False, *args, **kwargs), traced)
+        return traced
+
+    def test_reference_is_the_code_of_the_source(self):
+        self.assertEqual(self.reference, compile(CODE, '', 'exec'))
+
+    def test_module_body_is_charged_alike(self):
+        result, cost, _ = self.assert_charged_alike()
+        self.assertEqual(result, [[1, 0], [2, 0], [2, 1]])
+        self.assertGreater(cost, 0)
+
+    def test_functions_are_charged_alike(self):
+        for n in (0, 1, 2, 3, 5, 50):
+            self.assert_charged_alike('work', (n,))
+
+    def test_failing_functions_are_charged_alike(self):
+        result, _, _ = self.assert_charged_alike('work', (-10,))
+        self.assertEqual(result, 'bad -1')
+
+    def test_running_out_of_stamps_stops_alike(self):
+        for stamps in (500, 1000, 2000, 5000):
+            result, _, _ = self.assert_charged_alike('work', (20,), stamps=stamps)
+            self.assertEqual(result, 'The cost has exceeded the stamp supplied!')
+
+        self.assert_charged_alike('spin', stamps=3000)
+
+    def test_instrumented_code_is_not_traced(self):
+        self.assertTrue(metered(self.instrumented))
+        self.assertFalse(metered(self.reference))
+        self.assertEqual(run(self.instrumented, True, 'work', (5,)), run(self.reference, True, 'work', (5,)))
+
+    def test_code_that_cannot_be_instrumented_is_refused(self):
+        self.assertIsNone(metering.instrument('f = lambda x: x\n'))
+        self.assertIsNone(metering.instrument('try:\n    x = 1\nexcept Exception:\n    x = 2\n'))
+
+    def test_compiler_compiles_contracts_metered(self):
+        source = 'v = Variable()\n\n@export\ndef get():\n    return v.get()\n'
+        compiler = ContractingCompiler(module_name='con_test')
+
+        code = compiler.compile_metered(source)
+
+        self.assertTrue(metered(code))
+        self.assertIs(code, metering.instrument(compiler.parse_to_code(source))[1])
@@ -1,8 +1,10 @@
 import unittest
 import os
+from unittest import mock
 from shutil import rmtree
 from datetime import datetime
 from contracting.storage.driver import Driver
+from contracting.storage import hdf5
 
 class TestDriver(unittest.TestCase):
 
@@ -23,6 +25,19 @@ class TestDriver(unittest.TestCase):
         retrieved_value = self.driver.get(key)
         self.assertEqual(retrieved_value, value)
 
+    def test_empty_hash_components_survive_restart(self):
+        keys = ['con.h:a::b', 'con.h:x:', 'con.h::y']
+        for key in keys:
+            self.driver.set(key, 5)
+        self.driver.commit()
+
+        # A restarted node starts without filters, indexes or cached values
+        hdf5.bloom_filters.clear()
+        hdf5.key_indexes.clear()
+        self.driver.flush_cache()
+
+        self.assertEqual([self.driver.get(key) for key in keys], [5, 5, 5])
+
     def test_find(self):
         key = 'test_key'
         value = 'test_value'
@@ -97,6 +112,147 @@ class TestDriver(unittest.TestCase):
         retrieved_value = self.driver.get(key)
         self.assertEqual(retrieved_value, value)
 
+    def test_get_many(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('stamps.rate', 20)
+        self.driver.commit()
+        self.driver.cache.clear()
+        self.driver.set('currency.balances:jeff', 50)
+
+        values = self.driver.get_many(['stamps.rate', 'currency.balances:jeff', 'currency.balances:stu', 'currency.x'])
+        self.assertEqual(list(values.items()), [
+            ('stamps.rate', 20),
+            ('currency.balances:jeff', 50),
+            ('currency.balances:stu', 100),
+            ('currency.x', None),
+        ])
+        self.assertEqual(self.driver.pending_reads['currency.balances:stu'], 100)
+        self.assertEqual(self.driver.cache.get('stamps.rate').value, 20)
+
+    def test_commit_reuses_encoding_from_set(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('currency.owner', 'stu')
+        self.driver.set('currency.list', [1, 2])
+        self.driver.get('currency.list').append(3)
+
+        with mock.patch.object(hdf5, 'encode', wraps=hdf5.encode) as encode:
+            self.driver.commit()
+
+        # Only the mutable list is encoded again, and it is stored with the append
+        encode.assert_called_once_with([1, 2, 3])
+        self.assertEqual(self.driver.value_from_disk('currency.balances:stu'), 100)
+        self.assertEqual(self.driver.value_from_disk('currency.owner'), 'stu')
+        self.assertEqual(self.driver.value_from_disk('currency.list'), [1, 2, 3])
+        self.assertFalse(self.driver.pending_encoded)
+
+    def test_replaced_write_is_encoded_again(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.pending_writes['currency.balances:stu'] = 200
+        self.driver.set('currency.rate', 1.5)
+
+        self.driver.hard_apply(1)
+
+        self.assertEqual(self.driver.value_from_disk('currency.balances:stu'), 200)
+        self.assertEqual(self.driver.value_from_disk('currency.rate'), 1.5)
+
+    def test_revert_transaction(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('currency.list', [1])
+
+        self.driver.begin_transaction()
+        self.driver.set('currency.balances:stu', 50)
+        self.driver.set('currency.balances:jeff', 50)
+        self.driver.get('currency.list').append(2)
+        self.driver.revert_transaction()
+
+        self.assertEqual(self.driver.pending_writes, {'currency.balances:stu': 100, 'currency.list': [1]})
+        self.assertEqual(self.driver.journal, [])
+
+    def test_end_transaction_keeps_writes(self):
+        self.driver.set('currency.list', [1])
+
+        self.driver.begin_transaction()
+        self.driver.get('currency.list').append(2)
+        self.driver.set('currency.balances:stu', 50)
+        self.driver.end_transaction()
+        self.driver.revert_transaction()
+
+        self.assertEqual(self.driver.pending_writes, {'currency.list': [1, 2], 'currency.balances:stu': 50})
+
+    def test_rollback_to_nested_savepoint(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('currency.list', [1])
+
+        outer = self.driver.savepoint()
+        self.driver.set('currency.balances:stu', 90, is_txn_write=True)
+        self.driver.log_events.append({'event': 'outer'})
+
+        inner = self.driver.savepoint()
+        self.driver.set('currency.balances:stu', 80, is_txn_write=True)
+        self.driver.set('currency.balances:jeff', 20, is_txn_write=True)
+        self.driver.get('currency.list').append(2)
+        self.driver.log_events.append({'event': 'inner'})
+        self.driver.rollback_to(inner)
+
+        self.assertEqual(self.driver.pending_writes, {'currency.balances:stu': 90, 'currency.list': [1]})
+        self.assertEqual(self.driver.transaction_writes, {'currency.balances:stu': 90})
+        self.assertEqual(self.driver.log_events, [{'event': 'outer'}])
+
+        # The savepoint stays open after a rollback
+        self.driver.set('currency.balances:jeff', 30)
+        self.driver.rollback_to(inner)
+        self.assertNotIn('currency.balances:jeff', self.driver.pending_writes)
+
+        self.driver.rollback_to(outer)
+        self.assertEqual(self.driver.pending_writes, {'currency.balances:stu': 100, 'currency.list': [1]})
+        self.assertEqual(self.driver.transaction_writes, {})
+        self.assertEqual(self.driver.log_events, [])
+        self.assertEqual(len(self.driver.journal), 1)
+
+    def test_released_savepoint_is_undone_by_its_parent(self):
+        self.driver.set('currency.balances:stu', 100)
+
+        outer = self.driver.savepoint()
+        self.driver.set('currency.balances:stu', 90)
+        inner = self.driver.savepoint()
+        self.driver.set('currency.balances:stu', 80)
+        self.driver.set('currency.balances:jeff', 20)
+        self.driver.release(inner)
+
+        self.assertEqual(self.driver.pending_writes['currency.balances:stu'], 80)
+        self.assertEqual(len(self.driver.journal), 1)
+
+        self.driver.rollback_to(outer)
+        self.assertEqual(self.driver.pending_writes, {'currency.balances:stu': 100})
+
+        with self.assertRaises(AssertionError):
+            self.driver.release(inner)
+
+    def test_commit_groups_writes_by_file(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.set('currency.balances:jeff', 50)
+        self.driver.set('stamps.rate', 20)
+        timings = self.driver.commit()
+        self.assertEqual(len(timings), 2)
+        self.assertEqual(self.driver.get('currency.balances:stu'), 100)
+        self.assertEqual(self.driver.get('stamps.rate'), 20)
+
+    def test_commit_with_workers(self):
+        for i in range(4):
+            self.driver.set(f'con_{i}.balances:stu', i)
+        timings = self.driver.commit(max_workers=4)
+        self.assertEqual(len(timings), 4)
+        for i in range(4):
+            self.assertEqual(self.driver.value_from_disk(f'con_{i}.balances:stu'), i)
+
+    def test_hard_apply_applies_latest_delta(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.hard_apply(1)
+        self.driver.set('currency.balances:stu', 75)
+        self.driver.hard_apply(2)
+        self.assertEqual(self.driver.value_from_disk('currency.balances:stu'), 75)
+        self.assertFalse(self.driver.pending_deltas)
+
     def test_get_all_contract_state(self):
         key = 'contract.key'
         value = 'contract_value'
@@ -501,6 +501,45 @@ class TestHash(TestCase):
         # we care about whats included, not order
         self.assertSetEqual(set(hsh.all(1, 0)), set(l))
 
+    def test_multihash_all_reads_committed_values(self):
+        hsh = Hash('blah', 'scoob', driver=driver, default_value=0)
+
+        hsh[1, 0, '1'] = 123
+        hsh[1, 0, '2'] = 456
+        hsh[1, 1, '1'] = 999
+        hsh[2, 0, '1'] = 888
+
+        driver.commit()
+
+        self.assertSetEqual(set(hsh.all(1, 0)), {123, 456})
+        self.assertSetEqual(set(hsh.all(1)), {123, 456, 999})
+        self.assertSetEqual(set(hsh.all()), {123, 456, 999, 888})
+
+    def test_get_many(self):
+        hsh = Hash('blah', 'scoob', driver=driver, default_value=0)
+        hsh['stu'] = 100
+        hsh['stu', 'jeff'] = 1.5
+        driver.commit()
+
+        self.assertEqual(hsh.get_many(['stu', ('stu', 'jeff'), 'tejas']), [100, ContractingDecimal('1.5'), 0])
+
+        with self.assertRaises(AssertionError):
+            hsh.get_many(['a:b'])
+
+    def test_clear_committed_multihash_hides_deleted_keys(self):
+        hsh = Hash('blah', 'scoob', driver=driver, default_value=0)
+
+        hsh[1, 0, '1'] = 123
+        hsh[1, 1, '1'] = 999
+
+        driver.commit()
+
+        hsh.clear(1, 1)
+        self.assertDictEqual(hsh._items(1), {'blah.scoob:1:0:1': 123})
+
+        driver.commit()
+        self.assertDictEqual(hsh._items(1), {'blah.scoob:1:0:1': 123})
+
     def test_clear_items_deletes_all_key_value_pairs(self):
         contract = 'blah'
         name = 'scoob'
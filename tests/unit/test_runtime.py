@@ -137,4 +137,26 @@ class TestRuntime(TestCase):
         with self.assertRaises(AssertionError):
             runtime.rt.deduct_write('a', 'b' * 32 * 1024)
 
-        runtime.rt.clean_up()
\ No newline at end of file
+        runtime.rt.clean_up()
+
+    def test_methods_can_be_called_on_the_class(self):
+        runtime.Runtime.deduct_write(b'a', b'b')
+        runtime.Runtime.clean_up()
+
+        self.assertEqual(runtime.rt.writes, 0)
+
+    def test_setting_a_class_attribute_sets_the_context_state(self):
+        runtime.Runtime.env = {'block_num': 1}
+
+        self.assertIsInstance(runtime.Runtime.__dict__['env'], runtime.ExecutionState)
+        self.assertEqual(runtime.rt.env, {'block_num': 1})
+
+    def test_seeded_is_backed_by_the_runtime(self):
+        from contracting.stdlib.bridge.random import Seeded
+
+        Seeded.s = True
+        self.assertTrue(runtime.rt.seeded)
+
+        runtime.rt.clean_up()
+        self.assertFalse(Seeded.s)
+
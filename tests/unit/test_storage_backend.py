@@ -0,0 +1,171 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from contracting.storage import hdf5
+from contracting.storage.backend import HDF5Backend, parse_key, unparse_key
+from contracting.storage.sqlite import SQLiteBackend
+from contracting.storage.index import KeyIndex, prefix_upper_bound
+from contracting.storage.driver import Driver
+from contracting.storage.orm import Hash
+
+
+class BackendTests:
+    """
+    Tests every StorageBackend implementation has to pass. Subclasses provide make_backend.
+    """
+
+    def make_backend(self, storage_home):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = self.make_backend(os.path.join(self.dir, 'state'))
+
+    def tearDown(self):
+        hdf5.close_all()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_set_many_and_get(self):
+        self.backend.set_many({'currency.balances:stu': 100, 'currency.owner': 'stu'})
+        self.assertEqual(self.backend.get('currency.balances:stu'), 100)
+        self.assertEqual(self.backend.get('currency.owner'), 'stu')
+        self.assertIsNone(self.backend.get('currency.balances:jeff'))
+
+    def test_get_many(self):
+        self.backend.set_many({'currency.balances:stu': 100, 'stamps.rate': 20})
+        values = self.backend.get_many(['currency.balances:stu', 'stamps.rate', 'currency.balances:jeff'])
+        self.assertEqual(values, {'currency.balances:stu': 100, 'stamps.rate': 20, 'currency.balances:jeff': None})
+
+    def test_none_value_and_delete_many_delete(self):
+        self.backend.set_many({'currency.balances:stu': 100, 'currency.balances:jeff': 50})
+        self.backend.set_many({'currency.balances:stu': None})
+        self.backend.delete_many(['currency.balances:jeff'])
+        self.assertIsNone(self.backend.get('currency.balances:stu'))
+        self.assertIsNone(self.backend.get('currency.balances:jeff'))
+        self.assertEqual(self.backend.iter_prefix('currency.'), [])
+
+    def test_iter_prefix_is_sorted_and_limited(self):
+        self.backend.set_many({
+            'currency.balances:b': 2,
+            'currency.balances:a': 1,
+            'currency.balances:a:x': 3,
+            'currency.owner': 'stu',
+            'currency_two.balances:a': 4,
+        })
+        self.assertEqual(
+            self.backend.iter_prefix('currency.balances:'),
+            ['currency.balances:a', 'currency.balances:a:x', 'currency.balances:b']
+        )
+        self.assertEqual(self.backend.iter_prefix('currency.balances:a:'), ['currency.balances:a:x'])
+        self.assertEqual(self.backend.iter_prefix('currency.balances:', length=1), ['currency.balances:a'])
+        self.assertEqual(len(self.backend.iter_prefix('currency')), 5)
+
+    def test_names_exists_and_drop(self):
+        self.backend.set_many({'currency.balances:stu': 100, '__run.height': 5})
+        self.assertEqual(self.backend.names(), ['__run', 'currency'])
+        self.assertTrue(self.backend.exists('currency'))
+
+        self.backend.drop('currency')
+        self.assertFalse(self.backend.exists('currency'))
+        self.assertIsNone(self.backend.get('currency.balances:stu'))
+        self.assertEqual(self.backend.get('__run.height'), 5)
+
+    def test_flush(self):
+        self.backend.set_many({'currency.balances:stu': 100})
+        self.backend.flush()
+        self.assertEqual(self.backend.names(), [])
+
+    def test_snapshot_is_independent_copy(self):
+        self.backend.set_many({'currency.balances:stu': 100})
+        snapshot = self.backend.snapshot(os.path.join(self.dir, 'snapshot'))
+        self.backend.set_many({'currency.balances:stu': 50})
+
+        self.assertEqual(snapshot.get('currency.balances:stu'), 100)
+        self.assertEqual(self.backend.get('currency.balances:stu'), 50)
+
+    def test_driver_on_backend(self):
+        driver = Driver(backend=self.backend)
+        balances = Hash('currency', 'balances', driver=driver)
+        balances['stu'] = 100
+        balances['stu', 'jeff'] = 10
+        driver.commit()
+
+        self.assertEqual(driver.get('currency.balances:stu'), 100)
+        self.assertEqual(sorted(balances.all()), [10, 100])
+        self.assertEqual(driver.get_all_contract_state(), {'currency.balances:stu': 100, 'currency.balances:stu:jeff': 10})
+
+
+class TestHDF5Backend(BackendTests, unittest.TestCase):
+    def make_backend(self, storage_home):
+        return HDF5Backend(storage_home)
+
+
+class TestSQLiteBackend(BackendTests, unittest.TestCase):
+    def make_backend(self, storage_home):
+        return SQLiteBackend(storage_home)
+
+    def tearDown(self):
+        self.backend.close()
+        super().tearDown()
+
+
+class TestHDF5BinaryBackend(BackendTests, unittest.TestCase):
+    def make_backend(self, storage_home):
+        return HDF5Backend(storage_home, binary=True)
+
+    def test_reads_json_values(self):
+        HDF5Backend(self.backend.storage_home).set_many({'currency.balances:stu': 100})
+        self.backend.set_many({'currency.balances:jeff': b'\x00\x01'})
+        self.assertEqual(
+            self.backend.get_many(['currency.balances:stu', 'currency.balances:jeff']),
+            {'currency.balances:stu': 100, 'currency.balances:jeff': b'\x00\x01'}
+        )
+
+
+class TestSQLiteBinaryBackend(BackendTests, unittest.TestCase):
+    def make_backend(self, storage_home):
+        return SQLiteBackend(storage_home, binary=True)
+
+    def tearDown(self):
+        self.backend.close()
+        super().tearDown()
+
+
+class TestKeyParsing(unittest.TestCase):
+    def test_parse_key(self):
+        self.assertEqual(parse_key('currency.balances:stu:jeff'), ('currency', 'balances/stu/jeff'))
+        self.assertEqual(parse_key('test_key'), ('test_key', 'test_key'))
+
+    def test_unparse_key_inverts_parse_key(self):
+        for key in ('currency.balances:stu:jeff', 'currency.__code__', 'test_key'):
+            self.assertEqual(unparse_key(*parse_key(key)), key)
+
+
+class TestKeyIndex(unittest.TestCase):
+    def test_add_and_remove_keep_order(self):
+        index = KeyIndex(['b', 'a'])
+        index.add('c')
+        index.add('a')
+        index.remove('b')
+        index.remove('x')
+        self.assertEqual(index.keys, ['a', 'c'])
+        self.assertIn('c', index)
+        self.assertNotIn('b', index)
+
+    def test_prefix(self):
+        index = KeyIndex(['balances:a', 'balances:a:x', 'balances:b', 'balancesx', 'owner'])
+        self.assertEqual(index.prefix('balances:'), ['balances:a', 'balances:a:x', 'balances:b'])
+        self.assertEqual(index.prefix('balances:', length=1), ['balances:a'])
+        self.assertEqual(index.prefix('z'), [])
+        self.assertEqual(len(index.prefix()), 5)
+
+    def test_prefix_upper_bound(self):
+        self.assertEqual(prefix_upper_bound('currency.'), 'currency/')
+        self.assertEqual(prefix_upper_bound('a\U0010ffff'), 'b')
+        self.assertIsNone(prefix_upper_bound(''))
+
+
+if __name__ == '__main__':
+    unittest.main()
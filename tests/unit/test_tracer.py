@@ -0,0 +1,221 @@
+from unittest import TestCase, mock, skipUnless
+from contracting.execution import tracer
+from contracting.execution.tracer import Tracer, COST_TABLES, cost_table, cu_costs, prepare
+from types import CodeType
+
+import dis
+import threading
+import tracemalloc
+
+CODE = '''
+def helper(n):
+    return [i * 2 for i in range(n)]
+
+def work(n):
+    total = 0
+    for i in range(n):
+        total += i
+    i = 0
+    while i < n: i += 1
+    if n > 3:
+        total += sum(helper(n))
+    return total + len(outside(n))
+
+def spin():
+    while True:
+        pass
+
+def allocate(n):
+    data = 'x' * n
+    return len(data)
+'''
+
+
+def outside(n):
+    # Not contract code, so not charged
+    return {i: i for i in range(n)}
+
+
+def contract(code=CODE):
+    scope = {'__contract__': True, 'outside': outside}
+    exec(compile(code, '<contract>', 'exec'), scope)
+    return scope
+
+
+class TestTracer(TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def tearDown(self):
+        self.tracer.stop()
+
+    def run_metered(self, func, *args, stamps=1000000, rule=tracer.COUNT_ALL_LINES):
+        self.tracer.set_stamp(stamps)
+        self.tracer.call_count_rule = rule
+        self.tracer.start()
+        try:
+            return func(*args)
+        finally:
+            self.tracer.stop()
+
+    def test_contract_lines_are_charged(self):
+        scope = contract()
+
+        self.assertEqual(self.run_metered(scope['work'], 5), 35)
+        self.assertGreater(self.tracer.cost, 0)
+        self.assertGreater(self.tracer.call_count, 0)
+
+    def test_code_outside_contracts_is_not_charged(self):
+        self.run_metered(outside, 100)
+
+        self.assertEqual(self.tracer.cost, 0)
+        self.assertGreater(self.tracer.call_count, 0)
+
+        self.run_metered(outside, 100, rule=tracer.COUNT_CONTRACT_LINES)
+
+        self.assertEqual(self.tracer.cost, 0)
+        self.assertEqual(self.tracer.call_count, 0)
+
+    def test_guard_counts_lines_outside_contracts_by_default(self):
+        scope = contract()
+        self.tracer.max_call_count = 1000
+
+        # Charging ten lines of contract code runs far more lines outside it
+        scope['outside'] = lambda n: list(outside(n * 1000))
+        with self.assertRaisesRegex(AssertionError, 'Call count exceeded'):
+            self.run_metered(scope['work'], 1)
+
+        self.run_metered(scope['work'], 1, rule=tracer.COUNT_CONTRACT_LINES)
+        self.assertLess(self.tracer.call_count, 1000)
+
+    def test_guard_does_not_count_the_tracer(self):
+        self.run_metered(tracer.meter, 0, rule=tracer.COUNT_ALL_LINES)
+        self.assertEqual(self.tracer.call_count, 1)
+
+    def test_cost_does_not_depend_on_code_outside_contracts(self):
+        scope = contract()
+        self.run_metered(scope['work'], 5)
+        cost = self.tracer.cost
+
+        scope['outside'] = lambda n: list(outside(n * 100))
+        self.run_metered(scope['work'], 5)
+
+        self.assertEqual(self.tracer.cost, cost)
+
+    def test_infinite_loop_runs_out_of_stamps(self):
+        scope = contract()
+
+        with self.assertRaises(AssertionError):
+            self.run_metered(scope['spin'], stamps=3000)
+
+        self.assertFalse(self.tracer.is_started())
+        self.assertGreater(self.tracer.cost, 3000)
+
+    def test_memory_is_measured(self):
+        scope = contract()
+        self.run_metered(scope['allocate'], 100000)
+
+        self.assertGreater(self.tracer.get_total_mem_usage(), 100000)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_memory_cap(self):
+        scope = contract()
+        self.tracer = Tracer(max_memory=1024 * 1024)
+
+        self.run_metered(scope['allocate'], 100)
+
+        with self.assertRaisesRegex(AssertionError, 'memory usage'):
+            self.run_metered(scope['allocate'], 2 * 1024 * 1024)
+
+        self.assertFalse(self.tracer.is_started())
+
+    def test_memory_is_metered_in_one_thread_at_a_time(self):
+        other = Tracer()
+        started = threading.Event()
+
+        def run():
+            other.start(hooks=False)
+            started.set()
+            other.stop()
+
+        self.tracer.start(hooks=False)
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        self.assertFalse(started.wait(0.2))
+
+        self.tracer.stop()
+        thread.join()
+        self.assertTrue(started.is_set())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_tracer_without_memory_does_not_wait(self):
+        scope = contract()
+        other = Tracer(max_memory=1024)
+        outputs = []
+
+        def run():
+            other.set_stamp(1000000)
+            other.start(memory=False)
+            try:
+                outputs.append(scope['allocate'](1024 * 1024))
+            finally:
+                other.stop()
+
+        self.tracer.start(hooks=False)
+        try:
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join(5)
+        finally:
+            self.tracer.stop()
+
+        self.assertEqual(outputs, [1024 * 1024])
+        self.assertGreater(other.cost, 0)
+        self.assertEqual(other.get_total_mem_usage(), 0)
+
+    def test_stopped_tracer_does_not_charge(self):
+        scope = contract()
+        self.run_metered(scope['work'], 5)
+        cost = self.tracer.cost
+
+        scope['work'](5)
+
+        self.assertEqual(self.tracer.cost, cost)
+
+    @skipUnless(tracer.MONITORING, 'sys.monitoring needs Python 3.12')
+    def test_monitoring_charges_like_settrace(self):
+        scope = contract()
+        costs = []
+
+        for monitoring in (False, True):
+            with mock.patch.object(tracer, 'MONITORING', monitoring):
+                self.tracer = Tracer()
+                self.run_metered(scope['work'], 7)
+                costs.append((self.tracer.cost, self.tracer.call_count))
+                with self.assertRaises(AssertionError):
+                    self.run_metered(scope['spin'], stamps=500)
+                costs.append((self.tracer.cost, self.tracer.call_count))
+                self.assertEqual(self.tracer.monitoring, monitoring)
+
+        self.assertEqual(costs[:2], costs[2:])
+
+
+class TestCostTables(TestCase):
+    def test_cost_table_follows_opcode_costs(self):
+        code = contract()['work'].__code__
+        costs = cost_table(code)
+
+        for instruction in dis.get_instructions(code):
+            self.assertEqual(costs[instruction.offset // 2], cu_costs.get(instruction.opcode, 1))
+
+        self.assertIs(cost_table(code), costs)
+
+    def test_prepare_builds_tables_of_nested_code(self):
+        code = compile(CODE, '<contract>', 'exec')
+        prepare(code)
+
+        functions = [const for const in code.co_consts if isinstance(const, CodeType)]
+        self.assertEqual(len(functions), 4)
+        for function in [code] + functions:
+            self.assertIn(function, COST_TABLES)
@@ -0,0 +1,184 @@
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+from contracting.storage import hdf5
+from contracting.storage.backend import HDF5Backend
+from contracting.storage.driver import Driver
+from contracting.storage.wal import WriteAheadLog
+from contracting.stdlib.bridge.decimal import ContractingDecimal
+
+
+class TestWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = HDF5Backend(os.path.join(self.dir, 'state'))
+        self.wal = WriteAheadLog(os.path.join(self.dir, 'wal'))
+
+    def tearDown(self):
+        self.wal.stop()
+        hdf5.close_all()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_append_is_served_until_checkpoint(self):
+        self.wal.append(1, {'currency.balances:stu': 100, 'currency.balances:jeff': None})
+
+        self.assertEqual(self.wal.get('currency.balances:stu'), 100)
+        self.assertIsNone(self.backend.get('currency.balances:stu'))
+        self.assertEqual(len(self.wal.segments()), 1)
+
+        self.wal.checkpoint(self.backend)
+
+        self.assertEqual(self.backend.get('currency.balances:stu'), 100)
+        self.assertIsNone(self.wal.get('currency.balances:stu'))
+        self.assertEqual(self.wal.segments(), [])
+
+    def test_recover_replays_records_in_order(self):
+        self.wal.append(1, {'currency.balances:stu': 100, 'currency.owner': 'stu'})
+        self.wal.append(2, {'currency.balances:stu': ContractingDecimal('1.5'), 'currency.owner': None})
+        self.wal.stop()
+
+        # A new log on the same directory, as after a restart
+        WriteAheadLog(self.wal.directory).recover(self.backend)
+
+        self.assertEqual(self.backend.get('currency.balances:stu'), ContractingDecimal('1.5'))
+        self.assertIsNone(self.backend.get('currency.owner'))
+        self.assertEqual(self.wal.segments(), [])
+
+    def test_recover_stops_at_torn_record(self):
+        self.wal.append(1, {'currency.balances:stu': 100})
+        self.wal.append(2, {'currency.balances:stu': 200})
+        self.wal.stop()
+
+        segment = self.wal.segments()[0]
+        with open(segment, 'r+b') as f:
+            f.truncate(os.path.getsize(segment) - 3)
+
+        WriteAheadLog(self.wal.directory).recover(self.backend)
+
+        self.assertEqual(self.backend.get('currency.balances:stu'), 100)
+
+    def test_write_after_checkpoint_started_stays_pending(self):
+        self.wal.append(1, {'currency.balances:stu': 100})
+
+        class SlowBackend:
+            def set_many(inner, writes, block_num=None):
+                self.wal.append(2, {'currency.balances:stu': 200})
+                self.backend.set_many(writes, block_num=block_num)
+
+        self.wal.checkpoint(SlowBackend())
+
+        self.assertEqual(self.wal.get('currency.balances:stu'), 200)
+        self.assertEqual(len(self.wal.segments()), 1)
+
+    def test_background_checkpoint(self):
+        self.wal.interval = 0.01
+        self.wal.start(self.backend)
+        self.wal.append(1, {'currency.balances:stu': 100})
+
+        deadline = time.time() + 5
+        while self.wal.segments() and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.wal.stop()
+        self.assertEqual(self.backend.get('currency.balances:stu'), 100)
+        self.assertIsNone(self.wal.last_error)
+
+    def test_background_checkpoint_failure_is_logged(self):
+        class FailingBackend:
+            def set_many(self, writes, block_num=None):
+                raise OSError('disk full')
+
+        self.wal.interval = 0.01
+        self.wal.append(1, {'currency.balances:stu': 100})
+
+        with self.assertLogs('contracting.storage.wal', level='ERROR') as logs:
+            self.wal.start(FailingBackend())
+            deadline = time.time() + 5
+            while self.wal.last_error is None and time.time() < deadline:
+                time.sleep(0.01)
+            self.wal.stop()
+
+        self.assertIn('disk full', logs.output[0])
+        self.assertEqual(self.wal.get('currency.balances:stu'), 100)
+        self.assertEqual(len(self.wal.segments()), 1)
+
+
+class TestDriverWithWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = HDF5Backend(os.path.join(self.dir, 'state'))
+        self.wal_dir = os.path.join(self.dir, 'wal')
+        # A long interval keeps the background thread out of the way
+        self.driver = Driver(backend=self.backend, wal=WriteAheadLog(self.wal_dir, interval=3600))
+
+    def tearDown(self):
+        self.driver.close()
+        hdf5.close_all()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_hard_apply_appends_to_log(self):
+        self.driver.set('currency.balances:stu', 100)
+        timings = self.driver.hard_apply(1)
+
+        self.assertEqual(list(timings), [self.wal_dir])
+        self.assertIsNone(self.backend.get('currency.balances:stu'))
+
+        self.driver.cache.clear()
+        self.assertEqual(self.driver.get('currency.balances:stu'), 100)
+
+        self.driver.checkpoint()
+        self.assertEqual(self.backend.get('currency.balances:stu'), 100)
+
+    def test_logged_delete_hides_disk_value(self):
+        self.backend.set_many({'currency.balances:stu': 100, 'currency.balances:jeff': 50})
+
+        self.driver.delete('currency.balances:stu')
+        self.driver.set('currency.balances:tejas', 10)
+        self.driver.hard_apply(1)
+        self.driver.cache.clear()
+
+        self.assertIsNone(self.driver.get('currency.balances:stu'))
+        self.assertEqual(
+            self.driver.items('currency.balances:'),
+            {'currency.balances:jeff': 50, 'currency.balances:tejas': 10}
+        )
+
+    def test_restart_replays_log(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.hard_apply(1)
+
+        # Simulate a crash: the background thread dies without a final checkpoint
+        self.driver.wal.stop()
+
+        driver = Driver(backend=self.backend, wal=WriteAheadLog(self.wal_dir, interval=3600))
+        self.assertEqual(self.backend.get('currency.balances:stu'), 100)
+        self.assertEqual(driver.get('currency.balances:stu'), 100)
+        driver.close()
+
+    def test_commit_and_full_state_apply_log_first(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.hard_apply(1)
+        self.assertEqual(self.driver.get_all_contract_state(), {'currency.balances:stu': 100})
+
+        self.driver.set('currency.balances:stu', 50)
+        self.driver.hard_apply(2)
+        self.driver.set('currency.balances:stu', 25)
+        self.driver.commit()
+
+        self.assertEqual(self.backend.get('currency.balances:stu'), 25)
+        self.assertEqual(self.driver.wal.segments(), [])
+
+    def test_flush_drops_log(self):
+        self.driver.set('currency.balances:stu', 100)
+        self.driver.hard_apply(1)
+        self.driver.flush_full()
+
+        self.assertIsNone(self.driver.get('currency.balances:stu'))
+        self.assertEqual(self.driver.wal.segments(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()